@@ -3,6 +3,34 @@ ASGI config for GeoMemories project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The map and feed JSON endpoints are async views and the live map stream
+(core.views.post_events_api) keeps one connection open per map, so the
+site is meant to be served by uvicorn:
+
+    uvicorn GeoMemories.asgi:application --host 0.0.0.0 --port 8000 \
+        --workers 1 --timeout-keep-alive 5
+
+Keep --workers at 1. With the default settings the map tile versions,
+friend graphs and fragment versions live in a per-process LocMemCache, and
+live map events are published in process memory (core.events). With
+--workers N > 1 a change only invalidates the caches of the process that
+handled it, and only the maps connected to that process hear about it.
+Pointing CACHE_BACKEND at a shared cache (Redis, Memcached) fixes the
+caches, but core.events has no cross-process transport, so the live map
+stays single-process either way. One event loop serves many concurrent
+requests anyway: a waiting request costs a coroutine, not a worker.
+ASGI_THREADS caps the thread pool the ORM and the remaining sync views run
+on (the async ORM still runs sync database calls there).
+
+To compare against the WSGI setup, start each server in turn and run the
+same load against it. Run gunicorn with a shared CACHE_BACKEND when it has
+several workers (gunicorn GeoMemories.wsgi:application --workers 4), or
+with --workers 1 like uvicorn to compare one process against another:
+
+    python manage.py loadtest --concurrency 32 --duration 15 \
+        "http://127.0.0.1:8000/api/posts/nearby/?lat=24.8&lon=120.96&k=20" \
+        "http://127.0.0.1:8000/api/tiles/14/13697/7026/"
+
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 """
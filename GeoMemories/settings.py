@@ -58,14 +58,16 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'core.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.middleware.ProfilingMiddleware',
 ]
 
 MEDIA_URL = '/media/'
@@ -105,6 +107,79 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Map tile versions, fragment versions and the friend graph live here. With
+# several gunicorn or uvicorn workers point this at a backend shared between
+# processes (e.g. FileBasedCache or Redis), otherwise each worker keeps its
+# own copy and a change only invalidates the copy of the worker that made
+# it. Until FRIEND_GRAPH_TIMEOUT runs out, the other workers keep showing
+# the posts of a removed friend in feeds and timelines.
+# MAX_ENTRIES bounds memory, the backend culls old entries past it.
+
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='geomemories'),
+        'OPTIONS': {
+            'MAX_ENTRIES': config('CACHE_MAX_ENTRIES', default=10000, cast=int),
+        },
+    }
+}
+
+# Seconds a cached friend graph is trusted. Short with the per-process
+# default cache, see above.
+FRIEND_GRAPH_TIMEOUT = config(
+    'FRIEND_GRAPH_TIMEOUT', cast=int,
+    default=5 * 60 if CACHES['default']['BACKEND'].endswith('.LocMemCache') else 60 * 60,
+)
+
+
+# Home feed timeline
+# When enabled, new posts are copied into their readers' timelines at write
+# time (core.timeline). Run `manage.py backfill_timeline` after turning it on.
+
+TIMELINE_ENABLED = config('TIMELINE_ENABLED', default=False, cast=bool)
+
+
+# Background jobs
+# Jobs queued by core.jobs are run by `manage.py run_jobs`. Set JOBS_RUN_SYNC
+# to run them in the web process instead (tests, or no worker deployed).
+
+JOBS_RUN_SYNC = config('JOBS_RUN_SYNC', default=False, cast=bool)
+
+
+# Request performance
+# core.middleware.PerformanceMiddleware measures this share of requests (0 to
+# 1) and logs them to "core.performance" at PERF_LOG_LEVEL. It is off by
+# default, e.g. 0.05 measures one request in twenty. Use WARNING to only log
+# views that repeat a query (N+1).
+
+PERF_SAMPLE_RATE = config('PERF_SAMPLE_RATE', default=0.0, cast=float)
+
+# Staff requests with ?profile=1 or an X-Profile header are profiled by
+# core.middleware.ProfilingMiddleware. Only the newest PROFILE_MAX_COUNT
+# profiles are kept in PROFILE_DIR.
+
+PROFILE_DIR = config('PROFILE_DIR', default=os.path.join(BASE_DIR, 'profiles'))
+PROFILE_MAX_COUNT = config('PROFILE_MAX_COUNT', default=20, cast=int)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'core.performance': {
+            'handlers': ['console'],
+            'level': config('PERF_LOG_LEVEL', default='INFO'),
+            'propagate': False,
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
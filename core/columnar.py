@@ -0,0 +1,84 @@
+"""
+Compact columnar encoding of map pins.
+
+The default map payload is a list of objects that repeat every key, the
+author and topic names and the popup texts for each pin. The columnar
+format sends what the map needs to draw the markers instead:
+
+    {
+        "format": "columnar",
+        "ids": [...],        # post id (the newest post of a cluster)
+        "counts": [...],     # 1 for a pin, the number of posts for a cluster
+        "authors": [...],    # distinct author names
+        "author": [...],     # index into "authors", -1 for clusters
+        "topics": [...],     # distinct topic names
+        "topic": [...],      # index into "topics", -1 for none
+        "coords": "...",     # base64 of little-endian int32 lat, lon pairs
+    }
+
+Coordinates are multiplied by COORD_SCALE and rounded (about 11cm), so the
+browser can read them straight into an Int32Array. Popup details are
+fetched per marker from the post API when they are shown.
+"""
+
+import base64
+import struct
+
+FORMAT = 'columnar'
+
+# Quantization of the packed coordinates: 1e-6 degrees.
+COORD_SCALE = 1_000_000
+
+
+def pack_coords(points):
+    """
+    Packs (lat, lon) pairs as base64 little-endian int32s.
+    """
+    values = [round(value * COORD_SCALE) for point in points for value in point]
+    return base64.b64encode(struct.pack(f'<{len(values)}i', *values)).decode()
+
+
+def unpack_coords(data):
+    """
+    Reverses pack_coords.
+    """
+    raw = base64.b64decode(data)
+    values = struct.unpack(f'<{len(raw) // 4}i', raw)
+    return [(values[i] / COORD_SCALE, values[i + 1] / COORD_SCALE) for i in range(0, len(values), 2)]
+
+
+def _index(names, lookup, name):
+    if name not in lookup:
+        lookup[name] = len(names)
+        names.append(name)
+    return lookup[name]
+
+
+def encode(items):
+    """
+    Encodes the pins and clusters returned by the map endpoints.
+    """
+    authors, author_lookup = [], {}
+    topics, topic_lookup = [], {}
+    payload = {
+        "format": FORMAT,
+        "ids": [],
+        "counts": [],
+        "authors": authors,
+        "author": [],
+        "topics": topics,
+        "topic": [],
+    }
+    for item in items:
+        if item.get('cluster'):
+            payload['ids'].append(item['post_id'])
+            payload['counts'].append(item['count'])
+            payload['author'].append(-1)
+            payload['topic'].append(-1)
+        else:
+            payload['ids'].append(item['id'])
+            payload['counts'].append(1)
+            payload['author'].append(_index(authors, author_lookup, item['author']))
+            payload['topic'].append(_index(topics, topic_lookup, item['topic']) if item['topic'] else -1)
+    payload['coords'] = pack_coords((item['lat'], item['lon']) for item in items)
+    return payload
@@ -0,0 +1,43 @@
+"""
+Denormalized like and comment counters on Post.
+
+Post.like_count and Post.comment_count are updated with F() expressions in
+the same transaction as the Like/Comment row, so readers never have to
+aggregate. Anything that bypasses the views (admin, cascades, raw SQL) can
+make them drift; reconcile() recomputes them from the source tables.
+"""
+
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Post, Comment, Like
+
+
+def adjust(post_id, **deltas):
+    """
+    Atomically adds to counters of one post, e.g. adjust(pk, like_count=1).
+    """
+    Post.objects.filter(pk=post_id).update(
+        **{field: F(field) + delta for field, delta in deltas.items()}
+    )
+
+
+def _count_of(model):
+    counts = model.objects.filter(post=OuterRef('pk')).order_by().values('post').annotate(n=Count('pk')).values('n')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def reconcile():
+    """
+    Recomputes every post's counters from the Like and Comment tables.
+    Returns the number of posts that had drifted.
+    """
+    drifted = Post.objects.annotate(
+        real_likes=_count_of(Like), real_comments=_count_of(Comment)
+    ).filter(~Q(like_count=F('real_likes')) | ~Q(comment_count=F('real_comments')))
+    post_ids = list(drifted.values_list('pk', flat=True))
+    if post_ids:
+        Post.objects.filter(pk__in=post_ids).update(
+            like_count=_count_of(Like), comment_count=_count_of(Comment)
+        )
+    return len(post_ids)
@@ -0,0 +1,87 @@
+"""
+In-process publish/subscribe for live map updates.
+
+Every connected map (see views.post_events_api) holds a Subscription: an
+asyncio queue living on the server's event loop plus the viewport the map
+is showing. core.signals publishes an event whenever a post is created,
+moved or deleted, from whatever thread saved it, and each subscriber whose
+viewport contains the post's old or new position gets a copy.
+
+Only saves made in the same process are seen: with several server
+processes each one only notifies its own clients, so a broker would have
+to sit behind publish() before scaling out.
+"""
+
+import asyncio
+import threading
+
+from . import geo
+
+# Events kept per subscriber before it is told to resync instead.
+QUEUE_SIZE = 100
+
+_subscribers = set()
+_lock = threading.Lock()
+
+
+class Subscription:
+    def __init__(self, bbox=None):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+        # (south, west, north, east) boxes, None for the whole world
+        self.boxes = geo.split_bbox(*bbox) if bbox else None
+        # Set when events were dropped because the client fell behind
+        self.lagged = False
+
+    def wants(self, lat, lon):
+        if lat is None or lon is None:
+            return False
+        if self.boxes is None:
+            return True
+        return any(
+            south <= lat <= north and west <= lon <= east
+            for south, west, north, east in self.boxes
+        )
+
+    def _deliver(self, event):
+        # Runs on the subscriber's event loop
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.lagged = True
+
+
+def subscribe(bbox=None):
+    """
+    Registers a subscriber for posts inside `bbox` ("west, south, east,
+    north"). Must be called from the event loop that will read the queue.
+    """
+    subscription = Subscription(bbox)
+    with _lock:
+        _subscribers.add(subscription)
+    return subscription
+
+
+def unsubscribe(subscription):
+    with _lock:
+        _subscribers.discard(subscription)
+
+
+def has_subscribers():
+    return bool(_subscribers)
+
+
+def publish(event, location, previous=None):
+    """
+    Hands `event` to every subscriber watching `location` or `previous`,
+    both (lat, lon) pairs. Safe to call from any thread.
+    """
+    with _lock:
+        subscribers = list(_subscribers)
+    for subscription in subscribers:
+        if subscription.wants(*location) or (previous and subscription.wants(*previous)):
+            try:
+                subscription.loop.call_soon_threadsafe(subscription._deliver, event)
+            except RuntimeError:
+                # The loop was closed under a client that never unsubscribed
+                unsubscribe(subscription)
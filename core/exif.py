@@ -0,0 +1,80 @@
+"""
+GPS position and capture time from photo EXIF headers.
+
+Image.open only parses the file header, the pixel data is never decoded,
+so this is cheap enough for the upload path. The module does not touch
+Django so the bulk `geotag_photos` command can run it in worker processes.
+"""
+
+import datetime
+
+from PIL import ExifTags, Image, UnidentifiedImageError
+
+GPS = ExifTags.GPS
+TAGS = ExifTags.Base
+
+
+def _degrees(value, ref):
+    # (degrees, minutes, seconds) rationals -> signed decimal degrees
+    if not value or len(value) != 3:
+        return None
+    try:
+        degrees = float(value[0]) + float(value[1]) / 60 + float(value[2]) / 3600
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    return -degrees if ref in ('S', 'W') else degrees
+
+
+def _timestamp(value, offset):
+    try:
+        taken = datetime.datetime.strptime(str(value).strip('\x00 '), '%Y:%m:%d %H:%M:%S')
+    except (TypeError, ValueError):
+        return None
+    if offset:
+        try:
+            taken = taken.replace(tzinfo=datetime.datetime.strptime(offset.strip('\x00 '), '%z').tzinfo)
+        except ValueError:
+            pass
+    return taken
+
+
+def read(fileobj):
+    """
+    Returns {'latitude', 'longitude', 'taken_at'} for an image file object,
+    with None for anything the header does not carry. taken_at is naive
+    when the camera did not record its UTC offset. The file position is
+    restored afterwards.
+    """
+    metadata = {'latitude': None, 'longitude': None, 'taken_at': None}
+    position = fileobj.tell()
+    try:
+        with Image.open(fileobj) as image:
+            exif = image.getexif()
+            gps = exif.get_ifd(ExifTags.IFD.GPSInfo)
+            details = exif.get_ifd(ExifTags.IFD.Exif)
+    except (UnidentifiedImageError, OSError, SyntaxError, ValueError):
+        return metadata
+    finally:
+        fileobj.seek(position)
+
+    latitude = _degrees(gps.get(GPS.GPSLatitude), gps.get(GPS.GPSLatitudeRef))
+    longitude = _degrees(gps.get(GPS.GPSLongitude), gps.get(GPS.GPSLongitudeRef))
+    if latitude is not None and longitude is not None and abs(latitude) <= 90 and abs(longitude) <= 180:
+        metadata['latitude'], metadata['longitude'] = latitude, longitude
+
+    if TAGS.DateTimeOriginal in details:
+        metadata['taken_at'] = _timestamp(details[TAGS.DateTimeOriginal], details.get(TAGS.OffsetTimeOriginal))
+    elif TAGS.DateTime in exif:
+        metadata['taken_at'] = _timestamp(exif[TAGS.DateTime], None)
+    return metadata
+
+
+def read_path(path):
+    """
+    read() for a file on disk. Missing files yield empty metadata.
+    """
+    try:
+        with open(path, 'rb') as fileobj:
+            return read(fileobj)
+    except OSError:
+        return {'latitude': None, 'longitude': None, 'taken_at': None}
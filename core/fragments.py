@@ -0,0 +1,93 @@
+"""
+Versions for the cached template fragments.
+
+Templates cache their expensive parts with ``{% cache %}`` and put the
+version of what they show in the key, so nothing is ever deleted: a change
+bumps the version and the next render misses. core.signals bumps versions
+when posts, comments, likes, friendships and topics change.
+
+Scopes:
+    post:<id>   a post's page and its item in the feeds (caption, photo,
+                likes, comments)
+    user:<id>   a profile's activity (comments written by the user)
+    feed:<id>   the home activity of a user, which shows comments on the
+                posts of the user and their friends
+    topics      the topic lists
+"""
+
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+# How long a rendered fragment is kept. The fragments show "x minutes ago"
+# texts, so this also bounds how stale those can get.
+FRAGMENT_TIMEOUT = 10 * 60
+
+
+def _key(scope):
+    return f'fragments:{scope}:version'
+
+
+def versions(**scopes):
+    """
+    Returns {name: version} for keyword arguments {name: scope}.
+    """
+    keys = {name: _key(scope) for name, scope in scopes.items()}
+    found = cache.get_many(keys.values())
+    missing = {key: time.time_ns() for key in keys.values() if key not in found}
+    if missing:
+        cache.set_many(missing, None)
+        found.update(missing)
+    return {name: found[key] for name, key in keys.items()}
+
+
+async def aversions(**scopes):
+    """
+    Async version of versions.
+    """
+    keys = {name: _key(scope) for name, scope in scopes.items()}
+    found = await cache.aget_many(keys.values())
+    missing = {key: time.time_ns() for key in keys.values() if key not in found}
+    if missing:
+        await cache.aset_many(missing, None)
+        found.update(missing)
+    return {name: found[key] for name, key in keys.items()}
+
+
+def context(**scopes):
+    """
+    Template context for the {% cache %} tags of a page.
+    """
+    return {'fragment_timeout': FRAGMENT_TIMEOUT, 'fragment_versions': versions(**scopes)}
+
+
+def attach(posts):
+    """
+    Sets `fragment_version` on each post, for the per-post feed items.
+    """
+    found = versions(**{str(post.id): f'post:{post.id}' for post in posts})
+    for post in posts:
+        post.fragment_version = found[str(post.id)]
+    return posts
+
+
+async def aattach(posts):
+    found = await aversions(**{str(post.id): f'post:{post.id}' for post in posts})
+    for post in posts:
+        post.fragment_version = found[str(post.id)]
+    return posts
+
+
+def bump(*scopes):
+    """
+    Moves the given scopes to a new version once the current transaction
+    commits, so no fragment gets cached from data that is not visible yet.
+    """
+    keys = [_key(scope) for scope in scopes]
+
+    def commit():
+        version = time.time_ns()
+        cache.set_many({key: version for key in keys}, None)
+
+    transaction.on_commit(commit)
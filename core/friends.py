@@ -0,0 +1,76 @@
+"""
+Cached friend graph.
+
+Each user's friendships (both directions, any status) are loaded with one
+query and kept in the cache as an adjacency record, so visibility checks
+and the profile's friendship button do not hit the database on every page
+view. core.signals calls invalidate() for both users whenever a Friendship
+is saved or deleted. That only reaches other processes through a shared
+cache backend; with the per-process default the other processes rely on
+settings.FRIEND_GRAPH_TIMEOUT.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+
+from .models import Friendship
+
+
+def _key(user_id):
+    return f'friends:{user_id}'
+
+
+def _adjacency(user_id):
+    """
+    Returns {'sent': {user_id: status}, 'received': {user_id: status}} for
+    the friendship requests sent and received by a user.
+    """
+    adjacency = cache.get(_key(user_id))
+    if adjacency is None:
+        adjacency = {'sent': {}, 'received': {}}
+        rows = Friendship.objects.filter(
+            Q(from_user_id=user_id) | Q(to_user_id=user_id)
+        ).values_list('from_user_id', 'to_user_id', 'status')
+        for from_id, to_id, status in rows:
+            if from_id == user_id:
+                adjacency['sent'][to_id] = status
+            else:
+                adjacency['received'][from_id] = status
+        cache.set(_key(user_id), adjacency, settings.FRIEND_GRAPH_TIMEOUT)
+    return adjacency
+
+
+def friend_ids(user_id):
+    """
+    Returns the ids of the user's accepted friends, from either side.
+    """
+    adjacency = _adjacency(user_id)
+    return {
+        other for direction in ('sent', 'received')
+        for other, status in adjacency[direction].items()
+        if status == Friendship.STATUS_ACCEPTED
+    }
+
+
+def relationship(user_id, other_id):
+    """
+    Returns the friendship status between two users as shown on a profile:
+    the status of the request `user_id` sent, 'received_pending' for a
+    pending request from `other_id`, the status of a request received, or
+    None if there is none.
+    """
+    adjacency = _adjacency(user_id)
+    if other_id in adjacency['sent']:
+        return adjacency['sent'][other_id]
+    status = adjacency['received'].get(other_id)
+    if status == Friendship.STATUS_PENDING:
+        return 'received_pending'  # A custom status for the template
+    return status
+
+
+def invalidate(*user_ids):
+    """
+    Drops the cached adjacency of the given users.
+    """
+    cache.delete_many([_key(user_id) for user_id in user_ids])
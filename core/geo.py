@@ -0,0 +1,274 @@
+"""
+Small geometry helpers used by the map endpoints.
+
+Posts are indexed by a geohash string stored on the row. Every prefix of a
+geohash is a rectangular cell, and all hashes that share a prefix sort next
+to each other, so "posts inside this cell" is a plain index range scan:
+``prefix <= geohash < successor(prefix)``.
+"""
+
+import math
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+_DECODE = {char: index for index, char in enumerate(BASE32)}
+
+# Precision stored on Post.geohash. 10 characters is roughly a 1m x 0.6m cell.
+GEOHASH_PRECISION = 10
+
+# Upper bound on how many cells we use to cover a bounding box.
+MAX_COVER_CELLS = 32
+
+
+def encode(lat, lon, precision=GEOHASH_PRECISION):
+    """
+    Returns the geohash of a point as a string of `precision` characters.
+    """
+    lat, lon = float(lat), float(lon)
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bit_count = 0
+    value = 0
+    even = True  # geohash interleaves bits starting with longitude
+    while len(chars) < precision:
+        rng, coord = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if coord >= mid:
+            value = (value << 1) | 1
+            rng[0] = mid
+        else:
+            value = value << 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[value])
+            bit_count = 0
+            value = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """
+    Returns the (height, width) in degrees of a geohash cell.
+    """
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = (5 * precision) // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+
+def cell_center(prefix):
+    """
+    Returns the (lat, lon) center of a geohash cell.
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for char in prefix:
+        value = _DECODE[char]
+        for bit in range(4, -1, -1):
+            rng = lon_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if value >> bit & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+    return (lat_range[0] + lat_range[1]) / 2, (lon_range[0] + lon_range[1]) / 2
+
+
+def _cells_in_box(south, west, north, east, precision):
+    height, width = cell_size(precision)
+    rows = round(180.0 / height)
+    cols = round(360.0 / width)
+    row_start = max(int((south + 90.0) // height), 0)
+    row_end = min(int((north + 90.0) // height), rows - 1)
+    col_start = max(int((west + 180.0) // width), 0)
+    col_end = min(int((east + 180.0) // width), cols - 1)
+    return row_start, row_end, col_start, col_end
+
+
+def cell_count(south, west, north, east, precision):
+    """
+    Returns how many geohash cells of `precision` a bounding box touches.
+    """
+    row_start, row_end, col_start, col_end = _cells_in_box(south, west, north, east, precision)
+    return (row_end - row_start + 1) * (col_end - col_start + 1)
+
+
+def split_bbox(west, south, east, north):
+    """
+    Normalizes a Leaflet style bounding box and splits it in two when it
+    crosses the antimeridian. Returns a list of (south, west, north, east).
+    """
+    south = max(min(south, north), -90.0)
+    north = min(max(south, north), 90.0)
+    if east - west >= 360.0:
+        return [(south, -180.0, north, 180.0)]
+    # Leaflet reports longitudes outside [-180, 180] after panning around the world.
+    width = east - west if east >= west else east - west + 360.0
+    west = (west + 180.0) % 360.0 - 180.0
+    east = west + width
+    if east > 180.0:
+        return [(south, west, north, 180.0), (south, -180.0, north, east - 360.0)]
+    return [(south, west, north, east)]
+
+
+def covering_prefixes(south, west, north, east, max_cells=MAX_COVER_CELLS, max_precision=GEOHASH_PRECISION):
+    """
+    Returns the geohash prefixes of the cells that cover a bounding box,
+    using the finest precision up to `max_precision` that needs at most
+    `max_cells` cells.
+    """
+    chosen = 1
+    for precision in range(1, max_precision + 1):
+        if cell_count(south, west, north, east, precision) > max_cells:
+            break
+        chosen = precision
+
+    height, width = cell_size(chosen)
+    row_start, row_end, col_start, col_end = _cells_in_box(south, west, north, east, chosen)
+    prefixes = set()
+    for row in range(row_start, row_end + 1):
+        for col in range(col_start, col_end + 1):
+            prefixes.add(encode(-90.0 + (row + 0.5) * height, -180.0 + (col + 0.5) * width, chosen))
+    return sorted(prefixes)
+
+
+def successor(prefix):
+    """
+    Returns the smallest string that sorts after every geohash starting with
+    `prefix`, or None when there is no such bound (prefix is all 'z').
+    """
+    stripped = prefix.rstrip(BASE32[-1])
+    if not stripped:
+        return None
+    return stripped[:-1] + BASE32[_DECODE[stripped[-1]] + 1]
+
+
+def prefix_ranges(prefixes):
+    """
+    Collapses same-length prefixes into (low, high) index ranges, merging
+    cells that are adjacent along the geohash curve. `high` is exclusive and
+    may be None for an open upper bound.
+    """
+    ranges = []
+    previous = None
+    for prefix in sorted(prefixes):
+        number = 0
+        for char in prefix:
+            number = number * 32 + _DECODE[char]
+        if ranges and previous == number - 1:
+            ranges[-1][1] = successor(prefix)
+        else:
+            ranges.append([prefix, successor(prefix)])
+        previous = number
+    return [tuple(r) for r in ranges]
+
+
+def bbox_ranges(west, south, east, north, max_cells=MAX_COVER_CELLS, max_precision=GEOHASH_PRECISION):
+    """
+    Returns the geohash index ranges covering a Leaflet style bounding box.
+    Cap `max_precision` at the length of the keys being searched when they
+    are shorter than a full geohash.
+    """
+    ranges = []
+    for box in split_bbox(west, south, east, north):
+        ranges.extend(prefix_ranges(covering_prefixes(*box, max_cells=max_cells, max_precision=max_precision)))
+    return ranges
+
+
+
+def cluster_precision(zoom):
+    """
+    Returns the geohash precision whose cells are roughly 64px wide on a
+    web mercator map at `zoom` (a 256px tile spans 360 / 2**zoom degrees).
+    """
+    return max(1, min(GEOHASH_PRECISION, (2 * (int(zoom) + 2)) // 5))
+
+
+def tile_bounds(z, x, y):
+    """
+    Returns the (west, south, east, north) bounds of a slippy map tile.
+    """
+    n = 1 << z
+
+    def lat(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return x / n * 360.0 - 180.0, lat(y + 1), (x + 1) / n * 360.0 - 180.0, lat(y)
+
+
+def tile_for_point(lat, lon, z):
+    """
+    Returns the (x, y) of the slippy map tile containing a point at zoom `z`.
+    """
+    n = 1 << z
+    lat = max(min(float(lat), 85.0511287798), -85.0511287798)
+    x = int((float(lon) + 180.0) / 360.0 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distance between two points in kilometres.
+    """
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def ring_prefixes(lat, lon, precision, radius=1):
+    """
+    Returns the geohash prefixes of the block of cells reaching `radius`
+    cells out from the cell containing the point, 3x3 for a radius of 1.
+    """
+    height, width = cell_size(precision)
+    rows = round(180.0 / height)
+    cols = round(360.0 / width)
+    row = min(int((lat + 90.0) // height), rows - 1)
+    col = min(int((lon + 180.0) // width), cols - 1)
+    prefixes = set()
+    for r in range(max(row - radius, 0), min(row + radius, rows - 1) + 1):
+        for c in range(col - radius, col + radius + 1):
+            c %= cols
+            prefixes.add(encode(-90.0 + (r + 0.5) * height, -180.0 + (c + 0.5) * width, precision))
+    return sorted(prefixes)
+
+
+def ring_radius_km(lat, precision, radius=1):
+    """
+    Returns a distance from the point within which every location lies
+    inside its ring_prefixes block. Anything found in the block that is
+    closer than this is guaranteed to be closer than anything outside it.
+    """
+    height, width = cell_size(precision)
+    if width * (2 * radius + 1) >= 360.0:
+        lon_km = math.inf
+    else:
+        lon_km = EARTH_RADIUS_KM * math.asin(
+            math.cos(math.radians(lat)) * math.sin(math.radians(min(width * radius, 90.0)))
+        )
+    return min(EARTH_RADIUS_KM * math.radians(height * radius), lon_km)
+
+
+def radius_bbox(lat, lon, km):
+    """
+    Returns a Leaflet style (west, south, east, north) bounding box holding
+    every point within `km` of a point. Its longitudes may run past 180,
+    split_bbox deals with that.
+    """
+    angle = km / EARTH_RADIUS_KM
+    south = max(lat - math.degrees(angle), -90.0)
+    north = min(lat + math.degrees(angle), 90.0)
+    cos_lat = math.cos(math.radians(lat))
+    # Around a pole, or further than a quarter of the globe, every
+    # longitude is in reach
+    if south == -90.0 or north == 90.0 or angle >= math.pi / 2 or math.sin(angle) >= cos_lat:
+        return -180.0, south, 180.0, north
+    half_width = math.degrees(math.asin(math.sin(angle) / cos_lat))
+    return lon - half_width, south, lon + half_width, north
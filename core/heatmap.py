@@ -0,0 +1,180 @@
+"""
+Precomputed post density for the heatmap.
+
+HeatmapCell counts the posts in each geohash cell per topic and day, at
+every precision in PRECISIONS, so the heatmap API sums a few aggregate
+rows instead of scanning posts. core.signals keeps the counts up to date in
+the same transaction as the post. Code that bulk inserts posts calls
+add_posts(); anything else that bypasses Post.save() and delete() makes the
+counts drift, and rebuild() recomputes the table from the posts.
+"""
+
+from collections import Counter, defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q
+from django.db.models.functions import Substr, TruncDate
+from django.utils import timezone
+
+from . import geo
+from .models import HeatmapCell, Post
+
+# Precision 7 cells are about 150m across, enough for a city at zoom 16.
+PRECISIONS = range(1, 8)
+MAX_PRECISION = PRECISIONS[-1]
+# A viewport that would need more cells is drawn at a coarser precision.
+MAX_CELLS = 4096
+# Rows per bulk_create in rebuild().
+BATCH_SIZE = 5000
+# Cells looked up per query in add_posts(), well below SQLite's limit of
+# query parameters.
+ADD_CHUNK_SIZE = 2000
+# Lookup and insert rounds in _increment() before an IntegrityError is
+# taken for something other than a concurrent insert.
+INSERT_ATTEMPTS = 3
+
+
+def entry(lat, lon, topic_id, created_at):
+    """
+    Returns what a post counts under, (geohash, topic_id, day), or None
+    when it has no location.
+    """
+    if lat is None or lon is None:
+        return None
+    return geo.encode(lat, lon, MAX_PRECISION), topic_id, timezone.localdate(created_at)
+
+
+def _increment(counts):
+    """
+    Adds {(precision, cell, topic_id, day): n} to the table, with a few
+    queries for up to ADD_CHUNK_SIZE keys.
+    """
+    for attempt in range(INSERT_ATTEMPTS):
+        # precision leads the unique index, it has to be in the filter
+        rows = HeatmapCell.objects.filter(
+            precision__in={precision for precision, _, _, _ in counts},
+            cell__in={cell for _, cell, _, _ in counts},
+            day__range=(min(day for *_, day in counts), max(day for *_, day in counts)),
+        ).values_list('precision', 'cell', 'topic_id', 'day', 'pk')
+        found = {}
+        for *key, pk in rows:
+            if tuple(key) in counts:
+                found[tuple(key)] = pk
+        # One UPDATE per distinct increment, mostly just +1
+        by_delta = defaultdict(list)
+        for key, pk in found.items():
+            by_delta[counts[key]].append(pk)
+        for delta, pks in by_delta.items():
+            HeatmapCell.objects.filter(pk__in=pks).update(count=F('count') + delta)
+
+        counts = {key: count for key, count in counts.items() if key not in found}
+        if not counts:
+            return
+        try:
+            with transaction.atomic():
+                HeatmapCell.objects.bulk_create([
+                    HeatmapCell(precision=precision, cell=cell, topic_id=topic_id, day=day, count=count)
+                    for (precision, cell, topic_id, day), count in counts.items()
+                ])
+            return
+        except IntegrityError:
+            # A concurrent first post in the same cell created some of the
+            # rows since the lookup, add to those instead. Anything else,
+            # like a topic deleted meanwhile, fails every time.
+            if attempt == INSERT_ATTEMPTS - 1:
+                raise
+
+
+def _increment_chunked(counts):
+    keys = list(counts)
+    for start in range(0, len(keys), ADD_CHUNK_SIZE):
+        _increment({key: counts[key] for key in keys[start:start + ADD_CHUNK_SIZE]})
+
+
+def _adjust(counted, delta):
+    geohash, topic_id, day = counted
+    if delta > 0:
+        _increment({(precision, geohash[:precision], topic_id, day): delta for precision in PRECISIONS})
+        return
+    match = Q()
+    for precision in PRECISIONS:
+        match |= Q(precision=precision, cell=geohash[:precision])
+    rows = HeatmapCell.objects.filter(match, topic_id=topic_id, day=day)
+    rows.update(count=F('count') + delta)
+    rows.filter(count__lte=0).delete()
+
+
+def changed(previous, current):
+    """
+    Moves one post's count from the `previous` entry to the `current` one,
+    either of which may be None (created, deleted or unlocated).
+    """
+    if previous == current:
+        return
+    if previous is not None:
+        _adjust(previous, -1)
+    if current is not None:
+        _adjust(current, 1)
+
+
+def add_posts(posts):
+    """
+    Counts in posts that were inserted without signals (bulk_create), with
+    a few queries per ADD_CHUNK_SIZE cells instead of a few per post.
+    """
+    counts = Counter()
+    for post in posts:
+        if post.geohash:
+            day = timezone.localdate(post.created_at)
+            for precision in PRECISIONS:
+                counts[precision, post.geohash[:precision], post.topic_id, day] += 1
+
+    _increment_chunked(counts)
+
+
+def drop_topic(topic_id):
+    """
+    Moves the counts of a topic that is about to be deleted to the posts
+    without a topic, where its posts go. Letting SET_NULL do it would
+    clash with the rows already counted without a topic.
+    """
+    rows = HeatmapCell.objects.filter(topic_id=topic_id)
+    counts = {(precision, cell, None, day): count
+              for precision, cell, day, count in rows.values_list('precision', 'cell', 'day', 'count')}
+    rows.delete()
+    _increment_chunked(counts)
+
+
+def rebuild():
+    """
+    Recomputes the whole table from the posts. Returns the number of rows.
+    """
+    total = 0
+    with transaction.atomic():
+        HeatmapCell.objects.all().delete()
+        for precision in PRECISIONS:
+            rows = Post.objects.exclude(geohash='').order_by().values(
+                'topic_id', cell=Substr('geohash', 1, precision), day=TruncDate('created_at'),
+            ).annotate(count=Count('id'))
+            batch = []
+            for row in rows.iterator(chunk_size=BATCH_SIZE):
+                batch.append(HeatmapCell(precision=precision, **row))
+                if len(batch) == BATCH_SIZE:
+                    HeatmapCell.objects.bulk_create(batch)
+                    total += len(batch)
+                    batch = []
+            HeatmapCell.objects.bulk_create(batch)
+            total += len(batch)
+    return total
+
+
+def precision_for(bbox, requested):
+    """
+    Returns the finest precision up to `requested` at which the viewport
+    needs at most MAX_CELLS cells.
+    """
+    boxes = geo.split_bbox(*bbox)
+    for precision in range(min(requested, MAX_PRECISION), 1, -1):
+        if sum(geo.cell_count(*box, precision) for box in boxes) <= MAX_CELLS:
+            return precision
+    return 1
@@ -0,0 +1,53 @@
+"""
+Resized variants of uploaded post photos.
+
+The original upload is kept untouched in Post.photo. From it we render a
+small thumbnail for map popups, a feed-width copy and a capped "full" copy,
+each with the EXIF orientation applied and all metadata (GPS included)
+stripped, since Pillow only writes EXIF when asked to.
+"""
+
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, features
+
+# Post field -> longest side in pixels
+VARIANTS = {
+    'photo_thumb': 320,
+    'photo_medium': 960,
+    'photo_large': 2048,
+}
+
+FORMAT, EXTENSION = ('WEBP', 'webp') if features.check('webp') else ('JPEG', 'jpg')
+QUALITY = 80
+
+
+def _render(image, size):
+    copy = image.copy()
+    copy.thumbnail((size, size), Image.Resampling.LANCZOS)
+    buffer = BytesIO()
+    copy.save(buffer, FORMAT, quality=QUALITY)
+    return ContentFile(buffer.getvalue())
+
+
+def generate_variants(post):
+    """
+    (Re)builds the resized copies of a post's photo and saves them on the
+    post. Variants of a removed photo are cleared.
+    """
+    for field in VARIANTS:
+        old = getattr(post, field)
+        if old:
+            old.delete(save=False)
+
+    if post.photo:
+        with post.photo.open('rb') as upload:
+            image = ImageOps.exif_transpose(Image.open(upload))
+            image = image.convert('RGBA' if FORMAT == 'WEBP' and image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+            stem = os.path.splitext(os.path.basename(post.photo.name))[0]
+            for field, size in VARIANTS.items():
+                getattr(post, field).save(f'{stem}_{size}.{EXTENSION}', _render(image, size), save=False)
+
+    post.save(update_fields=list(VARIANTS))
@@ -0,0 +1,131 @@
+"""
+A small background job queue stored in the database.
+
+Work that is too slow for the request path (image resizing, EXIF parsing,
+counter reconciliation) is registered with @job and queued with enqueue().
+`manage.py run_jobs` claims pending rows and runs them on a process pool,
+so CPU-bound work uses every core without any external broker. Failed jobs
+are retried with exponential backoff up to Job.max_attempts.
+
+With settings.JOBS_RUN_SYNC the job runs in-process right after the
+current transaction commits, which is what tests and small deployments
+without a worker want.
+"""
+
+import datetime
+import traceback
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Job
+
+# First retry delay, doubled on every further attempt.
+RETRY_DELAY = datetime.timedelta(seconds=30)
+# Running jobs not heard of for this long are assumed lost (worker crash).
+STALE_AFTER = datetime.timedelta(minutes=10)
+# How often run_jobs marks the jobs it is still running as alive.
+HEARTBEAT_INTERVAL = datetime.timedelta(minutes=1)
+
+_registry = {}
+
+
+def job(name):
+    """
+    Registers a function as the handler of jobs called `name`. Handlers get
+    the job payload as keyword arguments.
+    """
+    def register(func):
+        _registry[name] = func
+        return func
+    return register
+
+
+def enqueue(name, max_attempts=3, **payload):
+    """
+    Queues a job and returns it. The payload must be JSON serializable.
+    """
+    if name not in _registry:
+        raise ValueError(f'Unknown job {name!r}')
+    queued = Job.objects.create(name=name, payload=payload, max_attempts=max_attempts)
+    if settings.JOBS_RUN_SYNC:
+        transaction.on_commit(lambda: run_now(queued))
+    return queued
+
+
+def execute(name, payload):
+    """
+    Runs a job handler. This is what the worker processes call.
+    """
+    _registry[name](**payload)
+
+
+def claim(limit):
+    """
+    Marks up to `limit` due jobs as running and returns them. Each row is
+    claimed with a conditional UPDATE, so concurrent workers never get the
+    same job.
+    """
+    now = timezone.now()
+    due = Job.objects.filter(
+        status=Job.STATUS_PENDING, run_after__lte=now
+    ).order_by('run_after', 'id').values_list('id', flat=True)[:limit]
+
+    claimed = []
+    for job_id in list(due):
+        updated = Job.objects.filter(id=job_id, status=Job.STATUS_PENDING).update(
+            status=Job.STATUS_RUNNING, updated_at=now
+        )
+        if updated:
+            claimed.append(job_id)
+    return list(Job.objects.filter(id__in=claimed).order_by('run_after', 'id'))
+
+
+def heartbeat(job_ids):
+    """
+    Marks running jobs as alive, so requeue_stale() leaves them alone
+    however long they take.
+    """
+    Job.objects.filter(id__in=job_ids, status=Job.STATUS_RUNNING).update(updated_at=timezone.now())
+
+
+def requeue_stale():
+    """
+    Puts jobs whose worker died while running them, and so stopped sending
+    heartbeats, back in the queue. Returns how many were requeued.
+    """
+    return Job.objects.filter(
+        status=Job.STATUS_RUNNING, updated_at__lt=timezone.now() - STALE_AFTER
+    ).update(status=Job.STATUS_PENDING, updated_at=timezone.now())
+
+
+def finish(queued, error=None):
+    """
+    Records the outcome of a claimed job, scheduling a retry on failure
+    while attempts remain.
+    """
+    queued.attempts += 1
+    if error is None:
+        queued.status = Job.STATUS_DONE
+        queued.last_error = ''
+    elif queued.attempts < queued.max_attempts:
+        queued.status = Job.STATUS_PENDING
+        queued.run_after = timezone.now() + RETRY_DELAY * 2 ** (queued.attempts - 1)
+        queued.last_error = error
+    else:
+        queued.status = Job.STATUS_FAILED
+        queued.last_error = error
+    queued.save(update_fields=['attempts', 'status', 'run_after', 'last_error', 'updated_at'])
+
+
+def run_now(queued):
+    """
+    Runs a job in the current process and records the outcome.
+    """
+    try:
+        execute(queued.name, queued.payload)
+    except Exception:
+        finish(queued, traceback.format_exc())
+    else:
+        finish(queued)
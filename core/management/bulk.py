@@ -0,0 +1,22 @@
+"""
+Helpers shared by the bulk loading commands.
+"""
+
+TIMESTAMP_FIELDS = ('created_at', 'updated_at')
+
+
+def create_with_timestamps(model, rows, batch_size=None):
+    """
+    bulk_create that keeps the created_at and updated_at set on the rows.
+    bulk_create gives auto_now(_add) fields the current time, so the dates
+    are written again with bulk_update afterwards.
+    """
+    names = [field.name for field in model._meta.concrete_fields if field.name in TIMESTAMP_FIELDS]
+    dates = [[getattr(row, name) for name in names] for row in rows]
+    model.objects.bulk_create(rows, batch_size=batch_size)
+    for row, values in zip(rows, dates):
+        for name, value in zip(names, values):
+            setattr(row, name, value)
+    if names:
+        model.objects.bulk_update(rows, names, batch_size=batch_size)
+    return rows
@@ -0,0 +1,28 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from core import friends, timeline
+
+
+class Command(BaseCommand):
+    help = 'Fills the fan-out home timelines from existing posts and friendships.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help='Only rebuild the timeline of this user id.')
+        parser.add_argument('--limit', type=int, default=timeline.BACKFILL_LIMIT,
+                            help='Recent posts copied per author (default %(default)s).')
+
+    def handle(self, *args, **options):
+        if not timeline.enabled():
+            raise CommandError('TIMELINE_ENABLED is off, nothing would read the timelines.')
+
+        users = User.objects.all()
+        if options['user']:
+            users = users.filter(id=options['user'])
+
+        count = 0
+        for user_id in users.values_list('id', flat=True).iterator():
+            for author_id in friends.friend_ids(user_id) | {user_id}:
+                timeline.backfill(user_id, author_id, options['limit'])
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Backfilled {count} timeline(s).'))
@@ -0,0 +1,140 @@
+import io
+import random
+import statistics
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from core import friends, geo
+from core.models import Post
+
+# Viewport used for the map benchmarks, around the densest generated city.
+MAP_CENTER = (24.8138, 120.9675)
+
+
+def _percentile(sorted_values, fraction):
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Times the main views in-process and reports latency percentiles, query '
+        'counts and peak memory per view. With --sizes, each size gets a fresh '
+        'test database filled by generate_data, so runs are repeatable; '
+        'without it the current database is measured.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='',
+                            help='Comma separated post counts, e.g. "1000,10000,100000". Users are a tenth.')
+        parser.add_argument('--requests', type=int, default=30, help='Timed requests per view.')
+        parser.add_argument('--cold', action='store_true',
+                            help='Clear the cache before every request instead of measuring warm.')
+        parser.add_argument('--seed', type=int, default=1, help='Seed for the data and the sampled URLs.')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        try:
+            if not options['sizes']:
+                self.run(options)
+                return
+            try:
+                sizes = [int(size) for size in options['sizes'].split(',')]
+            except ValueError:
+                raise CommandError('--sizes must be comma separated integers.')
+            for size in sizes:
+                self.stdout.write(self.style.MIGRATE_HEADING(f'\n{size} posts, {max(size // 10, 2)} users'))
+                old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+                try:
+                    # An in-memory SQLite test database can outlive destroy_test_db
+                    call_command('flush', interactive=False, verbosity=0)
+                    cache.clear()
+                    call_command('generate_data', posts=size, users=max(size // 10, 2),
+                                 seed=options['seed'], stdout=io.StringIO())
+                    self.run(options)
+                finally:
+                    connection.creation.destroy_test_db(old_name, verbosity=0)
+        finally:
+            teardown_test_environment()
+
+    def urls(self, rng):
+        """
+        Returns {view name: [urls]} sampled from the data, and the user to
+        log in as: the one with the most friends, whose pages are the
+        heaviest.
+        """
+        user = max(User.objects.all()[:200], key=lambda user: len(friends.friend_ids(user.id)))
+        post_ids = list(Post.objects.values_list('id', flat=True)[:5000])
+        user_ids = list(User.objects.values_list('id', flat=True)[:5000])
+        lat, lon = MAP_CENTER
+        west, south, east, north = lon - 0.2, lat - 0.15, lon + 0.2, lat + 0.15
+        tile = geo.tile_for_point(lat, lon, 12)
+        return user, {
+            'home': [reverse('home')],
+            'feed-page': [reverse('feed-page')],
+            'post': [reverse('post', args=[post_id]) for post_id in rng.sample(post_ids, min(20, len(post_ids)))],
+            'user-profile': [reverse('user-profile', args=[uid]) for uid in rng.sample(user_ids, min(20, len(user_ids)))],
+            'api-get-posts (z12)': [f"{reverse('api-get-posts')}?bbox={west},{south},{east},{north}&zoom=12"],
+            'api-get-posts (pins)': [f"{reverse('api-get-posts')}?bbox={west},{south},{east},{north}"],
+            'api-get-tile (z12)': [reverse('api-get-tile', args=[12, *tile])],
+            'api-nearby-posts': [f"{reverse('api-nearby-posts')}?lat={lat}&lon={lon}&k=20"],
+            'api-heatmap (z12)': [f"{reverse('api-heatmap')}?bbox={west},{south},{east},{north}&zoom=12"],
+        }
+
+    def request(self, client, url, cold):
+        if cold:
+            cache.clear()
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+            if response.streaming:
+                b''.join(response)
+        elapsed = time.perf_counter() - started
+        if response.status_code != 200:
+            raise CommandError(f'{url} returned {response.status_code}')
+        return elapsed, len(queries)
+
+    def run(self, options):
+        rng = random.Random(options['seed'])
+        user, views = self.urls(rng)
+        client = Client()
+        client.force_login(user)
+        cold = options['cold']
+
+        self.stdout.write(f"{'view':<22} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8} {'peak KiB':>9}")
+        for name, urls in views.items():
+            # One untimed pass fills the caches for the warm numbers
+            for url in urls:
+                self.request(client, url, cold)
+
+            latencies, query_counts = [], []
+            for index in range(options['requests']):
+                elapsed, count = self.request(client, urls[index % len(urls)], cold)
+                latencies.append(elapsed)
+                query_counts.append(count)
+
+            # tracemalloc slows everything down, so memory gets its own pass
+            tracemalloc.start()
+            peak = 0
+            for url in urls[:5]:
+                tracemalloc.reset_peak()
+                self.request(client, url, cold)
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+
+            latencies.sort()
+            self.stdout.write('{:<22} {:>8.1f} {:>8.1f} {:>8.1f} {:>8} {:>9.0f}'.format(
+                name, *(1000 * _percentile(latencies, f) for f in (0.5, 0.95, 0.99)),
+                f'{statistics.median(query_counts):g}/{max(query_counts)}', peak / 1024,
+            ))
+        if settings.DEBUG:
+            self.stderr.write('DEBUG is on, numbers include the debug overhead.')
@@ -0,0 +1,84 @@
+import json
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Post
+
+FORMATS = ('geojson', 'ndjson')
+# Post fields written to the feature properties, besides author and topic.
+PROPERTIES = ('caption', 'photo', 'photo_thumb', 'photo_medium', 'photo_large', 'taken_at', 'created_at', 'updated_at')
+
+
+def feature(row):
+    """
+    Turns a Post values() row into a GeoJSON Feature. Posts without a
+    location get a null geometry.
+    """
+    geometry = None
+    if row['latitude'] is not None and row['longitude'] is not None:
+        geometry = {'type': 'Point', 'coordinates': [row['longitude'], row['latitude']]}
+    properties = {'author': row['author__username'], 'topic': row['topic__name']}
+    for name in PROPERTIES:
+        value = row[name]
+        # Full precision, DjangoJSONEncoder would cut it to milliseconds
+        properties[name] = value.isoformat() if isinstance(value, datetime) else value or None
+    return {'type': 'Feature', 'id': row['id'], 'geometry': geometry, 'properties': properties}
+
+
+class Command(BaseCommand):
+    help = (
+        'Exports every post with its author, topic, coordinates and photo '
+        'file names as a GeoJSON FeatureCollection or as NDJSON (one Feature '
+        'per line). Posts are streamed in batches, so memory stays flat. '
+        'Photo files themselves are not copied. Read back with import_posts.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', nargs='?', default='-', help='File to write, "-" for stdout.')
+        parser.add_argument('--format', choices=FORMATS,
+                            help='Defaults to ndjson for .ndjson/.jsonl files and geojson otherwise.')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Posts fetched per query.')
+
+    def handle(self, *args, **options):
+        output = options['output']
+        fmt = options['format'] or ('ndjson' if output.endswith(('.ndjson', '.jsonl')) else 'geojson')
+        # Progress goes to stderr when the data goes to stdout
+        self.progress = self.stderr if output == '-' else self.stdout
+        if output == '-':
+            count, elapsed = self.export(lambda text: self.stdout.write(text, ending=''), fmt, options['batch_size'])
+        else:
+            try:
+                file = open(output, 'w', encoding='utf-8')
+            except OSError as error:
+                raise CommandError(f'Cannot write {output}: {error}')
+            with file:
+                count, elapsed = self.export(file.write, fmt, options['batch_size'])
+        self.progress.write(self.style.SUCCESS(
+            f'Exported {count} post(s) in {elapsed:.1f}s, {count / max(elapsed, 1e-9):.0f} posts/s.'
+        ))
+
+    def export(self, write, fmt, batch_size):
+        rows = Post.objects.order_by('id').values(
+            'id', 'latitude', 'longitude', 'author__username', 'topic__name', *PROPERTIES,
+        ).iterator(chunk_size=batch_size)
+        encoder = json.JSONEncoder(ensure_ascii=False)
+        started = time.monotonic()
+        count = 0
+
+        if fmt == 'geojson':
+            write('{"type": "FeatureCollection", "features": [\n')
+        for row in rows:
+            if fmt == 'geojson' and count:
+                write(',\n')
+            write(encoder.encode(feature(row)))
+            if fmt == 'ndjson':
+                write('\n')
+            count += 1
+            if count % batch_size == 0:
+                elapsed = time.monotonic() - started
+                self.progress.write(f'  {count} posts, {count / elapsed:.0f} posts/s')
+        if fmt == 'geojson':
+            write('\n]}\n')
+        return count, time.monotonic() - started
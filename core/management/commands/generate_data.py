@@ -0,0 +1,204 @@
+import math
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from core import fragments, friends, geo, heatmap, map_cache, search, timeline
+from core.management.bulk import create_with_timestamps
+from core.models import Comment, Friendship, Like, Post, Topic
+
+# (name, latitude, longitude, weight, spread in degrees)
+CITIES = [
+    ('Hsinchu', 24.8138, 120.9675, 8, 0.05),
+    ('Taipei', 25.0330, 121.5654, 10, 0.08),
+    ('Taichung', 24.1477, 120.6736, 5, 0.06),
+    ('Kaohsiung', 22.6273, 120.3014, 5, 0.06),
+    ('Tokyo', 35.6762, 139.6503, 6, 0.15),
+    ('Seoul', 37.5665, 126.9780, 4, 0.1),
+    ('Hong Kong', 22.3193, 114.1694, 3, 0.05),
+    ('Singapore', 1.3521, 103.8198, 3, 0.06),
+    ('Bangkok', 13.7563, 100.5018, 3, 0.1),
+    ('London', 51.5072, -0.1276, 3, 0.12),
+    ('Paris', 48.8566, 2.3522, 3, 0.08),
+    ('New York', 40.7128, -74.0060, 3, 0.12),
+    ('San Francisco', 37.7749, -122.4194, 2, 0.06),
+    ('Sydney', -33.8688, 151.2093, 2, 0.1),
+    ('Auckland', -36.8509, 174.7645, 1, 0.08),
+]
+
+TOPICS = ['food', 'travel', 'hiking', 'beach', 'coffee', 'nightlife', 'museum', 'sunset', 'family', 'concert']
+
+WORDS = [
+    'amazing', 'morning', 'walk', 'noodles', 'view', 'friends', 'rain', 'market', 'temple', 'street',
+    'sunset', 'coffee', 'trail', 'river', 'mountain', 'dinner', 'festival', 'lanterns', 'bike', 'harbour',
+]
+
+# Share of posts without a location, like posts created without a map pin.
+UNLOCATED_SHARE = 0.05
+# How far back the generated posts go.
+HISTORY = timedelta(days=365)
+
+
+class Command(BaseCommand):
+    help = (
+        'Bulk-generates users, friendships, posts clustered around real cities, '
+        'comments and likes for load and performance testing.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Number of users to create.')
+        parser.add_argument('--posts', type=int, default=10000, help='Number of posts to create.')
+        parser.add_argument('--friends', type=int, default=20,
+                            help='Average number of friends per user.')
+        parser.add_argument('--comments', type=float, default=3,
+                            help='Average number of comments per post.')
+        parser.add_argument('--likes', type=float, default=5, help='Average number of likes per post.')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed, for repeatable datasets.')
+        parser.add_argument('--batch-size', type=int, default=2000,
+                            help='Rows per bulk_create and per transaction.')
+
+    def handle(self, *args, **options):
+        if options['users'] < 2 or options['posts'] < 1:
+            raise CommandError('Need at least 2 users and 1 post.')
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        started = time.monotonic()
+
+        prefix = f'seed{options["seed"]}_'
+        if User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(f'Users named {prefix}* exist already, pick another --seed.')
+        user_ids = self.create_users(prefix, options['users'])
+        friend_ids = self.create_friendships(user_ids, options['friends'])
+        topic_ids = [Topic.objects.get_or_create(name=name)[0].id for name in TOPICS]
+        posts, comments, likes = self.create_posts(
+            user_ids, friend_ids, topic_ids, options['posts'], options['comments'], options['likes']
+        )
+
+        # bulk_create skips the signals that keep these up to date
+        search.reindex()
+        heatmap.rebuild()
+        # What the signals would have invalidated: the whole map, as in
+        # import_posts, the topic lists and the friend graphs
+        map_cache.invalidate_all()
+        fragments.bump('topics')
+        friends.invalidate(*user_ids)
+        timeline.forget_heavy_users()
+        if timeline.enabled():
+            call_command('backfill_timeline', stdout=self.stdout)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {len(user_ids)} users, {sum(map(len, friend_ids.values())) // 2} friendships, '
+            f'{posts} posts, {comments} comments and {likes} likes in {elapsed:.1f}s.'
+        ))
+
+    def create_users(self, prefix, count):
+        # Every generated user logs in with the password "password"
+        password = make_password('password')
+        users = [User(username=f'{prefix}{index}', password=password) for index in range(count)]
+        for start in range(0, count, self.batch_size):
+            with transaction.atomic():
+                User.objects.bulk_create(users[start:start + self.batch_size])
+        return list(User.objects.filter(username__startswith=prefix).values_list('id', flat=True))
+
+    def create_friendships(self, user_ids, average):
+        """
+        Creates accepted friendships, both rows of each pair like the
+        accept view does. Returns {user_id: set of friend ids}.
+        """
+        friends = {user_id: set() for user_id in user_ids}
+        pairs = min(len(user_ids) * average // 2, len(user_ids) * (len(user_ids) - 1) // 2)
+        # A few popular users get far more friends than the rest
+        weights = [self.random.paretovariate(1.5) for _ in user_ids]
+        created = 0
+        rows = []
+        now = timezone.now()
+        while created < pairs:
+            a, b = self.random.choices(user_ids, weights, k=2)
+            if a == b or b in friends[a]:
+                continue
+            friends[a].add(b)
+            friends[b].add(a)
+            created += 1
+            rows += [
+                Friendship(from_user_id=a, to_user_id=b, status=Friendship.STATUS_ACCEPTED, created_at=now),
+                Friendship(from_user_id=b, to_user_id=a, status=Friendship.STATUS_ACCEPTED, created_at=now),
+            ]
+            if len(rows) >= self.batch_size:
+                self._insert(Friendship, rows)
+                rows = []
+        self._insert(Friendship, rows)
+        return friends
+
+    def create_posts(self, user_ids, friends, topic_ids, count, comments_per_post, likes_per_post):
+        now = timezone.now()
+        city_weights = [city[3] for city in CITIES]
+        # Post times in ascending order, so ids and created_at agree like in production
+        offsets = sorted((self.random.random() for _ in range(count)), reverse=True)
+        comment_total = like_total = 0
+
+        for start in range(0, count, self.batch_size):
+            posts = []
+            for offset in offsets[start:start + self.batch_size]:
+                created_at = now - HISTORY * offset
+                author_id = self.random.choice(user_ids)
+                post = Post(
+                    author_id=author_id,
+                    topic_id=self.random.choice(topic_ids),
+                    caption=' '.join(self.random.sample(WORDS, self.random.randint(3, 8))).capitalize(),
+                    created_at=created_at, updated_at=created_at,
+                    # The counters are filled in below, they must match the rows
+                    comment_count=self._poisson(comments_per_post),
+                    like_count=min(self._poisson(likes_per_post), len(friends[author_id]) or len(user_ids)),
+                )
+                if self.random.random() >= UNLOCATED_SHARE:
+                    _, lat, lon, _, spread = self.random.choices(CITIES, city_weights)[0]
+                    post.latitude = max(min(self.random.gauss(lat, spread), 90.0), -90.0)
+                    post.longitude = (self.random.gauss(lon, spread) + 180.0) % 360.0 - 180.0
+                    # bulk_create does not call Post.save()
+                    post.geohash = geo.encode(post.latitude, post.longitude)
+                posts.append(post)
+
+            with transaction.atomic():
+                self._insert(Post, posts)
+                comments, likes = [], []
+                for post in posts:
+                    # Mostly friends of the author react to a post
+                    audience = list(friends[post.author_id]) or user_ids
+                    for _ in range(post.comment_count):
+                        comments.append(Comment(
+                            post_id=post.id, author_id=self.random.choice(audience),
+                            text=' '.join(self.random.sample(WORDS, 4)),
+                            created_at=post.created_at + (now - post.created_at) * self.random.random() * 0.1,
+                        ))
+                    likes += [
+                        Like(post_id=post.id, user_id=user_id, created_at=post.created_at)
+                        for user_id in self.random.sample(audience, post.like_count)
+                    ]
+                self._insert(Comment, comments)
+                self._insert(Like, likes)
+
+            comment_total += len(comments)
+            like_total += len(likes)
+            self.stdout.write(f'  {min(start + self.batch_size, count)}/{count} posts')
+        return count, comment_total, like_total
+
+    def _poisson(self, mean):
+        # Knuth's method, fine for the small means used here
+        limit, k, p = math.exp(-mean), 0, 1.0
+        while True:
+            p *= self.random.random()
+            if p <= limit:
+                return k
+            k += 1
+
+    def _insert(self, model, rows):
+        if rows:
+            create_with_timestamps(model, rows, self.batch_size)
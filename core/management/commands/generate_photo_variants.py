@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from core import images, jobs
+from core.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Generates the resized variants of post photos that do not have them yet.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Regenerate variants that already exist.')
+        parser.add_argument('--queue', action='store_true',
+                            help='Queue one background job per photo for `run_jobs` instead of resizing here.')
+
+    def handle(self, *args, **options):
+        posts = Post.objects.exclude(photo='').exclude(photo__isnull=True)
+        if not options['force']:
+            # __in drops None, new posts store NULL in the variant columns
+            posts = posts.filter(Q(photo_thumb__isnull=True) | Q(photo_thumb=''))
+
+        if options['queue']:
+            queued = 0
+            for post_id in posts.values_list('id', flat=True).iterator():
+                jobs.enqueue('photo_variants', post_id=post_id)
+                queued += 1
+            self.stdout.write(self.style.SUCCESS(f'Queued {queued} job(s).'))
+            return
+
+        done = failed = 0
+        for post in posts.iterator(chunk_size=100):
+            try:
+                images.generate_variants(post)
+                done += 1
+            except (OSError, ValueError) as error:
+                failed += 1
+                self.stderr.write(f'Post {post.id} ({post.photo.name}): {error}')
+        self.stdout.write(self.style.SUCCESS(f'Generated variants for {done} post(s), {failed} failed.'))
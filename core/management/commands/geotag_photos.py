@@ -0,0 +1,86 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.db.models import Q
+
+from core import exif, heatmap, jobs, map_cache
+from core.models import Post
+
+BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = ('Reads GPS coordinates and capture times from the EXIF headers of existing post photos '
+            'and fills them in where the post has none.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Number of processes reading headers (default: one per core).')
+        parser.add_argument('--queue', action='store_true',
+                            help='Queue one background job per photo for `run_jobs` instead.')
+
+    def handle(self, *args, **options):
+        posts = Post.objects.exclude(photo='').exclude(photo__isnull=True).filter(
+            Q(latitude__isnull=True) | Q(taken_at__isnull=True)
+        )
+
+        if options['queue']:
+            queued = 0
+            for post_id in posts.values_list('id', flat=True).iterator():
+                jobs.enqueue('photo_metadata', post_id=post_id)
+                queued += 1
+            self.stdout.write(self.style.SUCCESS(f'Queued {queued} job(s).'))
+            return
+
+        # topic and created_at are what the heatmap counts a located post under
+        posts = list(posts.only('id', 'photo', 'latitude', 'longitude', 'taken_at', 'topic', 'created_at'))
+        paths = [post.photo.path for post in posts]
+        started = time.monotonic()
+
+        # Header parsing is CPU bound, spread it over fresh processes
+        connections.close_all()
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max(options['workers'], 1), mp_context=context) as pool:
+            results = pool.map(exif.read_path, paths, chunksize=64)
+
+            located = dated = 0
+            batch = []
+            for post, metadata in zip(posts, results):
+                changed = post.apply_photo_metadata(metadata)
+                located += 'latitude' in changed
+                dated += 'taken_at' in changed
+                if changed:
+                    batch.append((post, 'latitude' in changed))
+                if len(batch) >= BATCH_SIZE:
+                    self.save(batch)
+                    batch = []
+            self.save(batch)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Read {len(paths)} photo(s) in {elapsed:.1f}s: {located} geotagged, {dated} dated.'
+        ))
+
+    def save(self, batch):
+        """
+        Writes a batch of (post, located) pairs. bulk_update skips the post
+        signals, so the heatmap counts and the cached map responses are
+        brought up to date here.
+        """
+        if not batch:
+            return
+        located = [post for post, is_located in batch if is_located]
+        with transaction.atomic():
+            Post.objects.bulk_update([post for post, _ in batch], ['latitude', 'longitude', 'geohash', 'taken_at'])
+            # The posts had no location before, so they only enter the map
+            heatmap.add_posts(located)
+
+            def changed():
+                for post in located:
+                    map_cache.invalidate_point(post.latitude, post.longitude)
+
+            transaction.on_commit(changed)
@@ -0,0 +1,228 @@
+import json
+import re
+import sys
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from core import fragments, geo, heatmap, map_cache, search, timeline
+from core.management.bulk import create_with_timestamps
+from core.models import Post, Topic
+
+from .export_posts import FORMATS
+
+# Characters read from a GeoJSON file at a time.
+READ_SIZE = 1 << 16
+PHOTO_FIELDS = ('photo', 'photo_thumb', 'photo_medium', 'photo_large')
+
+_SEPARATORS = re.compile(r'[\s,]*')
+
+
+def read_ndjson(file):
+    for number, line in enumerate(file, 1):
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError as error:
+                raise CommandError(f'Line {number}: {error}')
+
+
+def read_geojson(file):
+    """
+    Yields the features of a FeatureCollection one at a time, so only the
+    current feature and one read buffer are ever in memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    while True:
+        start = buffer.find('"features"')
+        bracket = buffer.find('[', start) if start != -1 else -1
+        if bracket != -1:
+            break
+        chunk = file.read(READ_SIZE)
+        if not chunk:
+            raise CommandError('Not a FeatureCollection, found no "features" array.')
+        buffer += chunk
+
+    position = bracket + 1
+    while True:
+        position = _SEPARATORS.match(buffer, position).end()
+        if position < len(buffer) and buffer[position] == ']':
+            return
+        try:
+            if position == len(buffer):
+                raise ValueError('need more data')
+            feature, position = decoder.raw_decode(buffer, position)
+        except ValueError:
+            # A feature cut off at the end of the buffer, read on
+            chunk = file.read(READ_SIZE)
+            if not chunk:
+                raise CommandError('The features array is cut off or not valid JSON.')
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        yield feature
+
+
+def post_fields(feature):
+    """
+    Turns a Feature written by export_posts into Post field values, with
+    the author and topic as names. Raises ValueError.
+    """
+    if not isinstance(feature, dict) or feature.get('type') != 'Feature':
+        raise ValueError('not a GeoJSON Feature')
+    properties = feature.get('properties') or {}
+    if not properties.get('author'):
+        raise ValueError('no author')
+
+    latitude = longitude = None
+    geometry = feature.get('geometry')
+    if geometry:
+        if geometry.get('type') != 'Point':
+            raise ValueError('only Point geometries can be imported')
+        longitude, latitude = (float(value) for value in geometry['coordinates'][:2])
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            raise ValueError('coordinates out of range')
+
+    fields = {
+        'author': properties['author'],
+        'topic': properties.get('topic') or None,
+        'caption': properties.get('caption') or '',
+        'latitude': latitude,
+        'longitude': longitude,
+    }
+    for name in PHOTO_FIELDS:
+        fields[name] = properties.get(name) or None
+    for name in ('taken_at', 'created_at', 'updated_at'):
+        value = properties.get(name)
+        fields[name] = parse_datetime(value) if value else None
+        if value and fields[name] is None:
+            raise ValueError(f'{name} is not a date and time')
+    return fields
+
+
+class Command(BaseCommand):
+    help = (
+        'Imports posts written by export_posts (GeoJSON or NDJSON). The file '
+        'is streamed and posts are inserted with bulk_create, one transaction '
+        'per batch, with the authors and topics of a batch resolved in a few '
+        'queries. Photo fields keep the file names, the files have to be in '
+        'the media storage already. Importing the same file twice creates '
+        'the posts twice.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='File to read, "-" for stdin.')
+        parser.add_argument('--format', choices=FORMATS,
+                            help='Defaults to ndjson for .ndjson/.jsonl files and geojson otherwise.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Posts per bulk_create and transaction.')
+        parser.add_argument('--create-users', action='store_true',
+                            help='Create missing authors (with an unusable password) instead of failing.')
+
+    def handle(self, *args, **options):
+        path = options['input']
+        fmt = options['format'] or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'geojson')
+        read = read_ndjson if fmt == 'ndjson' else read_geojson
+        self.create_users = options['create_users']
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be positive.')
+
+        try:
+            file = sys.stdin if path == '-' else open(path, encoding='utf-8')
+        except OSError as error:
+            raise CommandError(f'Cannot read {path}: {error}')
+
+        started = time.monotonic()
+        count = 0
+        batch = []
+        try:
+            for number, feature in enumerate(read(file), 1):
+                try:
+                    batch.append(post_fields(feature))
+                except (KeyError, TypeError, ValueError) as error:
+                    raise CommandError(f'Feature {number}: {error}. {count} post(s) were imported before it.')
+                if len(batch) == batch_size:
+                    count += self.load(batch, count)
+                    batch = []
+                    elapsed = time.monotonic() - started
+                    self.stdout.write(f'  {count} posts, {count / elapsed:.0f} posts/s')
+            count += self.load(batch, count)
+        finally:
+            if file is not sys.stdin:
+                file.close()
+        elapsed = time.monotonic() - started
+
+        # The new pins may be on any tile, bump the whole map at once.
+        # Topics were bulk created without the signals that bump their lists.
+        map_cache.invalidate_all()
+        fragments.bump('topics')
+        if timeline.enabled():
+            call_command('backfill_timeline', stdout=self.stdout)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {count} post(s) in {elapsed:.1f}s, {count / max(elapsed, 1e-9):.0f} posts/s.'
+        ))
+
+    def load(self, batch, imported):
+        if not batch:
+            return 0
+        with transaction.atomic():
+            authors = self.authors({fields['author'] for fields in batch}, imported)
+            topics = self.topics({fields['topic'] for fields in batch if fields['topic']})
+            now = timezone.now()
+            posts = []
+            for fields in batch:
+                post = Post(
+                    author_id=authors[fields.pop('author')],
+                    topic_id=topics.get(fields.pop('topic')),
+                    **fields,
+                )
+                post.created_at = post.created_at or now
+                post.updated_at = post.updated_at or post.created_at
+                # bulk_create does not call Post.save()
+                if post.latitude is not None:
+                    post.geohash = geo.encode(post.latitude, post.longitude)
+                posts.append(post)
+            create_with_timestamps(Post, posts)
+            # bulk_create skips the signals that keep these up to date
+            search.index_posts(posts)
+            heatmap.add_posts(posts)
+        return len(posts)
+
+    def authors(self, usernames, imported):
+        """
+        Returns {username: id}, creating the missing users if asked to.
+        """
+        found = dict(User.objects.filter(username__in=usernames).values_list('username', 'id'))
+        missing = usernames - found.keys()
+        if missing and not self.create_users:
+            raise CommandError(
+                f'Unknown author(s): {", ".join(sorted(missing)[:10])}. Use --create-users to create them. '
+                f'{imported} post(s) were imported before them.'
+            )
+        if missing:
+            password = make_password(None)
+            User.objects.bulk_create([User(username=username, password=password) for username in missing])
+            found.update(User.objects.filter(username__in=missing).values_list('username', 'id'))
+        return found
+
+    def topics(self, names):
+        """
+        Returns {name: id}, creating the missing topics.
+        """
+        found = {}
+        # Topic names are not unique in the schema, use the oldest
+        for name, topic_id in Topic.objects.filter(name__in=names).order_by('id').values_list('name', 'id'):
+            found.setdefault(name, topic_id)
+        missing = names - found.keys()
+        if missing:
+            Topic.objects.bulk_create([Topic(name=name) for name in missing])
+            found.update(Topic.objects.filter(name__in=missing).values_list('name', 'id'))
+        return found
@@ -0,0 +1,95 @@
+import http.client
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Load tests a running server: keeps --concurrency clients requesting '
+        'the given URLs for --duration seconds and reports requests/second '
+        'and latency percentiles. Run it once against the WSGI and once '
+        'against the ASGI server to compare them (see GeoMemories/asgi.py).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='+',
+                            help='Absolute URLs to request, cycled through by every client.')
+        parser.add_argument('--concurrency', type=int, default=50,
+                            help='Number of concurrent clients.')
+        parser.add_argument('--duration', type=float, default=10.0,
+                            help='Seconds to keep the load up.')
+        parser.add_argument('--cookie', default='',
+                            help='Cookie header to send, e.g. "sessionid=..." for the feed.')
+
+    def handle(self, *args, **options):
+        targets = []
+        for url in options['urls']:
+            parts = urlsplit(url)
+            if parts.scheme not in ('http', 'https') or not parts.netloc:
+                raise CommandError(f'Not an absolute http(s) URL: {url}')
+            path = parts.path + (f'?{parts.query}' if parts.query else '')
+            targets.append((parts.scheme, parts.netloc, path or '/'))
+
+        headers = {'Cookie': options['cookie']} if options['cookie'] else {}
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+        deadline = time.monotonic() + options['duration']
+
+        def client(offset):
+            # One keep-alive connection per host, like a browser would use
+            connections = {}
+            for scheme, netloc, path in itertools.islice(itertools.cycle(targets), offset, None):
+                if time.monotonic() >= deadline:
+                    break
+                if (scheme, netloc) not in connections:
+                    factory = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+                    connections[scheme, netloc] = factory(netloc, timeout=30)
+                connection = connections[scheme, netloc]
+                started = time.perf_counter()
+                try:
+                    connection.request('GET', path, headers=headers)
+                    response = connection.getresponse()
+                    response.read()
+                    status = response.status
+                except (OSError, http.client.HTTPException) as error:
+                    connection.close()
+                    del connections[scheme, netloc]
+                    with lock:
+                        errors.append(type(error).__name__)
+                    continue
+                elapsed = time.perf_counter() - started
+                with lock:
+                    if status >= 400:
+                        errors.append(str(status))
+                    else:
+                        latencies.append(elapsed)
+            for connection in connections.values():
+                connection.close()
+
+        concurrency = max(options['concurrency'], 1)
+        started = time.monotonic()
+        with ThreadPoolExecutor(concurrency) as pool:
+            list(pool.map(client, range(concurrency)))
+        elapsed = time.monotonic() - started
+
+        latencies.sort()
+        self.stdout.write(f'{len(latencies)} request(s) in {elapsed:.1f}s with {concurrency} client(s)')
+        self.stdout.write(self.style.SUCCESS(f'{len(latencies) / elapsed:.1f} requests/second'))
+        self.stdout.write('latency ms: p50 {:.1f}  p95 {:.1f}  p99 {:.1f}  max {:.1f}'.format(
+            *(1000 * _percentile(latencies, fraction) for fraction in (0.5, 0.95, 0.99, 1.0))
+        ))
+        if errors:
+            counts = {error: errors.count(error) for error in sorted(set(errors))}
+            self.stderr.write('errors: ' + ', '.join(f'{error} x{count}' for error, count in counts.items()))
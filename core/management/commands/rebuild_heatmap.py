@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from core import heatmap, jobs
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the heatmap aggregate (HeatmapCell) from the posts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queue', action='store_true', help='Queue a background job instead of running now.')
+
+    def handle(self, *args, **options):
+        if options['queue']:
+            queued = jobs.enqueue('rebuild_heatmap')
+            self.stdout.write(self.style.SUCCESS(f'Queued {queued}.'))
+            return
+        rows = heatmap.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt the heatmap, {rows} cell row(s).'))
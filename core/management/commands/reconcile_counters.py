@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from core import counters, jobs
+
+
+class Command(BaseCommand):
+    help = 'Recomputes Post.like_count and Post.comment_count from the Like and Comment tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queue', action='store_true', help='Queue a background job instead of running now.')
+
+    def handle(self, *args, **options):
+        if options['queue']:
+            queued = jobs.enqueue('reconcile_counters')
+            self.stdout.write(self.style.SUCCESS(f'Queued {queued}.'))
+            return
+        fixed = counters.reconcile()
+        self.stdout.write(self.style.SUCCESS(f'Reconciled counters, {fixed} post(s) had drifted.'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search index of post captions and topics.'
+
+    def handle(self, *args, **options):
+        if not search.available():
+            self.stdout.write('The database has no FTS5 index, search uses icontains filters.')
+            return
+        count = search.reindex()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} post(s).'))
@@ -0,0 +1,88 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core import jobs, worker
+
+
+class Command(BaseCommand):
+    help = 'Runs queued background jobs on a pool of worker processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Number of worker processes (default: one per core).')
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='Seconds to wait for new jobs when the queue is empty.')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit as soon as the queue is empty.')
+
+    def start_pool(self, workers):
+        # Fresh interpreters rather than forks, so no worker inherits an open
+        # database connection from this process.
+        connections.close_all()
+        context = multiprocessing.get_context('spawn')
+        return ProcessPoolExecutor(workers, mp_context=context, initializer=worker.setup)
+
+    def handle(self, *args, **options):
+        workers = max(options['workers'], 1)
+        running = {}
+        self.done = self.failed = 0
+        beat = time.monotonic()
+        pool = self.start_pool(workers)
+        self.stdout.write(f'Running jobs with {workers} worker process(es).')
+        try:
+            while True:
+                if time.monotonic() - beat >= jobs.HEARTBEAT_INTERVAL.total_seconds():
+                    # Our own long jobs must not look lost to requeue_stale()
+                    jobs.heartbeat([queued.id for queued in running.values()])
+                    beat = time.monotonic()
+                jobs.requeue_stale()
+
+                broken = False
+                for queued in jobs.claim(workers - len(running)):
+                    try:
+                        running[pool.submit(worker.execute, queued.name, queued.payload)] = queued
+                    except BrokenProcessPool as error:
+                        self.finish(queued, error)
+                        broken = True
+
+                if not running and not broken:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                finished, _ = wait(running, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                for future in finished:
+                    error = future.exception()
+                    broken = broken or isinstance(error, BrokenProcessPool)
+                    self.finish(running.pop(future), error)
+
+                if broken:
+                    # A worker process died (killed, out of memory, crashed
+                    # in C code) and took the pool down. Its jobs can't be
+                    # told apart, so every job still in the pool fails this
+                    # attempt, a job that keeps crashing its worker ends up
+                    # failed, and the others are retried on a new pool.
+                    for future, queued in running.items():
+                        self.finish(queued, BrokenProcessPool('A worker process terminated abruptly'))
+                    running = {}
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    pool = self.start_pool(workers)
+        finally:
+            pool.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(f'{self.done} job(s) done, {self.failed} failed.'))
+
+    def finish(self, queued, error):
+        jobs.finish(queued, None if error is None else f'{type(error).__name__}: {error}')
+        if error is None:
+            self.done += 1
+        else:
+            self.failed += 1
+            self.stderr.write(f'{queued.name} #{queued.id} failed: {error}')
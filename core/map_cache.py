@@ -0,0 +1,92 @@
+"""
+Version counters for the cacheable map responses.
+
+Every slippy map tile has a version stored in the cache. The tile endpoint
+uses it both as its ETag and as part of the key of the cached response
+body, so bumping a version invalidates exactly that tile. When a post is
+created, moved or deleted we bump the one tile per zoom level that contains
+its old and new position. Bulk loads bump one version for the whole map
+instead, and a tile is at the later of its own version and that one.
+
+The posts API has a single version for all pins, bumped by the same calls.
+Versions are time.time_ns() values, so they double as Last-Modified dates.
+"""
+
+import hashlib
+import time
+
+from django.core.cache import cache
+
+from . import geo
+
+# Highest zoom level the map page requests tiles for (Leaflet maxZoom).
+TILE_MAX_ZOOM = 19
+
+
+def _version_key(z, x, y):
+    return f'map:tile:{z}:{x}:{y}:version'
+
+
+MAP_VERSION_KEY = 'map:version'
+POSTS_VERSION_KEY = 'map:posts:version'
+
+
+def _version(key):
+    # A version that has never been seen (or was evicted) gets a fresh
+    # value, which only costs a refetch.
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key, time.time_ns())
+    return version
+
+
+def tile_version(z, x, y):
+    """
+    Returns the current version of a tile.
+    """
+    keys = [_version_key(z, x, y), MAP_VERSION_KEY]
+    found = cache.get_many(keys)
+    return max(found[key] if key in found else _version(key) for key in keys)
+
+
+def posts_version():
+    """
+    Returns the current version of the posts API, which changes whenever
+    any pin does.
+    """
+    return _version(POSTS_VERSION_KEY)
+
+
+def posts_body_key(version, query):
+    return f'map:posts:body:{version}:{hashlib.md5(query.encode()).hexdigest()}'
+
+
+def tile_body_key(z, x, y, version, fmt='json'):
+    return f'map:tile:{z}:{x}:{y}:body:{fmt}:{version}'
+
+
+def invalidate_point(lat, lon):
+    """
+    Bumps the version of every tile, at every zoom level, containing the
+    given point. Posts without coordinates are not on the map, so None is
+    accepted and ignored.
+    """
+    if lat is None or lon is None:
+        return
+    version = time.time_ns()
+    versions = {
+        _version_key(z, *geo.tile_for_point(lat, lon, z)): version
+        for z in range(TILE_MAX_ZOOM + 1)
+    }
+    versions[POSTS_VERSION_KEY] = version
+    cache.set_many(versions, None)
+
+
+def invalidate_all():
+    """
+    Bumps the version of every tile and of the posts API, for bulk loads
+    that touch too many tiles to bump them one by one.
+    """
+    version = time.time_ns()
+    cache.set_many({MAP_VERSION_KEY: version, POSTS_VERSION_KEY: version}, None)
@@ -0,0 +1,261 @@
+import cProfile
+import functools
+import json
+import logging
+import random
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import async_to_sync, iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.backends.django import Template as DjangoTemplate
+from django.urls import reverse
+from django.utils.deprecation import MiddlewareMixin
+
+from . import profiling
+from whitenoise.middleware import WhiteNoiseMiddleware as BaseWhiteNoiseMiddleware
+
+
+class WhiteNoiseMiddleware(BaseWhiteNoiseMiddleware):
+    """
+    WhiteNoise that can also sit in an async middleware chain.
+
+    Django runs the whole chain below a sync-only middleware in sync mode,
+    so under ASGI the stock WhiteNoise would turn every async view back
+    into a sync one on a worker thread.
+    """
+    async_capable = True
+
+    def __init__(self, get_response, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return await self.get_response(request)
+
+
+# A request running the same SQL this many times is logged as a likely N+1.
+DUPLICATE_QUERY_LIMIT = 5
+
+logger = logging.getLogger('core.performance')
+
+# Stats of the request being measured, seen by the query wrapper and the
+# template patch. Context variables follow sync_to_async onto its threads.
+_current = ContextVar('performance_stats', default=None)
+
+
+class _Stats:
+    __slots__ = ('queries', 'query_time', 'template_time', 'statements', 'trace')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+        self.template_time = 0.0
+        self.statements = Counter()
+        # A list of the queries while a request is being profiled
+        self.trace = None
+
+
+def _record_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        stats.query_time += elapsed
+        stats.queries += 1
+        stats.statements[sql] += 1
+        if stats.trace is not None and len(stats.trace) < profiling.MAX_TRACE_QUERIES:
+            stats.trace.append({'sql': sql, 'params': repr(params)[:500], 'ms': round(elapsed * 1000, 2)})
+
+
+def _install_wrapper(connection, **kwargs):
+    # Left installed for the life of the connection, it does nothing
+    # outside measured requests
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+def _timed_render(render):
+    @functools.wraps(render)
+    def wrapper(self, *args, **kwargs):
+        stats = _current.get()
+        if stats is None:
+            return render(self, *args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return render(self, *args, **kwargs)
+        finally:
+            stats.template_time += time.perf_counter() - started
+    wrapper.timed = True
+    return wrapper
+
+
+def _install():
+    connection_created.connect(_install_wrapper, dispatch_uid='core.performance')
+    for connection in connections.all(initialized_only=True):
+        _install_wrapper(connection)
+    # Backend templates wrap every render() and render_to_string()
+    if not getattr(DjangoTemplate.render, 'timed', False):
+        DjangoTemplate.render = _timed_render(DjangoTemplate.render)
+
+
+class PerformanceMiddleware:
+    """
+    Measures a sample of requests: wall time, number and time of the SQL
+    queries, template render time and response size.
+
+    Sets a Server-Timing header, logs one JSON line per measured request to
+    the "core.performance" logger and warns when a view runs the same query
+    DUPLICATE_QUERY_LIMIT times or more. PERF_SAMPLE_RATE picks the share
+    of requests measured; the rest only pay for a random number. Streamed
+    bodies are produced after the middleware returns and are not included.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = settings.PERF_SAMPLE_RATE
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        if self.sample_rate <= 0:
+            raise MiddlewareNotUsed
+        _install()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if random.random() >= self.sample_rate:
+            return self.get_response(request)
+        stats = _Stats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.report(request, response, stats, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        if random.random() >= self.sample_rate:
+            return await self.get_response(request)
+        stats = _Stats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.report(request, response, stats, time.perf_counter() - started)
+        return response
+
+    def report(self, request, response, stats, elapsed):
+        match = request.resolver_match
+        view = match.view_name if match else None
+        if response.streaming:
+            size = int(response['Content-Length']) if response.has_header('Content-Length') else None
+        else:
+            size = len(response.content)
+
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={stats.query_time * 1000:.1f};desc="{stats.queries} queries"',
+            f'tpl;dur={stats.template_time * 1000:.1f}',
+            f'total;dur={elapsed * 1000:.1f}',
+        ])
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'view': view,
+            'status': response.status_code,
+            'ms': round(elapsed * 1000, 1),
+            'queries': stats.queries,
+            'db_ms': round(stats.query_time * 1000, 1),
+            'template_ms': round(stats.template_time * 1000, 1),
+            'bytes': size,
+        }))
+
+        if stats.statements:
+            sql, count = stats.statements.most_common(1)[0]
+            if count >= DUPLICATE_QUERY_LIMIT:
+                logger.warning('%s ran the same query %d times (%d queries in total): %s',
+                               view or request.path, count, stats.queries, sql)
+
+
+class ProfilingMiddleware(MiddlewareMixin):
+    """
+    Runs a staff request under cProfile when it has ?profile=1 or an
+    X-Profile header, and stores the profile with its SQL trace (see
+    core.profiling). The response gets an X-Profile header with the URL of
+    the stored profile.
+
+    Must come after AuthenticationMiddleware. Only the view is profiled.
+    An async view gets its own event loop on a second thread, so its
+    coroutines and its sync_to_async calls are both in the profile.
+    """
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not ('profile' in request.GET or 'X-Profile' in request.headers):
+            return None
+        if not request.user.is_staff:
+            return None
+        _install()
+
+        stats = _current.get()
+        token = None
+        if stats is None:
+            stats = _Stats()
+            token = _current.set(stats)
+        stats.trace = []
+        queries = stats.queries
+        profiler = cProfile.Profile()
+        loop_profiler = cProfile.Profile()
+        started = time.perf_counter()
+        try:
+            profiler.enable()
+            try:
+                if iscoroutinefunction(view_func):
+                    async def profiled():
+                        loop_profiler.enable()
+                        try:
+                            return await view_func(request, *view_args, **view_kwargs)
+                        finally:
+                            loop_profiler.disable()
+                    response = async_to_sync(profiled, force_new_loop=True)()
+                else:
+                    response = view_func(request, *view_args, **view_kwargs)
+            finally:
+                profiler.disable()
+            elapsed = time.perf_counter() - started
+            trace = stats.trace
+        finally:
+            stats.trace = None
+            if token is not None:
+                _current.reset(token)
+
+        profilers = [profiler] + ([loop_profiler] if loop_profiler.getstats() else [])
+        profile_id = profiling.save(
+            profilers, request, request.resolver_match.view_name, elapsed, trace, stats.queries - queries,
+        )
+        response['X-Profile'] = reverse('profile-detail', args=[profile_id])
+        return response
@@ -0,0 +1,33 @@
+from django.db import migrations, models
+
+from core import geo
+
+
+def fill_geohash(apps, schema_editor):
+    Post = apps.get_model('core', 'Post')
+    posts = Post.objects.filter(latitude__isnull=False, longitude__isnull=False).only('id', 'latitude', 'longitude')
+    batch = []
+    for post in posts.iterator(chunk_size=2000):
+        post.geohash = geo.encode(post.latitude, post.longitude)
+        batch.append(post)
+        if len(batch) >= 2000:
+            Post.objects.bulk_update(batch, ['geohash'])
+            batch = []
+    if batch:
+        Post.objects.bulk_update(batch, ['geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_alter_post_latitude_alter_post_longitude_friendship'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=10),
+        ),
+        migrations.RunPython(fill_geohash, migrations.RunPython.noop),
+    ]
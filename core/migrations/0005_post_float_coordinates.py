@@ -0,0 +1,60 @@
+from django.db import migrations, models
+from django.db.models import F
+from django.db.models.functions import Cast
+
+
+def copy_coordinates(apps, schema_editor):
+    # One UPDATE statement, the database does the decimal -> float conversion
+    Post = apps.get_model('core', 'Post')
+    Post.objects.update(
+        latitude_float=Cast(F('latitude'), models.FloatField()),
+        longitude_float=Cast(F('longitude'), models.FloatField()),
+    )
+
+
+def copy_coordinates_back(apps, schema_editor):
+    Post = apps.get_model('core', 'Post')
+    Post.objects.update(latitude=F('latitude_float'), longitude=F('longitude_float'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_post_geohash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='latitude_float',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='longitude_float',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.RunPython(copy_coordinates, copy_coordinates_back),
+        migrations.RemoveField(
+            model_name='post',
+            name='latitude',
+        ),
+        migrations.RemoveField(
+            model_name='post',
+            name='longitude',
+        ),
+        migrations.RenameField(
+            model_name='post',
+            old_name='latitude_float',
+            new_name='latitude',
+        ),
+        migrations.RenameField(
+            model_name='post',
+            old_name='longitude_float',
+            new_name='longitude',
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['latitude', 'longitude'], name='core_post_lat_lon_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.5 on 2026-10-18 12:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_post_float_coordinates'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['created_at', 'id'], name='core_post_created_id_idx'),
+        ),
+    ]
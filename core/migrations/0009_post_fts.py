@@ -0,0 +1,33 @@
+from django.db import migrations
+
+
+def create_index(apps, schema_editor):
+    # FTS5 is SQLite only, other databases search with icontains
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE core_post_fts USING fts5("
+        "caption, topic, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    )
+    schema_editor.execute(
+        "INSERT INTO core_post_fts (rowid, caption, topic) "
+        "SELECT post.id, post.caption, COALESCE(topic.name, '') "
+        "FROM core_post post LEFT JOIN core_topic topic ON topic.id = post.topic_id"
+    )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE core_post_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_timelineentry'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.5 on 2026-10-18 12:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_post_fts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='photo_large',
+            field=models.ImageField(blank=True, editable=False, null=True, upload_to='post_photos/variants/'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='photo_medium',
+            field=models.ImageField(blank=True, editable=False, null=True, upload_to='post_photos/variants/'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='photo_thumb',
+            field=models.ImageField(blank=True, editable=False, null=True, upload_to='post_photos/variants/'),
+        ),
+    ]
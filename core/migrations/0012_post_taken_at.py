@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 12:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='taken_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
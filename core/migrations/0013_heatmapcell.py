@@ -0,0 +1,42 @@
+# Generated by Django 5.2.5 on 2026-10-18 12:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import Substr, TruncDate
+
+
+def fill_heatmap(apps, schema_editor):
+    Post = apps.get_model('core', 'Post')
+    HeatmapCell = apps.get_model('core', 'HeatmapCell')
+    # core.heatmap.PRECISIONS when this migration was written
+    for precision in range(1, 8):
+        rows = Post.objects.exclude(geohash='').order_by().values(
+            'topic_id', cell=Substr('geohash', 1, precision), day=TruncDate('created_at'),
+        ).annotate(count=Count('id'))
+        HeatmapCell.objects.bulk_create((HeatmapCell(precision=precision, **row) for row in rows), batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_post_taken_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HeatmapCell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('precision', models.PositiveSmallIntegerField()),
+                ('cell', models.CharField(max_length=10)),
+                ('day', models.DateField()),
+                ('count', models.IntegerField(default=0)),
+                ('topic', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.topic')),
+            ],
+            options={
+                'unique_together': {('precision', 'cell', 'topic', 'day')},
+            },
+        ),
+        migrations.RunPython(fill_heatmap, migrations.RunPython.noop),
+    ]
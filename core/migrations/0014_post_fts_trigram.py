@@ -0,0 +1,50 @@
+import sqlite3
+
+from django.db import migrations
+
+
+def _fill(schema_editor):
+    schema_editor.execute(
+        "INSERT INTO core_post_fts (rowid, caption, topic) "
+        "SELECT post.id, post.caption, COALESCE(topic.name, '') "
+        "FROM core_post post LEFT JOIN core_topic topic ON topic.id = post.topic_id"
+    )
+
+
+def use_trigrams(apps, schema_editor):
+    # unicode61 keeps a run of CJK characters as one token and only matches
+    # word prefixes. Trigrams match any substring of 3 or more characters,
+    # like the icontains search they replace. SQLite 3.34 added them, older
+    # versions drop the index and search with icontains.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE IF EXISTS core_post_fts')
+    if sqlite3.sqlite_version_info < (3, 34):
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE core_post_fts USING fts5("
+        "caption, topic, tokenize='trigram')"
+    )
+    _fill(schema_editor)
+
+
+def use_words(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE IF EXISTS core_post_fts')
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE core_post_fts USING fts5("
+        "caption, topic, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    )
+    _fill(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_heatmapcell'),
+    ]
+
+    operations = [
+        migrations.RunPython(use_trigrams, use_words),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.5 on 2026-10-18 13:59
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def merge_duplicates(apps, schema_editor):
+    # Rows without a topic could repeat so far, sum each group into its
+    # first row before they have to be unique
+    HeatmapCell = apps.get_model('core', 'HeatmapCell')
+    duplicates = HeatmapCell.objects.filter(topic__isnull=True).order_by().values(
+        'precision', 'cell', 'day',
+    ).annotate(rows=Count('id'), total=Sum('count')).filter(rows__gt=1)
+    for group in list(duplicates):
+        rows = HeatmapCell.objects.filter(
+            topic__isnull=True, precision=group['precision'], cell=group['cell'], day=group['day'],
+        ).order_by('id')
+        keep = rows.values_list('id', flat=True).first()
+        rows.exclude(id=keep).delete()
+        HeatmapCell.objects.filter(id=keep).update(count=group['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_post_fts_trigram'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='heatmapcell',
+            constraint=models.UniqueConstraint(condition=models.Q(('topic__isnull', True)), fields=('precision', 'cell', 'day'), name='core_heatmapcell_no_topic_uniq'),
+        ),
+    ]
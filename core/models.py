@@ -1,6 +1,9 @@
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import User
 
+from . import geo
+
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     
@@ -24,17 +27,112 @@ class Post(models.Model):
     topic = models.ForeignKey(Topic, on_delete=models.SET_NULL, null=True)
     caption = models.TextField()
     photo = models.ImageField(upload_to='post_photos/', blank=True, null=True)
-    latitude = models.DecimalField(max_digits=20, decimal_places=15, null=True, blank=True)
-    longitude = models.DecimalField(max_digits=20, decimal_places=15, null=True, blank=True)
+    # Resized copies of the photo, generated by core.images
+    photo_thumb = models.ImageField(upload_to='post_photos/variants/', blank=True, null=True, editable=False)
+    photo_medium = models.ImageField(upload_to='post_photos/variants/', blank=True, null=True, editable=False)
+    photo_large = models.ImageField(upload_to='post_photos/variants/', blank=True, null=True, editable=False)
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    # When the photo was taken, from its EXIF header
+    taken_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # Spatial index key, derived from latitude/longitude in save()
+    geohash = models.CharField(max_length=geo.GEOHASH_PRECISION, blank=True, default='', db_index=True, editable=False)
+    # Denormalized counters, maintained by core.counters
+    like_count = models.IntegerField(default=0, editable=False)
+    comment_count = models.IntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['latitude', 'longitude'], name='core_post_lat_lon_idx'),
+            # Keyset pagination of the feed orders by (created_at, id)
+            models.Index(fields=['created_at', 'id'], name='core_post_created_id_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember where the pin was, so core.signals can refresh the old
+        # spot on the map when the post moves or is deleted.
+        instance._loaded_location = (instance.__dict__.get('latitude'), instance.__dict__.get('longitude'))
+        # and the topic, for the heatmap counts
+        instance._loaded_topic_id = instance.__dict__.get('topic_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        # Keep the geohash in sync with the coordinates so map lookups can use the index
+        if self.latitude is not None and self.longitude is not None:
+            self.geohash = geo.encode(self.latitude, self.longitude)
+        else:
+            self.geohash = ''
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'geohash'}
+        super().save(*args, **kwargs)
+
+    def apply_photo_metadata(self, metadata):
+        """
+        Fills the coordinates and capture time from core.exif metadata where
+        they are still missing. Returns the names of the fields it changed.
+        """
+        changed = []
+        if (self.latitude is None or self.longitude is None) and metadata['latitude'] is not None:
+            self.latitude, self.longitude = metadata['latitude'], metadata['longitude']
+            changed += ['latitude', 'longitude', 'geohash']
+            self.geohash = geo.encode(self.latitude, self.longitude)
+        if self.taken_at is None and metadata['taken_at'] is not None:
+            taken_at = metadata['taken_at']
+            if timezone.is_naive(taken_at):
+                taken_at = timezone.make_aware(taken_at)
+            self.taken_at = taken_at
+            changed.append('taken_at')
+        return changed
+
+    def _variant_url(self, variant):
+        # Fall back to the original until the variants have been generated
+        if variant:
+            return variant.url
+        return self.photo.url if self.photo else ''
+
+    @property
+    def photo_thumb_url(self):
+        return self._variant_url(self.photo_thumb)
+
+    @property
+    def photo_medium_url(self):
+        return self._variant_url(self.photo_medium)
+
+    @property
+    def photo_large_url(self):
+        return self._variant_url(self.photo_large)
 
     def __str__(self):
         return f'Post by {self.author.username} at {self.created_at.strftime("%Y-%m-%d %H:%M")}'
 
+class TimelineEntry(models.Model):
+    """
+    One post in one user's home timeline. Rows are written when the post is
+    created (fan-out on write) so the home feed is a single indexed range
+    over (owner, created_at). See core.timeline.
+    """
+    owner = models.ForeignKey(User, related_name='timeline_entries', on_delete=models.CASCADE)
+    post = models.ForeignKey(Post, related_name='+', on_delete=models.CASCADE)
+    # Copied from the post so that removing a friend can drop their entries
+    author = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    # Copied from the post, the sort key of the timeline
+    created_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('owner', 'post')
+        indexes = [
+            models.Index(fields=['owner', 'created_at', 'post'], name='core_timeline_owner_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.post} in the timeline of {self.owner.username}'
+
 class Comment(models.Model):
     post = models.ForeignKey(Post, related_name='comments', on_delete=models.CASCADE)
     author = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -85,3 +183,66 @@ class Friendship(models.Model):
 
     def __str__(self):
         return f'Request from {self.from_user.username} to {self.to_user.username} - {self.get_status_display()}'
+
+
+class Job(models.Model):
+    """
+    A unit of background work, e.g. resizing a photo. Jobs are queued with
+    core.jobs.enqueue and executed by `manage.py run_jobs`.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    # Pending jobs are not picked up before this time (used for retry backoff)
+    run_after = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='core_job_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.name} #{self.id} - {self.get_status_display()}'
+
+
+class HeatmapCell(models.Model):
+    """
+    The number of posts in one geohash cell for one topic and day, kept at
+    several precisions by core.heatmap so the heatmap API reads a small
+    aggregate instead of scanning posts.
+    """
+    precision = models.PositiveSmallIntegerField()
+    cell = models.CharField(max_length=geo.GEOHASH_PRECISION)
+    # Posts without a topic count under NULL
+    topic = models.ForeignKey(Topic, related_name='+', null=True, on_delete=models.SET_NULL)
+    day = models.DateField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('precision', 'cell', 'topic', 'day')
+        constraints = [
+            # NULLs never compare equal, so the above leaves the rows
+            # without a topic free to repeat
+            models.UniqueConstraint(fields=['precision', 'cell', 'day'], condition=models.Q(topic__isnull=True),
+                                    name='core_heatmapcell_no_topic_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.count} post(s) in {self.cell} on {self.day}'
@@ -0,0 +1,99 @@
+"""
+Keyset ("cursor") pagination.
+
+Instead of OFFSET, each page remembers the sort key of its last row and the
+next page asks for the rows strictly after it. With an index on the sort
+columns every page is a short index range scan, however deep the user
+scrolls, and rows inserted at the top do not shift later pages.
+"""
+
+import base64
+import datetime
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+# Number of posts per feed page.
+FEED_PAGE_SIZE = 20
+
+
+def encode_cursor(values):
+    """
+    Packs the sort key of a row into an opaque URL-safe token.
+    """
+    values = [v.isoformat() if isinstance(v, datetime.datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """
+    Reverses encode_cursor. Raises ValueError for a malformed token.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (TypeError, ValueError, UnicodeDecodeError) as error:
+        raise ValueError('Invalid cursor') from error
+    if not isinstance(values, list) or not all(isinstance(v, (str, int, float)) for v in values):
+        raise ValueError('Invalid cursor')
+    return values
+
+
+def _parse(queryset, name, value):
+    # Cursors come from clients, turn each value into what its column holds
+    # so a bad one is a ValueError and not an error from the database.
+    try:
+        field = queryset.model._meta.get_field(name)
+    except FieldDoesNotExist:
+        field = queryset.query.annotations[name].output_field
+    try:
+        return field.to_python(value)
+    except (TypeError, ValidationError) as error:
+        raise ValueError('Invalid cursor') from error
+
+
+def _after(ordering, values):
+    # (a, b) after (x, y) in descending order is: a < x OR (a = x AND b < y)
+    condition = Q()
+    for index, field in enumerate(ordering):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        step = Q(**{f'{name}__{lookup}': values[index]})
+        for previous, value in zip(ordering[:index], values):
+            step &= Q(**{previous.lstrip('-'): value})
+        condition |= step
+    return condition
+
+
+def _page_rows(queryset, cursor, ordering, size):
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != len(ordering):
+            raise ValueError('Invalid cursor')
+        values = [_parse(queryset, field.lstrip('-'), value) for field, value in zip(ordering, values)]
+        queryset = queryset.filter(_after(ordering, values))
+    return queryset[:size + 1]
+
+
+def _page(rows, ordering, size):
+    if len(rows) <= size:
+        return rows, None
+    last = rows[size - 1]
+    return rows[:size], encode_cursor([getattr(last, field.lstrip('-')) for field in ordering])
+
+
+def keyset_page(queryset, cursor=None, ordering=('-created_at', '-id'), size=FEED_PAGE_SIZE):
+    """
+    Returns (rows, next_cursor) for the page of `queryset` following
+    `cursor`. `ordering` must end with a unique field so the key is total.
+    next_cursor is None on the last page.
+    """
+    return _page(list(_page_rows(queryset, cursor, ordering, size)), ordering, size)
+
+
+async def akeyset_page(queryset, cursor=None, ordering=('-created_at', '-id'), size=FEED_PAGE_SIZE):
+    """
+    Async version of keyset_page.
+    """
+    return _page([row async for row in _page_rows(queryset, cursor, ordering, size)], ordering, size)
@@ -0,0 +1,111 @@
+"""
+Stored request profiles.
+
+Staff can profile a single request by adding ?profile=1 or an X-Profile
+header (core.middleware.ProfilingMiddleware). Each profile is kept in
+PROFILE_DIR as two files: <id>.prof, the cProfile data that pstats and
+tools like snakeviz read, and <id>.json with the request details and its
+SQL trace. Only the newest PROFILE_MAX_COUNT profiles are kept.
+"""
+
+import io
+import json
+import os
+import pstats
+import re
+import uuid
+from datetime import datetime
+
+from django.conf import settings
+
+# The SQL trace of one profile stops after this many queries.
+MAX_TRACE_QUERIES = 1000
+# Functions listed on the profile page.
+REPORT_LINES = 60
+
+_ID = re.compile(r'^\d{8}-\d{6}-\d{6}-[0-9a-f]{4}$')
+
+
+def _path(profile_id, extension):
+    if not _ID.match(profile_id):
+        raise FileNotFoundError(profile_id)
+    return os.path.join(settings.PROFILE_DIR, f'{profile_id}.{extension}')
+
+
+def save(profilers, request, view, elapsed, trace, queries):
+    """
+    Stores the merged stats of `profilers` with the request details and SQL
+    trace, drops the oldest profiles over the cap and returns the new id.
+    """
+    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+    # Ids sort by time, which is what the retention cap relies on
+    profile_id = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{uuid.uuid4().hex[:4]}"
+    stats = pstats.Stats(*profilers)
+    stats.dump_stats(_path(profile_id, 'prof'))
+    with open(_path(profile_id, 'json'), 'w') as file:
+        json.dump({
+            'id': profile_id,
+            'method': request.method,
+            'path': request.get_full_path(),
+            'view': view,
+            'user': request.user.get_username(),
+            'ms': round(elapsed * 1000, 1),
+            'queries': queries,
+            'trace': trace,
+        }, file)
+    _prune()
+    return profile_id
+
+
+def _prune():
+    ids = sorted(name[:-len('.json')] for name in os.listdir(settings.PROFILE_DIR) if name.endswith('.json'))
+    for profile_id in ids[:max(len(ids) - settings.PROFILE_MAX_COUNT, 0)]:
+        for extension in ('json', 'prof'):
+            try:
+                os.remove(_path(profile_id, extension))
+            except FileNotFoundError:
+                pass
+
+
+def listing():
+    """
+    Returns the details of the stored profiles, newest first, without
+    their SQL traces.
+    """
+    if not os.path.isdir(settings.PROFILE_DIR):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(settings.PROFILE_DIR), reverse=True):
+        if name.endswith('.json'):
+            try:
+                details = load(name[:-len('.json')])
+            except (FileNotFoundError, ValueError):
+                continue
+            details.pop('trace')
+            profiles.append(details)
+    return profiles
+
+
+def load(profile_id):
+    """
+    Returns the stored details of a profile. Raises FileNotFoundError.
+    """
+    with open(_path(profile_id, 'json')) as file:
+        return json.load(file)
+
+
+def report(profile_id, sort='cumulative'):
+    """
+    Returns the pstats table of a profile as text.
+    """
+    output = io.StringIO()
+    stats = pstats.Stats(_path(profile_id, 'prof'), stream=output)
+    stats.strip_dirs().sort_stats(sort).print_stats(REPORT_LINES)
+    return output.getvalue()
+
+
+def prof_path(profile_id):
+    path = _path(profile_id, 'prof')
+    if not os.path.exists(path):
+        raise FileNotFoundError(profile_id)
+    return path
@@ -0,0 +1,126 @@
+"""
+Full-text search over post captions and topic names.
+
+On SQLite the posts are indexed in an FTS5 virtual table (created by
+migration 0009, trigram tokenized since 0014) whose rowid is the post id.
+Trigrams match any substring of MIN_TERM_LENGTH characters or more, in any
+script, so results are those of an icontains search on every word. Signals
+in core.signals keep the index in sync when a post or topic is saved or
+deleted, and `manage.py reindex_posts` rebuilds it from scratch. Shorter
+search terms, other databases and SQLite before 3.34 fall back to
+icontains filters.
+"""
+
+import re
+import sqlite3
+
+from django.db import connection
+from django.db.models import FloatField, Q
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'core_post_fts'
+
+# Feed ordering for search results: best bm25 rank first, id as tie-breaker.
+ORDERING = ('search_rank', 'id')
+# The trigram index cannot match anything shorter.
+MIN_TERM_LENGTH = 3
+
+
+def available():
+    return connection.vendor == 'sqlite' and sqlite3.sqlite_version_info >= (3, 34)
+
+
+def match_expression(q):
+    """
+    Turns a search box string into an FTS5 query where every word must
+    appear as a substring, e.g. 'night mark' -> '"night" "mark"'. Returns
+    None when a word is too short for the index.
+    """
+    words = re.findall(r'\w+', q)
+    if not words or any(len(word) < MIN_TERM_LENGTH for word in words):
+        return None
+    return ' '.join(f'"{word}"' for word in words)
+
+
+def filter_posts(posts, q):
+    """
+    Restricts a Post queryset to the posts matching `q`. Returns the
+    queryset and the ordering to paginate it with.
+    """
+    expression = match_expression(q) if available() else None
+    if expression is None:
+        return posts.filter(Q(topic__name__icontains=q) | Q(caption__icontains=q)), ('-created_at', '-id')
+    # The id subquery is answered from the index once, the rank only gets
+    # computed for the posts that matched.
+    posts = posts.filter(
+        id__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', (expression,))
+    ).annotate(search_rank=RawSQL(
+        f'SELECT rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s AND rowid = core_post.id', (expression,),
+        output_field=FloatField(),
+    ))
+    return posts, ORDERING
+
+
+def index_post(post):
+    if not available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT OR REPLACE INTO {FTS_TABLE} (rowid, caption, topic) '
+            f'VALUES (%s, %s, COALESCE((SELECT name FROM core_topic WHERE id = %s), \'\'))',
+            [post.id, post.caption, post.topic_id],
+        )
+
+
+def index_posts(posts):
+    """
+    Indexes posts that were inserted without signals (bulk_create).
+    """
+    if not available():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT OR REPLACE INTO {FTS_TABLE} (rowid, caption, topic) '
+            f'VALUES (%s, %s, COALESCE((SELECT name FROM core_topic WHERE id = %s), \'\'))',
+            [(post.id, post.caption, post.topic_id) for post in posts],
+        )
+
+
+def index_topic(topic_id, name):
+    """
+    Updates the topic name indexed with the posts of a topic, e.g. '' when
+    the topic is about to be deleted.
+    """
+    if not available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {FTS_TABLE} SET topic = %s WHERE rowid IN (SELECT id FROM core_post WHERE topic_id = %s)',
+            [name, topic_id],
+        )
+
+
+def unindex_post(post_id):
+    if not available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [post_id])
+
+
+def reindex():
+    """
+    Rebuilds the whole index from the post table. Returns the number of
+    posts indexed.
+    """
+    if not available():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, caption, topic) '
+            f'SELECT post.id, post.caption, COALESCE(topic.name, \'\') '
+            f'FROM core_post post LEFT JOIN core_topic topic ON topic.id = post.topic_id'
+        )
+        cursor.execute(f'INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES (\'optimize\')')
+        cursor.execute(f'SELECT COUNT(*) FROM {FTS_TABLE}')
+        return cursor.fetchone()[0]
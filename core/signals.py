@@ -0,0 +1,131 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+
+from . import events, fragments, friends, heatmap, map_cache, search
+from .models import Comment, Friendship, Like, Post, Topic
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, **kwargs):
+    search.index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):
+    search.unindex_post(instance.id)
+
+
+@receiver(post_save, sender=Topic)
+def index_topic(sender, instance, created, **kwargs):
+    # A renamed topic is searched under its new name
+    if not created:
+        search.index_topic(instance.id, instance.name)
+
+
+@receiver(pre_delete, sender=Topic)
+def unindex_topic(sender, instance, **kwargs):
+    # Before the posts' topic is set to NULL and they can no longer be found
+    search.index_topic(instance.id, '')
+
+
+@receiver(pre_delete, sender=Topic)
+def uncount_topic(sender, instance, **kwargs):
+    # SET_NULL would move the counts onto the rows without a topic, which
+    # already exist for most cells
+    heatmap.drop_topic(instance.id)
+
+
+def _map_changed(kind, post, location, previous=None):
+    """
+    Once the change is committed, refreshes the cached map tiles at the old
+    and new position of a post and tells live maps about it.
+    """
+    event = {"type": kind, "id": post.id, "lat": location[0], "lon": location[1]}
+    if previous and previous != location:
+        event["previous"] = previous
+    else:
+        previous = None
+
+    def changed():
+        map_cache.invalidate_point(*location)
+        if previous:
+            map_cache.invalidate_point(*previous)
+        if events.has_subscribers():
+            events.publish(event, location, previous)
+
+    transaction.on_commit(changed)
+
+
+def _heatmap_entry(post):
+    # Where the post was counted, as loaded from the database
+    lat, lon = getattr(post, '_loaded_location', (post.latitude, post.longitude))
+    return heatmap.entry(lat, lon, getattr(post, '_loaded_topic_id', post.topic_id), post.created_at)
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_loaded_location', None)
+    location = (instance.latitude, instance.longitude)
+    # An unsaved instance with a pk may be an existing post we never loaded,
+    # its old heatmap entry is unknown then
+    if created or hasattr(instance, '_loaded_location'):
+        heatmap.changed(
+            None if created else _heatmap_entry(instance),
+            heatmap.entry(*location, instance.topic_id, instance.created_at),
+        )
+    instance._loaded_location = location
+    instance._loaded_topic_id = instance.topic_id
+    _map_changed('created' if created else 'updated', instance, location, previous)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    heatmap.changed(_heatmap_entry(instance), None)
+    _map_changed('deleted', instance, getattr(instance, '_loaded_location', (instance.latitude, instance.longitude)))
+
+
+def _feed_scopes(author_id):
+    # Comments on an author's posts show up in the home activity of the
+    # author and all of their friends.
+    return [f'feed:{user_id}' for user_id in friends.friend_ids(author_id) | {author_id}]
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def post_fragments(sender, instance, **kwargs):
+    fragments.bump(f'post:{instance.id}', *_feed_scopes(instance.author_id))
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comment_fragments(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Post):
+        # Deleted along with its post, which bumps the feeds itself
+        fragments.bump(f'user:{instance.author_id}')
+        return
+    fragments.bump(f'post:{instance.post_id}', f'user:{instance.author_id}',
+                   *_feed_scopes(instance.post.author_id))
+
+
+@receiver(post_save, sender=Like)
+@receiver(post_delete, sender=Like)
+def like_fragments(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Post):
+        return  # deleted along with its post, which bumps its scopes itself
+    fragments.bump(f'post:{instance.post_id}', *_feed_scopes(instance.post.author_id))
+
+
+@receiver(post_save, sender=Friendship)
+@receiver(post_delete, sender=Friendship)
+def friendship_changed(sender, instance, **kwargs):
+    # However the friendship changed (views, admin, cascades, scripts), drop
+    # the cached friend graphs before the fragments are rendered again
+    friends.invalidate(instance.from_user_id, instance.to_user_id)
+    fragments.bump(f'feed:{instance.from_user_id}', f'feed:{instance.to_user_id}')
+
+
+@receiver(post_save, sender=Topic)
+@receiver(post_delete, sender=Topic)
+def topic_fragments(sender, instance, **kwargs):
+    fragments.bump('topics')
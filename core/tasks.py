@@ -0,0 +1,36 @@
+"""
+Background job handlers, see core.jobs.
+"""
+
+from . import counters, exif, heatmap, images
+from .jobs import job
+from .models import Post
+
+
+@job('photo_variants')
+def photo_variants(post_id):
+    post = Post.objects.filter(id=post_id).first()
+    if post is None:
+        return  # deleted before the job ran
+    images.generate_variants(post)
+
+
+@job('reconcile_counters')
+def reconcile_counters():
+    counters.reconcile()
+
+
+@job('rebuild_heatmap')
+def rebuild_heatmap():
+    heatmap.rebuild()
+
+
+@job('photo_metadata')
+def photo_metadata(post_id):
+    post = Post.objects.filter(id=post_id).first()
+    if post is None or not post.photo:
+        return
+    with post.photo.open('rb') as photo:
+        changed = post.apply_photo_metadata(exif.read(photo))
+    if changed:
+        post.save(update_fields=changed)
@@ -1,3 +1,1236 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import random
+import tempfile
+import warnings
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import F
+from django.http import HttpResponse
+from PIL import ExifTags, Image
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import columnar, counters, events, fragments, friends, geo, heatmap, images, jobs, map_cache, profiling, search, timeline, views
+from .forms import PostForm
+from .pagination import encode_cursor, keyset_page
+from .management.commands import import_posts, run_jobs
+from .middleware import DUPLICATE_QUERY_LIMIT, PerformanceMiddleware
+from .models import HeatmapCell, Job, Post, Topic, Comment, Like, Friendship, TimelineEntry
+
+
+class QueryBudgetTests(TestCase):
+    """
+    The main pages must not issue a query per post, comment or like.
+    Each page gets a fixed budget that does not grow with the data.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', password='secret')
+        topics = [Topic.objects.create(name=name) for name in ('food', 'travel', 'hiking')]
+        friends = []
+        for index in range(3):
+            friend = User.objects.create_user(f'friend{index}', password='secret')
+            Friendship.objects.create(from_user=cls.user, to_user=friend, status='accepted')
+            Friendship.objects.create(from_user=friend, to_user=cls.user, status='accepted')
+            friends.append(friend)
+
+        for index in range(12):
+            author = [cls.user, *friends][index % 4]
+            post = Post.objects.create(
+                author=author, topic=topics[index % 3], caption=f'Memory {index}',
+                latitude=24.8 + index / 100, longitude=120.9,
+            )
+            for commenter in friends:
+                Comment.objects.create(post=post, author=commenter, text='Nice!')
+                Like.objects.create(post=post, user=commenter)
+            Comment.objects.create(post=post, author=cls.user, text='Thanks')
+        cls.post = post
+
+    def assertMaxQueries(self, budget, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(
+            len(queries), budget,
+            f'{url} ran {len(queries)} queries, budget is {budget}:\n'
+            + '\n'.join(query['sql'] for query in queries.captured_queries)
+        )
+
+    def setUp(self):
+        # Measure with cold caches
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_home(self):
+        self.assertMaxQueries(8, reverse('home'))
+
+    def test_home_builds_the_visible_posts_once(self):
+        for params in ({}, {'q': 'Memory'}):
+            with self.subTest(params=params), \
+                    mock.patch.object(views, '_feed_posts', wraps=views._feed_posts) as feed_posts:
+                response = self.client.get(reverse('home'), params)
+                self.assertEqual(len(response.context['posts']), 12)
+                self.assertEqual(feed_posts.call_count, 1)
+
+    def test_post(self):
+        self.assertMaxQueries(6, reverse('post', args=[self.post.id]))
+
+    def test_user_profile(self):
+        self.assertMaxQueries(7, reverse('user-profile', args=[self.user.id]))
+
+
+class BboxTests(TestCase):
+
+    def in_ranges(self, geohash, ranges):
+        return any(low <= geohash and (high is None or geohash < high) for low, high in ranges)
+
+    def test_covering_ranges_hold_every_point_in_the_box(self):
+        rng = random.Random(1)
+        boxes = [(120.5, 24.5, 121.5, 25.5), (-0.01, 51.49, 0.01, 51.51), (170.0, -10.0, -170.0, 10.0),
+                 (-180.0, -90.0, 180.0, 90.0), (179.99, 89.9, 180.0, 90.0)]
+        for west, south, east, north in boxes:
+            ranges = geo.bbox_ranges(west, south, east, north)
+            self.assertLessEqual(len(ranges), 2 * geo.MAX_COVER_CELLS)
+            for south_, west_, north_, east_ in geo.split_bbox(west, south, east, north):
+                for _ in range(200):
+                    lat, lon = rng.uniform(south_, north_), rng.uniform(west_, east_)
+                    with self.subTest(box=(west, south, east, north), point=(lat, lon)):
+                        self.assertTrue(self.in_ranges(geo.encode(lat, lon), ranges))
+
+    def test_split_bbox_at_the_antimeridian(self):
+        self.assertEqual(geo.split_bbox(170.0, -10.0, -170.0, 10.0),
+                         [(-10.0, 170.0, 10.0, 180.0), (-10.0, -180.0, 10.0, -170.0)])
+        # Leaflet keeps counting past 180 after panning east
+        self.assertEqual(geo.split_bbox(170.0, -10.0, 190.0, 10.0), geo.split_bbox(170.0, -10.0, -170.0, 10.0))
+        self.assertEqual(geo.split_bbox(-550.0, -10.0, -530.0, 10.0), geo.split_bbox(170.0, -10.0, -170.0, 10.0))
+        self.assertEqual(geo.split_bbox(-200.0, 0.0, 200.0, 1.0), [(0.0, -180.0, 1.0, 180.0)])
+
+    def test_bbox_api_across_the_antimeridian(self):
+        user = User.objects.create_user('alice', password='secret')
+        fiji = Post.objects.create(author=user, caption='Fiji', latitude=-17.7, longitude=179.5)
+        samoa = Post.objects.create(author=user, caption='Samoa', latitude=-13.8, longitude=-179.5)
+        Post.objects.create(author=user, caption='Nowhere near', latitude=-15.0, longitude=0.0)
+        Post.objects.create(author=user, caption='Too far south', latitude=-30.0, longitude=179.9)
+        for bbox in ('170,-20,-170,-10', '170,-20,190,-10', '-190,-20,-170,-10'):
+            with self.subTest(bbox=bbox):
+                pins = self.client.get(reverse('api-get-posts'), {'bbox': bbox}).json()
+                self.assertEqual(sorted(pin['id'] for pin in pins), [fiji.id, samoa.id])
+
+
+class ClusterTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user('alice', password='secret')
+        rng = random.Random(2)
+        posts = [Post(author=user, caption='Memory', latitude=lat + rng.uniform(-1, 1), longitude=lon + rng.uniform(-1, 1))
+                 for lat, lon, count in ((25.0, 121.0, 30), (48.8, 2.3, 12), (-33.9, 151.2, 5)) for _ in range(count)]
+        posts.append(Post(author=user, caption='Alone', latitude=64.1, longitude=-21.9))
+        for post in posts:
+            post.save()
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, bbox, zoom):
+        return self.client.get(reverse('api-get-posts'), {'bbox': bbox, 'zoom': zoom}).json()
+
+    def test_cluster_counts_match_the_cells(self):
+        for zoom in (2, 5, 8):
+            with self.subTest(zoom=zoom):
+                precision = geo.cluster_precision(zoom)
+                expected = {}
+                for geohash in Post.objects.values_list('geohash', flat=True):
+                    expected[geohash[:precision]] = expected.get(geohash[:precision], 0) + 1
+                items = self.get('-180,-90,180,90', zoom)
+                found = {}
+                for item in items:
+                    if item.get('cluster'):
+                        # The centroid may fall outside the cell, its newest post does not
+                        found[Post.objects.get(id=item['post_id']).geohash[:precision]] = item['count']
+                    else:
+                        found[geo.encode(item['lat'], item['lon'], precision)] = 1
+                self.assertEqual(found, expected)
+                self.assertEqual(sum(item.get('count', 1) for item in items), Post.objects.count())
+
+    def test_single_post_cells_are_pins(self):
+        alone = Post.objects.get(caption='Alone')
+        items = self.get('-180,-90,180,90', 3)
+        pin, = [item for item in items if not item.get('cluster')]
+        self.assertEqual(pin['id'], alone.id)
+        self.assertEqual(pin['caption'], 'Alone')
+
+    def test_clusters_only_count_the_viewport(self):
+        items = self.get('120,20,122.5,30', 4)
+        self.assertEqual(sum(item.get('count', 1) for item in items), 30)
+
+    def test_no_clusters_from_the_cluster_zoom_on(self):
+        items = self.get('-180,-90,180,90', views.CLUSTER_MAX_ZOOM)
+        self.assertEqual(len(items), Post.objects.count())
+        self.assertFalse(any(item.get('cluster') for item in items))
+
+
+class TileTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('alice', password='secret')
+
+    def tile(self, z, lat, lon, **headers):
+        return self.client.get(reverse('api-get-tile', args=(z, *geo.tile_for_point(lat, lon, z))), **headers)
+
+    def test_tile_bounds_hold_their_points(self):
+        west, south, east, north = geo.tile_bounds(0, 0, 0)
+        self.assertEqual((west, east), (-180.0, 180.0))
+        self.assertAlmostEqual(north, 85.0511287798)
+        self.assertAlmostEqual(south, -85.0511287798)
+        rng = random.Random(3)
+        for _ in range(500):
+            lat, lon, z = rng.uniform(-85, 85), rng.uniform(-180, 179.999), rng.randint(0, map_cache.TILE_MAX_ZOOM)
+            west, south, east, north = geo.tile_bounds(z, *geo.tile_for_point(lat, lon, z))
+            with self.subTest(lat=lat, lon=lon, z=z):
+                self.assertTrue(west <= lon < east and south < lat <= north)
+
+    def test_out_of_range_tiles(self):
+        self.assertEqual(self.client.get(reverse('api-get-tile', args=(2, 4, 0))).status_code, 404)
+        self.assertEqual(self.client.get(reverse('api-get-tile', args=(map_cache.TILE_MAX_ZOOM + 1, 0, 0))).status_code, 404)
+
+    def test_tiles_change_with_the_posts_inside(self):
+        taipei, paris = (25.03, 121.56), (48.85, 2.35)
+        etags = {place: self.tile(17, *place)['ETag'] for place in (taipei, paris)}
+        self.assertEqual(self.tile(17, *taipei, HTTP_IF_NONE_MATCH=etags[taipei]).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(author=self.user, caption='Memory', latitude=taipei[0], longitude=taipei[1])
+        response = self.tile(17, *taipei, HTTP_IF_NONE_MATCH=etags[taipei])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([pin['id'] for pin in response.json()], [post.id])
+        self.assertEqual(self.tile(17, *paris, HTTP_IF_NONE_MATCH=etags[paris]).status_code, 304)
+
+        # Moving the post changes the tile it left and the one it went to
+        etags = {place: self.tile(17, *place)['ETag'] for place in (taipei, paris)}
+        post.latitude, post.longitude = paris
+        with self.captureOnCommitCallbacks(execute=True):
+            post.save()
+        self.assertEqual(self.tile(17, *taipei, HTTP_IF_NONE_MATCH=etags[taipei]).json(), [])
+        self.assertEqual([pin['id'] for pin in self.tile(17, *paris, HTTP_IF_NONE_MATCH=etags[paris]).json()],
+                         [post.id])
+
+        etag = self.tile(17, *paris)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            post.delete()
+        self.assertEqual(self.tile(17, *paris, HTTP_IF_NONE_MATCH=etag).json(), [])
+
+
+class MigrationTests(TransactionTestCase):
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        self.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_decimal_coordinates_become_floats(self):
+        before, after = [('core', '0004_post_geohash')], [('core', '0005_post_float_coordinates')]
+        apps = self.migrate(before)
+        author = apps.get_model('auth', 'User').objects.create(username='alice')
+        Post = apps.get_model('core', 'Post')
+        located = Post.objects.create(author=author, caption='Memory', latitude=Decimal('24.801234'),
+                                      longitude=Decimal('-120.912345'))
+        unlocated = Post.objects.create(author=author, caption='Somewhere')
+
+        apps = self.migrate(after)
+        Post = apps.get_model('core', 'Post')
+        self.assertEqual(Post._meta.get_field('latitude').get_internal_type(), 'FloatField')
+        self.assertEqual(Post.objects.get(id=located.id).latitude, 24.801234)
+        self.assertEqual(Post.objects.get(id=located.id).longitude, -120.912345)
+        self.assertEqual(Post.objects.filter(id=unlocated.id, latitude__isnull=True, longitude__isnull=True).count(), 1)
+
+        apps = self.migrate(before)
+        post = apps.get_model('core', 'Post').objects.get(id=located.id)
+        self.assertEqual((post.latitude, post.longitude), (Decimal('24.801234'), Decimal('-120.912345')))
+
+    def test_heatmap_rows_without_a_topic_are_merged(self):
+        apps = self.migrate([('core', '0014_post_fts_trigram')])
+        HeatmapCell = apps.get_model('core', 'HeatmapCell')
+        food = apps.get_model('core', 'Topic').objects.create(name='food')
+        day = timezone.localdate()
+        HeatmapCell.objects.bulk_create([
+            HeatmapCell(precision=1, cell='w', day=day, count=2),
+            HeatmapCell(precision=1, cell='w', day=day, count=3),
+            HeatmapCell(precision=1, cell='w', day=day, topic=food, count=4),
+            HeatmapCell(precision=2, cell='wh', day=day, count=5),
+        ])
+
+        apps = self.migrate([('core', '0015_heatmapcell_no_topic_uniq')])
+        rows = apps.get_model('core', 'HeatmapCell').objects.values_list('precision', 'topic_id', 'count')
+        self.assertEqual(sorted(rows, key=str), sorted([(1, None, 5), (1, food.id, 4), (2, None, 5)], key=str))
+
+
+class NearbyTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user('alice', password='secret')
+        rng = random.Random(5)
+        points = [(24.8 + rng.uniform(-0.05, 0.05), 120.9 + rng.uniform(-0.05, 0.05)) for _ in range(40)]
+        # On both sides of the antimeridian
+        points += [(-16.5 + rng.uniform(-1, 1), rng.choice((179.5, -179.5)) + rng.uniform(-0.4, 0.4)) for _ in range(20)]
+        points += [(51.5, -0.1), (-33.9, 151.2)]
+        for lat, lon in points:
+            Post.objects.create(author=user, caption='Memory', latitude=lat, longitude=lon)
+
+    def nearby(self, lat, lon, **params):
+        response = self.client.get(reverse('api-nearby-posts'), {'lat': lat, 'lon': lon, **params})
+        self.assertEqual(response.status_code, 200)
+        return [(pin['id'], pin['distance_km']) for pin in response.json()]
+
+    def expected(self, lat, lon, k, radius_km=None):
+        hits = sorted(
+            (geo.haversine_km(lat, lon, post.latitude, post.longitude), post.id) for post in Post.objects.all()
+        )
+        return [(post_id, round(distance, 3)) for distance, post_id in hits
+                if radius_km is None or distance <= radius_km][:k]
+
+    def test_matches_a_full_scan(self):
+        for lat, lon, k in ((24.8, 120.9, 5), (24.83, 120.95, 30), (-16.5, 179.99, 10), (-16.5, -179.99, 25),
+                            (0.0, -150.0, 3), (89.9, 0.0, 62), (10.0, 10.0, 100)):
+            with self.subTest(lat=lat, lon=lon, k=k):
+                self.assertEqual(self.nearby(lat, lon, k=k), self.expected(lat, lon, k))
+
+    def test_radius(self):
+        for lat, lon, radius_km in ((24.8, 120.9, 3), (-16.5, 180.0, 60), (0.0, -150.0, 1000)):
+            with self.subTest(lat=lat, lon=lon, radius_km=radius_km):
+                self.assertEqual(self.nearby(lat, lon, k=100, radius_km=radius_km),
+                                 self.expected(lat, lon, 100, radius_km))
+
+
+def jpeg_upload(size=(8, 8), gps=None, orientation=None):
+    exif = Image.Exif()
+    if gps:
+        lat, lon = gps
+        exif[ExifTags.Base.GPSInfo] = {
+            ExifTags.GPS.GPSLatitudeRef: 'N', ExifTags.GPS.GPSLatitude: (lat, 0.0, 0.0),
+            ExifTags.GPS.GPSLongitudeRef: 'E', ExifTags.GPS.GPSLongitude: (lon, 0.0, 0.0),
+        }
+    if orientation:
+        exif[ExifTags.Base.Orientation] = orientation
+    buffer = io.BytesIO()
+    Image.new('RGB', size).save(buffer, 'JPEG', exif=exif)
+    return SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+
+class GeotagPhotosTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=directory.name))
+        cache.clear()
+
+    def test_geotagged_posts_show_up_on_the_map(self):
+        user = User.objects.create_user('alice', password='secret')
+        post = Post.objects.create(author=user, caption='Memory', photo=jpeg_upload(gps=(24.5, 120.5)))
+        bbox = {'bbox': '120,24,121,25'}
+        tile_url = reverse('api-get-tile', args=[10, *geo.tile_for_point(24.5, 120.5, 10)])
+        # Cache the empty responses first
+        self.assertEqual(self.client.get(reverse('api-get-posts'), bbox).json(), [])
+        self.assertEqual(self.client.get(tile_url).json(), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('geotag_photos', workers=1, stdout=io.StringIO())
+
+        self.assertEqual([pin['id'] for pin in self.client.get(reverse('api-get-posts'), bbox).json()], [post.id])
+        self.assertEqual([pin['id'] for pin in self.client.get(tile_url).json()], [post.id])
+        nearby = self.client.get(reverse('api-nearby-posts'), {'lat': 24.5, 'lon': 120.5}).json()
+        self.assertEqual([pin['id'] for pin in nearby], [post.id])
+        heat = self.client.get(reverse('api-heatmap'), {**bbox, 'precision': 3}).json()
+        self.assertEqual([point[2] for point in heat['points']], [1])
+
+
+class PhotoVariantTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=directory.name))
+        self.user = User.objects.create(username='alice')
+
+    def test_urls_fall_back_to_the_original(self):
+        post = Post.objects.create(author=self.user, caption='Memory', photo=jpeg_upload())
+        for url in (post.photo_thumb_url, post.photo_medium_url, post.photo_large_url):
+            self.assertEqual(url, post.photo.url)
+        self.assertEqual(Post.objects.create(author=self.user, caption='No photo').photo_thumb_url, '')
+
+    def test_variants_are_resized_upright_and_stripped(self):
+        # Orientation 6: the camera was turned, the stored pixels are sideways
+        post = Post.objects.create(author=self.user, caption='Memory',
+                                   photo=jpeg_upload((3000, 1000), gps=(24.5, 120.5), orientation=6))
+        images.generate_variants(post)
+        post.refresh_from_db()
+        for field, size in images.VARIANTS.items():
+            variant = getattr(post, field)
+            with self.subTest(field), variant.open('rb') as file:
+                image = Image.open(file)
+                self.assertEqual(image.format, images.FORMAT)
+                width, height = image.size
+                self.assertEqual(height, min(size, 3000))
+                self.assertAlmostEqual(width / height, 1 / 3, delta=0.01)
+                self.assertNotIn(ExifTags.Base.GPSInfo, image.getexif())
+                self.assertNotEqual(getattr(post, f'{field}_url'), post.photo.url)
+
+    def test_removed_photos_drop_their_variants(self):
+        post = Post.objects.create(author=self.user, caption='Memory', photo=jpeg_upload())
+        images.generate_variants(post)
+        thumb = post.photo_thumb.name
+        self.assertTrue(post.photo_thumb.storage.exists(thumb))
+        post.photo.delete()
+        images.generate_variants(post)
+        post.refresh_from_db()
+        self.assertFalse(post.photo_thumb)
+        self.assertFalse(post.photo_thumb.storage.exists(thumb))
+        self.assertEqual(post.photo_thumb_url, '')
+
+    def test_backfill_command_fills_missing_variants(self):
+        post = Post.objects.create(author=self.user, caption='Memory', photo=jpeg_upload())
+        done = Post.objects.create(author=self.user, caption='Done', photo=jpeg_upload())
+        images.generate_variants(done)
+        thumb = Post.objects.get(id=done.id).photo_thumb.name
+        # As stored for the posts that existed when the variant columns were added
+        Post.objects.filter(id=post.id).update(photo_thumb=None, photo_medium=None, photo_large=None)
+
+        out = io.StringIO()
+        call_command('generate_photo_variants', stdout=out)
+        self.assertIn('Generated variants for 1 post(s)', out.getvalue())
+        post.refresh_from_db()
+        for field in images.VARIANTS:
+            self.assertTrue(getattr(post, field))
+            self.assertNotEqual(getattr(post, f'{field}_url'), post.photo.url)
+        self.assertEqual(Post.objects.get(id=done.id).photo_thumb.name, thumb)
+
+    def test_replaced_photos_show_the_new_original_until_resized(self):
+        post = Post.objects.create(author=self.user, caption='Memory', photo=jpeg_upload())
+        images.generate_variants(post)
+        old_thumb = post.photo_thumb.name
+        self.client.force_login(self.user)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('update-post', args=[post.id]), {
+                'caption': 'Memory', 'topic': 'food', 'photo': jpeg_upload((16, 16)),
+            })
+        self.assertRedirects(response, reverse('home'))
+        post.refresh_from_db()
+        self.assertNotEqual(post.photo.name, 'post_photos/photo.jpg')
+        for field in images.VARIANTS:
+            self.assertFalse(getattr(post, field))
+            self.assertEqual(getattr(post, f'{field}_url'), post.photo.url)
+        self.assertFalse(post.photo_thumb.storage.exists(old_thumb))
+        self.assertEqual(Job.objects.get().name, 'photo_variants')
+
+
+class JobQueueTests(TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.failures = 0
+        self.enterContext(mock.patch.dict(jobs._registry, {'flaky': self.flaky}))
+
+    def flaky(self, value):
+        self.calls.append(value)
+        if len(self.calls) <= self.failures:
+            raise RuntimeError('Try again')
+
+    def run_due(self):
+        for queued in jobs.claim(10):
+            jobs.run_now(queued)
+
+    def make_due(self):
+        Job.objects.filter(status=Job.STATUS_PENDING).update(run_after=timezone.now())
+
+    def test_claimed_jobs_are_not_claimed_again(self):
+        queued = jobs.enqueue('flaky', value=1)
+        self.assertEqual(jobs.claim(10), [queued])
+        self.assertEqual(Job.objects.get().status, Job.STATUS_RUNNING)
+        self.assertEqual(jobs.claim(10), [])
+
+    def test_failed_jobs_are_retried_with_backoff(self):
+        self.failures = 1
+        jobs.enqueue('flaky', value=1)
+        before = timezone.now()
+        self.run_due()
+        queued = Job.objects.get()
+        self.assertEqual((queued.status, queued.attempts), (Job.STATUS_PENDING, 1))
+        self.assertIn('Try again', queued.last_error)
+        self.assertGreaterEqual(queued.run_after, before + jobs.RETRY_DELAY)
+        # Not due yet
+        self.assertEqual(jobs.claim(10), [])
+
+        self.make_due()
+        self.run_due()
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts, queued.last_error), (Job.STATUS_DONE, 2, ''))
+        self.assertEqual(self.calls, [1, 1])
+
+    def test_jobs_fail_after_max_attempts(self):
+        self.failures = 10
+        jobs.enqueue('flaky', max_attempts=3, value=1)
+        delays = []
+        for _ in range(3):
+            self.make_due()
+            before = timezone.now()
+            self.run_due()
+            queued = Job.objects.get()
+            delays.append(queued.run_after - before)
+        self.assertEqual((queued.status, queued.attempts), (Job.STATUS_FAILED, 3))
+        self.assertGreaterEqual(delays[1], 2 * jobs.RETRY_DELAY)
+        self.make_due()
+        self.run_due()
+        self.assertEqual(len(self.calls), 3)
+
+    def test_stale_running_jobs_are_requeued(self):
+        lost, busy = jobs.enqueue('flaky', value=1), jobs.enqueue('flaky', value=2)
+        jobs.claim(10)
+        Job.objects.filter(id=lost.id).update(updated_at=timezone.now() - jobs.STALE_AFTER - timedelta(seconds=1))
+        self.assertEqual(jobs.requeue_stale(), 1)
+        self.assertEqual(dict(Job.objects.values_list('id', 'status')),
+                         {lost.id: Job.STATUS_PENDING, busy.id: Job.STATUS_RUNNING})
+        self.assertEqual(jobs.claim(10), [lost])
+
+    def test_jobs_with_a_heartbeat_are_not_stale(self):
+        long_running = jobs.enqueue('flaky', value=1)
+        jobs.claim(10)
+        Job.objects.update(updated_at=timezone.now() - jobs.STALE_AFTER - timedelta(seconds=1))
+        jobs.heartbeat([long_running.id])
+        self.assertEqual(jobs.requeue_stale(), 0)
+        self.assertEqual(Job.objects.get().status, Job.STATUS_RUNNING)
+
+    def test_run_jobs_survives_a_crashed_worker(self):
+        pools = []
+
+        class Pool:
+            # Runs jobs in this process, the first pool has a dead worker
+            def __init__(self, *args, **kwargs):
+                self.broken = not pools
+                pools.append(self)
+
+            def submit(self, func, *args):
+                future = Future()
+                if self.broken:
+                    future.set_exception(BrokenProcessPool('A child process terminated abruptly'))
+                else:
+                    future.set_result(func(*args))
+                return future
+
+            def shutdown(self, wait=True, cancel_futures=False):
+                pass
+
+        first, second = jobs.enqueue('flaky', value=1), jobs.enqueue('flaky', value=2)
+        with mock.patch.object(run_jobs, 'ProcessPoolExecutor', Pool):
+            call_command('run_jobs', workers=2, once=True, poll_interval=0, stdout=io.StringIO(), stderr=io.StringIO())
+            self.assertEqual(len(pools), 2)
+            for queued in Job.objects.all():
+                self.assertEqual((queued.status, queued.attempts), (Job.STATUS_PENDING, 1))
+                self.assertIn('BrokenProcessPool', queued.last_error)
+
+            self.make_due()
+            call_command('run_jobs', workers=2, once=True, poll_interval=0, stdout=io.StringIO())
+        self.assertEqual(set(Job.objects.values_list('status', flat=True)), {Job.STATUS_DONE})
+        self.assertEqual(sorted(self.calls), [1, 2])
+
+    @override_settings(JOBS_RUN_SYNC=True)
+    def test_sync_jobs_run_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            jobs.enqueue('flaky', value=1)
+            self.assertEqual(self.calls, [])
+        self.assertEqual(self.calls, [1])
+        self.assertEqual(Job.objects.get().status, Job.STATUS_DONE)
+
+
+class PostsApiCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', password='secret')
+        cls.post = Post.objects.create(author=cls.user, caption='Memory', latitude=24.8, longitude=120.9)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_unchanged_posts_revalidate(self):
+        url = reverse('api-get-posts')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Post.objects.create(author=self.user, caption='New', latitude=24.9, longitude=121.0)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.json()), 2)
+
+    def test_cached_pins_carry_the_creation_time(self):
+        # Not a "x minutes ago" text, which the cached body would freeze
+        pin, = self.client.get(reverse('api-get-posts')).json()
+        self.assertEqual(parse_datetime(pin['created_at']),
+                         self.post.created_at.replace(microsecond=self.post.created_at.microsecond // 1000 * 1000))
+
+
+class ColumnarTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        alice = User.objects.create_user('alice', password='secret')
+        bob = User.objects.create_user('bob', password='secret')
+        food = Topic.objects.create(name='food')
+        Post.objects.create(author=alice, topic=food, caption='Night market', latitude=24.8, longitude=120.9)
+        Post.objects.create(author=bob, caption='Harbour', latitude=-33.868820, longitude=151.209295)
+        Post.objects.create(author=alice, topic=food, caption='Dumplings', latitude=24.8000004, longitude=120.9000004)
+
+    def setUp(self):
+        cache.clear()
+
+    def fetch(self, **params):
+        url = reverse('api-get-posts')
+        params['bbox'] = '-180,-90,180,90'
+        items = self.client.get(url, params).json()
+        payload = self.client.get(url, {**params, 'format': columnar.FORMAT}).json()
+        return items, payload
+
+    def assertCoordsEqual(self, packed, items):
+        coords = columnar.unpack_coords(packed)
+        self.assertEqual(len(coords), len(items))
+        for (lat, lon), item in zip(coords, items):
+            self.assertAlmostEqual(lat, item['lat'], delta=0.5 / columnar.COORD_SCALE)
+            self.assertAlmostEqual(lon, item['lon'], delta=0.5 / columnar.COORD_SCALE)
+
+    def test_pins_round_trip(self):
+        items, payload = self.fetch()
+        decoded = [
+            (post_id, payload['authors'][author], payload['topics'][topic] if topic >= 0 else '')
+            for post_id, author, topic in zip(payload['ids'], payload['author'], payload['topic'])
+        ]
+        self.assertEqual(decoded, [(item['id'], item['author'], item['topic']) for item in items])
+        self.assertEqual(payload['counts'], [1, 1, 1])
+        self.assertEqual(sorted(payload['authors']), ['alice', 'bob'])
+        self.assertCoordsEqual(payload['coords'], items)
+
+    def test_clusters_round_trip(self):
+        items, payload = self.fetch(zoom=3)
+        # The lone harbour post stays a pin
+        self.assertEqual(payload['ids'], [item['post_id'] if item.get('cluster') else item['id'] for item in items])
+        self.assertEqual(payload['counts'], [item.get('count', 1) for item in items])
+        self.assertEqual(payload['counts'], [2, 1])
+        self.assertEqual(payload['author'][0], -1)
+        self.assertEqual(payload['authors'][payload['author'][1]], 'bob')
+        self.assertCoordsEqual(payload['coords'], items)
+
+    def test_extreme_coordinates(self):
+        points = [(-90.0, -180.0), (90.0, 180.0), (0.0, 0.0), (12.3456784, -98.7654316)]
+        for (lat, lon), point in zip(columnar.unpack_coords(columnar.pack_coords(points)), points):
+            self.assertAlmostEqual(lat, point[0], delta=0.5 / columnar.COORD_SCALE)
+            self.assertAlmostEqual(lon, point[1], delta=0.5 / columnar.COORD_SCALE)
+
+
+class StreamedPostsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user('alice', password='secret')
+        food = Topic.objects.create(name='food')
+        for index in range(5):
+            Post.objects.create(author=user, topic=food if index % 2 else None, caption=f'Memory "{index}"',
+                                latitude=24.8 + index / 100, longitude=120.9)
+        Post.objects.create(author=user, caption='Somewhere')
+
+    def setUp(self):
+        # Several chunks per response
+        self.enterContext(mock.patch.object(views, 'STREAM_CHUNK_SIZE', 2))
+
+    def test_stream_matches_the_full_list(self):
+        expected = self.client.get(reverse('api-get-posts')).json()
+        self.assertEqual(len(expected), 5)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            response = self.client.get(reverse('api-get-posts'), {'stream': 1})
+            body = b''.join(response.streaming_content)
+        # A sync iterator, not an async one buffered by async_to_sync
+        self.assertEqual([str(warning.message) for warning in caught], [])
+        self.assertEqual(json.loads(body), expected)
+
+    async def test_async_stream_matches_the_full_list(self):
+        expected = (await self.async_client.get(reverse('api-get-posts'))).json()
+        response = await self.async_client.get(reverse('api-get-posts'), {'stream': 1})
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(json.loads(body), expected)
+
+
+class LiveEventsTests(TestCase):
+
+    def test_saved_posts_reach_subscribers_in_view(self):
+        user = User.objects.create_user('alice', password='secret')
+
+        def create():
+            with self.captureOnCommitCallbacks(execute=True):
+                return Post.objects.create(author=user, caption='Memory', latitude=24.8, longitude=120.9)
+
+        async def scenario():
+            inside = events.subscribe((120, 24, 122, 26))
+            outside = events.subscribe((0, 0, 1, 1))
+            try:
+                post = await sync_to_async(create)()
+                event = await asyncio.wait_for(inside.queue.get(), 1)
+                self.assertEqual((event['type'], event['id']), ('created', post.id))
+                await asyncio.sleep(0)
+                self.assertTrue(outside.queue.empty())
+            finally:
+                events.unsubscribe(inside)
+                events.unsubscribe(outside)
+
+        async_to_sync(scenario)()
+        self.assertFalse(events.has_subscribers())
+
+    def test_slow_subscribers_are_told_to_resync(self):
+        async def scenario():
+            subscription = events.subscribe()
+            try:
+                for index in range(3):
+                    events.publish({'type': 'created', 'id': index}, (1.0, 1.0))
+                await asyncio.sleep(0)
+                self.assertTrue(subscription.lagged)
+                self.assertEqual(subscription.queue.qsize(), 1)
+            finally:
+                events.unsubscribe(subscription)
+
+        with mock.patch.object(events, 'QUEUE_SIZE', 1):
+            async_to_sync(scenario)()
+
+    def test_stream_needs_asgi(self):
+        self.assertEqual(self.client.get(reverse('api-post-events')).status_code, 204)
+        self.assertNotIn(reverse('api-post-events'), self.client.get(reverse('map-page')).content.decode())
+
+    async def test_stream_under_asgi(self):
+        response = await self.async_client.get(reverse('api-post-events'), {'bbox': '120,24,122,26'})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunks = []
+
+        async def read():
+            async for chunk in response.streaming_content:
+                chunks.append(chunk)
+
+        reader = asyncio.create_task(read())
+        await asyncio.sleep(0.1)
+        self.assertEqual(chunks, [b'retry: 3000\n\n'])
+        self.assertTrue(events.has_subscribers())
+        # The browser goes away
+        reader.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await reader
+        self.assertFalse(events.has_subscribers())
+
+
+class KeysetPaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', password='secret')
+        for index in range(5):
+            Post.objects.create(author=cls.user, caption=f'Memory {index}')
+        # Posts created in the same instant must neither repeat nor vanish
+        Post.objects.update(created_at=Post.objects.first().created_at)
+
+    def test_pages_through_ties(self):
+        seen, cursor = [], None
+        while True:
+            page, cursor = keyset_page(Post.objects.all(), cursor, size=2)
+            seen += [post.id for post in page]
+            if cursor is None:
+                break
+        self.assertEqual(seen, sorted(Post.objects.values_list('id', flat=True), reverse=True))
+
+    def test_malformed_cursors_are_rejected(self):
+        self.client.force_login(self.user)
+        for cursor in ('not base64!', encode_cursor(['garbage', 1]), encode_cursor([{'a': 1}, 1]),
+                       encode_cursor(['2025-01-01T00:00:00+00:00', 'x']), encode_cursor([1])):
+            with self.subTest(cursor):
+                response = self.client.get(reverse('feed-page'), {'cursor': cursor})
+                self.assertEqual(response.status_code, 400)
+
+
+class CounterTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', password='secret')
+        cls.post = Post.objects.create(author=cls.user, caption='Night market', latitude=24.8, longitude=120.9)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def counts(self):
+        return Post.objects.values_list('like_count', 'comment_count').get(id=self.post.id)
+
+    def test_likes_and_comments_are_counted(self):
+        self.client.post(reverse('like_post', args=[self.post.id]))
+        self.client.post(reverse('post', args=[self.post.id]), {'text': 'Nice!'})
+        self.assertEqual(self.counts(), (1, 1))
+        # Liking again takes the like back
+        self.client.post(reverse('like_post', args=[self.post.id]))
+        self.assertEqual(self.counts(), (0, 1))
+
+    def test_editing_a_post_keeps_concurrent_counts(self):
+        is_valid = PostForm.is_valid
+
+        def like_meanwhile(form):
+            counters.adjust(self.post.id, like_count=1)
+            return is_valid(form)
+
+        with mock.patch.object(PostForm, 'is_valid', like_meanwhile):
+            self.client.post(reverse('update-post', args=[self.post.id]),
+                             {'caption': 'Edited', 'topic': 'food', 'latitude': 24.8, 'longitude': 120.9})
+        post = Post.objects.get(id=self.post.id)
+        self.assertEqual((post.caption, post.like_count), ('Edited', 1))
+
+    def test_reconcile(self):
+        Like.objects.create(post=self.post, user=self.user)
+        Post.objects.filter(id=self.post.id).update(comment_count=5)
+        self.assertEqual(counters.reconcile(), 1)
+        self.assertEqual(self.counts(), (1, 0))
+        self.assertEqual(counters.reconcile(), 0)
+
+
+class SearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', password='secret')
+        cls.topic = Topic.objects.create(name='food')
+        cls.station = Post.objects.create(author=cls.user, caption='新竹火車站2020年拍攝')
+        cls.market = Post.objects.create(author=cls.user, topic=cls.topic, caption='Night market snacks')
+
+    def search(self, q):
+        posts, _ = search.filter_posts(Post.objects.all(), q)
+        return set(posts.values_list('id', flat=True))
+
+    def test_substrings_match(self):
+        self.assertEqual(self.search('火車站'), {self.station.id})
+        self.assertEqual(self.search('ARKET'), {self.market.id})
+        self.assertEqual(self.search('night snack'), {self.market.id})
+        self.assertEqual(self.search('night 火車站'), set())
+        # Too short for the index, searched with icontains
+        self.assertEqual(self.search('竹'), {self.station.id})
+
+    def test_topic_changes_are_reindexed(self):
+        self.topic.name = 'street food'
+        self.topic.save()
+        self.assertEqual(self.search('street'), {self.market.id})
+        self.topic.delete()
+        self.assertEqual(self.search('street'), set())
+
+    def test_search_results_page(self):
+        for index in range(25):
+            Post.objects.create(author=self.user, caption=f'Station {index}')
+        self.client.force_login(self.user)
+        page = self.client.get(reverse('home'), {'q': 'station'})
+        response = self.client.get(reverse('feed-page'), {'q': 'station', 'cursor': page.context['next_cursor']})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.json()['next_cursor'])
+
+
+class FriendGraphTests(TestCase):
+
+    def test_cached_graph_follows_any_friendship_change(self):
+        alice = User.objects.create_user('alice', password='secret')
+        bob = User.objects.create_user('bob', password='secret')
+        self.assertEqual(friends.friend_ids(alice.id), set())
+        # Changed outside the views, as the admin or a script would
+        Friendship.objects.create(from_user=alice, to_user=bob, status='accepted')
+        self.assertEqual(friends.friend_ids(alice.id), {bob.id})
+        self.assertEqual(friends.relationship(bob.id, alice.id), 'accepted')
+        bob.delete()
+        self.assertEqual(friends.friend_ids(alice.id), set())
+
+    @override_settings(FRIEND_GRAPH_TIMEOUT=120)
+    def test_cached_graph_expires_after_the_configured_timeout(self):
+        alice = User.objects.create(username='alice')
+        friends.invalidate(alice.id)
+        with mock.patch.object(friends.cache, 'set') as cache_set:
+            friends.friend_ids(alice.id)
+        self.assertEqual(cache_set.call_args.args[2], 120)
+
+
+class FragmentCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create(username='alice')
+        self.bob = User.objects.create(username='bob')
+        self.carol = User.objects.create(username='carol')
+        self.topic = Topic.objects.create(name='food')
+        self.post = Post.objects.create(author=self.alice, topic=self.topic, caption='Night market')
+        self.client.force_login(self.bob)
+
+    def change(self, func, *args, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return func(*args, **kwargs)
+
+    def page(self, name, *args):
+        return self.client.get(reverse(name, args=args)).content.decode()
+
+    def test_cached_fragments_are_rendered_again_after_a_change(self):
+        self.assertNotIn('Try the dumplings', self.page('post', self.post.id))
+        self.change(self.client.post, reverse('post', args=[self.post.id]), {'text': 'Try the dumplings'})
+        self.assertIn('Try the dumplings', self.page('post', self.post.id))
+
+        self.assertIn('Night market', self.page('user-profile', self.alice.id))
+        self.post.caption = 'Flower market'
+        self.change(self.post.save)
+        self.assertIn('Flower market', self.page('user-profile', self.alice.id))
+
+        self.assertIn('food', self.page('home'))
+        self.topic.name = 'street food'
+        self.change(self.topic.save)
+        self.assertIn('street food', self.page('home'))
+
+    def test_likes_bump_the_post_and_its_feeds(self):
+        scopes = {'post': f'post:{self.post.id}', 'feed': f'feed:{self.alice.id}'}
+        before = fragments.versions(**scopes)
+        like = self.change(Like.objects.create, post=self.post, user=self.bob)
+        after = fragments.versions(**scopes)
+        self.assertTrue(all(after[name] > before[name] for name in scopes))
+        self.change(like.delete)
+        self.assertTrue(all(version > after[name] for name, version in fragments.versions(**scopes).items()))
+
+    def test_home_activity_follows_friends_and_their_comments(self):
+        self.assertNotIn('So crowded', self.page('home'))
+        self.change(Friendship.objects.create, from_user=self.bob, to_user=self.alice, status='accepted')
+        self.change(Comment.objects.create, post=self.post, author=self.carol, text='So crowded')
+        self.assertIn('So crowded', self.page('home'))
+
+        self.change(Friendship.objects.filter(from_user=self.bob).delete)
+        self.assertNotIn('So crowded', self.page('home'))
+
+    def test_profile_activity_follows_the_users_comments(self):
+        self.assertNotIn('Worth the queue', self.page('user-profile', self.carol.id))
+        comment = self.change(Comment.objects.create, post=self.post, author=self.carol, text='Worth the queue')
+        self.assertIn('Worth the queue', self.page('user-profile', self.carol.id))
+        self.change(comment.delete)
+        self.assertNotIn('Worth the queue', self.page('user-profile', self.carol.id))
+
+
+@override_settings(TIMELINE_ENABLED=True)
+class TimelineTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.reader = User.objects.create(username='reader')
+        self.heavy = User.objects.create(username='heavy')
+        self.normal = User.objects.create(username='normal')
+        self.stranger = User.objects.create(username='stranger')
+        fans = [User.objects.create(username=f'fan{i}') for i in range(2)]
+        for user, friend in [(self.heavy, self.reader), (self.normal, self.reader)] + [(self.heavy, fan) for fan in fans]:
+            Friendship.objects.create(from_user=user, to_user=friend, status='accepted')
+            Friendship.objects.create(from_user=friend, to_user=user, status='accepted')
+        patcher = mock.patch.object(timeline, 'FANOUT_LIMIT', 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, author, caption):
+        post = Post.objects.create(author=author, caption=caption)
+        timeline.fan_out(post)
+        return post
+
+    def owners(self, post):
+        return set(TimelineEntry.objects.filter(post=post).values_list('owner_id', flat=True))
+
+    def test_fan_out_skips_the_friends_of_heavy_authors(self):
+        self.assertEqual(timeline.heavy_user_ids(), {self.heavy.id})
+        self.assertEqual(self.owners(self.post(self.normal, 'Normal')), {self.normal.id, self.reader.id})
+        self.assertEqual(self.owners(self.post(self.heavy, 'Heavy')), {self.heavy.id})
+        self.assertEqual(self.owners(self.post(self.stranger, 'Stranger')), {self.stranger.id})
+
+    def test_timeline_merges_heavy_friends_at_read_time(self):
+        expected = []
+        for i in range(7):
+            expected.append(self.post([self.heavy, self.normal][i % 2], f'Post {i}').id)
+            self.post(self.stranger, 'Not a friend')
+            expected.append(self.post(self.reader, f'Own {i}').id)
+
+        seen, cursor = [], None
+        while True:
+            page, cursor = keyset_page(timeline.posts_for(self.reader.id, cursor, size=4), cursor, size=4)
+            seen.extend(post.id for post in page)
+            if cursor is None:
+                break
+        self.assertEqual(seen, sorted(expected, reverse=True))
+
+        self.client.force_login(self.reader)
+        home = self.client.get(reverse('home'))
+        self.assertEqual([post.id for post in home.context['posts']], seen[:len(home.context['posts'])])
+
+    def test_backfill_and_remove_follow_friendships(self):
+        post = self.post(self.stranger, 'Stranger')
+        timeline.backfill(self.reader.id, self.stranger.id)
+        self.assertEqual(self.owners(post), {self.stranger.id, self.reader.id})
+        timeline.remove(self.reader.id, self.stranger.id)
+        self.assertEqual(self.owners(post), {self.stranger.id})
+        # Heavy authors are never copied in, they are merged at read time
+        heavy_post = self.post(self.heavy, 'Heavy')
+        timeline.backfill(self.reader.id, self.heavy.id)
+        self.assertEqual(self.owners(heavy_post), {self.heavy.id})
+
+
+@override_settings(PERF_SAMPLE_RATE=1.0)
+class PerformanceMiddlewareTests(TestCase):
+
+    def test_server_timing(self):
+        user = User.objects.create_user('alice', password='secret')
+        self.client.force_login(user)
+        with self.assertLogs('core.performance', 'INFO') as logs:
+            response = self.client.get(reverse('home'))
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('"view": "home"', logs.output[0])
+
+    def test_repeated_query_is_flagged(self):
+        def view(request):
+            for _ in range(DUPLICATE_QUERY_LIMIT):
+                Post.objects.filter(id=1).exists()
+            return HttpResponse('ok')
+
+        with self.assertLogs('core.performance', 'WARNING') as logs:
+            PerformanceMiddleware(view)(RequestFactory().get('/'))
+        self.assertIn(f'same query {DUPLICATE_QUERY_LIMIT} times', logs.output[0])
+
+
+class ProfilingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('admin', password='secret', is_staff=True)
+        cls.user = User.objects.create_user('alice', password='secret')
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(PROFILE_DIR=directory.name, PROFILE_MAX_COUNT=2))
+
+    def test_staff_request_is_profiled(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('feed-page'), HTTP_X_PROFILE='1')
+        page = self.client.get(response['X-Profile'])
+        self.assertEqual(page.status_code, 200)
+        self.assertEqual(page.context['profile']['view'], 'feed-page')
+        self.assertEqual(len(page.context['profile']['trace']), page.context['profile']['queries'])
+
+    def test_only_newest_profiles_are_kept(self):
+        self.client.force_login(self.staff)
+        urls = [self.client.get(reverse('home') + '?profile=1')['X-Profile'] for _ in range(3)]
+        self.assertEqual([profile['id'] for profile in profiling.listing()],
+                         [url.split('/')[-2] for url in reversed(urls[1:])])
+
+    def test_other_users_are_not_profiled(self):
+        self.client.force_login(self.user)
+        self.assertNotIn('X-Profile', self.client.get(reverse('home') + '?profile=1'))
+
+
+class HeatmapTests(TestCase):
+
+    def counts(self):
+        return sorted(HeatmapCell.objects.filter(count__gt=0).values_list(
+            'precision', 'cell', 'topic_id', 'day', 'count'), key=str)
+
+    def test_incremental_counts_match_rebuild(self):
+        user = User.objects.create_user('alice', password='secret')
+        food = Topic.objects.create(name='food')
+        posts = [
+            Post.objects.create(author=user, caption=f'Memory {index}', topic=food if index % 2 else None,
+                                latitude=24.8 + index / 1000, longitude=120.9)
+            for index in range(4)
+        ]
+        moved = Post.objects.get(id=posts[0].id)
+        moved.latitude, moved.longitude, moved.topic = 35.6, 139.6, food
+        moved.save()
+        Post.objects.get(id=posts[1].id).delete()
+
+        counted = self.counts()
+        heatmap.rebuild()
+        self.assertEqual(counted, self.counts())
+
+        response = self.client.get(reverse('api-heatmap') + '?bbox=120,24,122,26&precision=4&topic=food')
+        self.assertEqual([point[2] for point in response.json()['points']], [1])
+
+    def test_concurrent_first_posts_in_a_cell(self):
+        user = User.objects.create_user('alice', password='secret')
+        geohash = geo.encode(24.8, 120.9, heatmap.MAX_PRECISION)
+        atomic = transaction.atomic
+
+        # Without a topic too, the rows are unique then as well
+        for topic in (Topic.objects.create(name='food'), None):
+            with self.subTest(topic=topic):
+                HeatmapCell.objects.all().delete()
+                raced = []
+
+                def racing(*args, **kwargs):
+                    # Another transaction counts its post in the same cells
+                    # between the lookup and the insert
+                    if not raced:
+                        raced.append(True)
+                        HeatmapCell.objects.bulk_create([
+                            HeatmapCell(precision=precision, cell=geohash[:precision], topic=topic,
+                                        day=timezone.localdate(), count=1)
+                            for precision in heatmap.PRECISIONS
+                        ])
+                    return atomic(*args, **kwargs)
+
+                with mock.patch.object(heatmap.transaction, 'atomic', racing):
+                    Post.objects.create(author=user, topic=topic, caption='Memory', latitude=24.8, longitude=120.9)
+                self.assertTrue(raced)
+                self.assertEqual(set(HeatmapCell.objects.values_list('count', flat=True)), {2})
+                self.assertEqual(HeatmapCell.objects.count(), len(heatmap.PRECISIONS))
+
+    def test_other_integrity_errors_are_raised(self):
+        user = User.objects.create_user('alice', password='secret')
+        failing = mock.Mock(side_effect=IntegrityError('FOREIGN KEY constraint failed'))
+        with mock.patch.object(HeatmapCell.objects, 'bulk_create', failing), self.assertRaises(IntegrityError):
+            Post.objects.create(author=user, caption='Memory', latitude=24.8, longitude=120.9)
+        self.assertEqual(failing.call_count, heatmap.INSERT_ATTEMPTS)
+
+    def test_deleted_topics_are_counted_without_a_topic(self):
+        user = User.objects.create_user('alice', password='secret')
+        food = Topic.objects.create(name='food')
+        Post.objects.create(author=user, topic=food, caption='Noodles', latitude=24.8, longitude=120.9)
+        Post.objects.create(author=user, caption='Memory', latitude=24.8, longitude=120.9)
+        food.delete()
+        rows = HeatmapCell.objects.values_list('precision', 'topic_id', 'count')
+        self.assertEqual(sorted(rows), [(precision, None, 2) for precision in heatmap.PRECISIONS])
+        heat = self.client.get(reverse('api-heatmap'), {'bbox': '120,24,121,25', 'precision': 3}).json()
+        self.assertEqual([point[2] for point in heat['points']], [2])
+
+
+class GenerateDataTests(TestCase):
+
+    def test_generated_dataset_is_consistent(self):
+        cache.set('unrelated', 'kept')
+        x, y = geo.tile_for_point(25.0330, 121.5654, 8)
+        tile = map_cache.tile_version(8, x, y)
+        self.assertEqual(self.client.get(reverse('api-get-tile', args=[8, x, y])).json(), [])
+        call_command('generate_data', users=30, posts=120, friends=4, comments=1.5, likes=2, seed=7,
+                     batch_size=50, stdout=io.StringIO())
+        self.assertEqual(cache.get('unrelated'), 'kept')
+        self.assertGreater(map_cache.tile_version(8, x, y), tile)
+        self.assertTrue(self.client.get(reverse('api-get-tile', args=[8, x, y])).json())
+        self.assertEqual(User.objects.filter(username__startswith='seed7_').count(), 30)
+        self.assertEqual(Post.objects.count(), 120)
+        # Both rows of every friendship
+        self.assertEqual(Friendship.objects.filter(status='accepted').count(), 2 * 30 * 4 // 2)
+
+        # The dates spread over HISTORY instead of all being "now"
+        oldest = Post.objects.order_by('created_at').first()
+        self.assertLess(oldest.created_at, timezone.now() - timedelta(days=7))
+        self.assertEqual(oldest.updated_at, oldest.created_at)
+        self.assertEqual(Post.objects.filter(created_at__gt=timezone.now() - timedelta(minutes=1)).count(), 0)
+        self.assertFalse(Comment.objects.filter(created_at__lt=F('post__created_at')).exists())
+
+        # What bulk_create skipped is filled in
+        self.assertEqual(counters.reconcile(), 0)
+        located = Post.objects.exclude(geohash='')
+        self.assertGreater(located.count(), 100)
+        self.assertEqual(sum(HeatmapCell.objects.filter(precision=1).values_list('count', flat=True)),
+                         located.count())
+        word = Post.objects.first().caption.split()[-1]
+        matches, _ = search.filter_posts(Post.objects.all(), word)
+        self.assertEqual(set(matches.values_list('id', flat=True)),
+                         set(Post.objects.filter(caption__icontains=word).values_list('id', flat=True)))
+
+        with self.assertRaises(CommandError):
+            call_command('generate_data', users=2, posts=1, seed=7, stdout=io.StringIO())
+
+
+class ImportExportTests(TestCase):
+
+    def test_round_trip(self):
+        user = User.objects.create_user('alice', password='secret')
+        food = Topic.objects.create(name='food')
+        Post.objects.create(author=user, topic=food, caption='Night market', latitude=24.8, longitude=120.9)
+        Post.objects.create(author=user, caption='Somewhere')
+        fields = ('author__username', 'topic__name', 'caption', 'latitude', 'longitude', 'geohash', 'created_at')
+        exported = list(Post.objects.order_by('id').values(*fields))
+
+        for fmt in ('geojson', 'ndjson'):
+            with self.subTest(fmt), tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, f'posts.{fmt}')
+                call_command('export_posts', path, stdout=io.StringIO())
+                Post.objects.all().delete()
+                # Features cut across reads must still decode
+                with mock.patch.object(import_posts, 'READ_SIZE', 7):
+                    call_command('import_posts', path, stdout=io.StringIO())
+                self.assertEqual(list(Post.objects.order_by('id').values(*fields)), exported)
+                self.assertEqual(HeatmapCell.objects.filter(precision=1).get().count, 1)
+
+    def write_export(self, directory):
+        user = User.objects.create_user('alice', password='secret')
+        Post.objects.create(author=user, topic=Topic.objects.create(name='food'), caption='Night market',
+                            latitude=24.8, longitude=120.9)
+        Post.objects.update(created_at=timezone.now() - timedelta(days=3))
+        path = os.path.join(directory, 'posts.ndjson')
+        call_command('export_posts', path, stdout=io.StringIO())
+        Post.objects.all().delete()
+        return path
+
+    def test_import_leaves_auto_now_alone(self):
+        created_at = Post._meta.get_field('created_at')
+        updated_at = Post._meta.get_field('updated_at')
+        create = Post.objects.bulk_create
+        flags = []
+
+        def bulk_create(*args, **kwargs):
+            # Other threads saving posts at the same time see the same fields
+            flags.append((created_at.auto_now_add, updated_at.auto_now))
+            return create(*args, **kwargs)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = self.write_export(directory)
+            with mock.patch.object(Post.objects, 'bulk_create', bulk_create):
+                call_command('import_posts', path, stdout=io.StringIO())
+        self.assertEqual(flags, [(True, True)])
+        post = Post.objects.get()
+        self.assertEqual(post.created_at.date(), (timezone.now() - timedelta(days=3)).date())
+
+    def test_import_bumps_the_map_instead_of_clearing_the_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = self.write_export(directory)
+            cache.set('unrelated', 'kept')
+            x, y = geo.tile_for_point(24.8, 120.9, 10)
+            versions = (map_cache.tile_version(10, x, y), map_cache.tile_version(3, 0, 0),
+                        map_cache.posts_version(), fragments.versions(topics='topics')['topics'])
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command('import_posts', path, stdout=io.StringIO())
+        self.assertEqual(cache.get('unrelated'), 'kept')
+        bumped = (map_cache.tile_version(10, x, y), map_cache.tile_version(3, 0, 0),
+                  map_cache.posts_version(), fragments.versions(topics='topics')['topics'])
+        for before, after in zip(versions, bumped):
+            self.assertGreater(after, before)
+        # A later change to one tile still moves that tile on
+        map_cache.invalidate_point(24.8, 120.9)
+        self.assertGreater(map_cache.tile_version(10, x, y), bumped[0])
@@ -0,0 +1,115 @@
+"""
+Fan-out-on-write home timeline.
+
+When settings.TIMELINE_ENABLED is on, createPost copies each new post into
+the TimelineEntry table for its author and every friend, and the home feed
+reads one indexed range of the viewer's entries instead of an IN (...)
+over all friends' posts.
+
+Users with more than FANOUT_LIMIT friends are "heavy": copying their posts
+would mean thousands of rows per post, so their posts are not fanned out
+and readers merge them in at read time instead.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from . import friends
+from .models import Friendship, Post, TimelineEntry
+from .pagination import FEED_PAGE_SIZE, keyset_page
+
+# Authors with more friends than this are merged at read time.
+FANOUT_LIMIT = 1000
+# How many recent posts of a new friend are copied into a timeline.
+BACKFILL_LIMIT = 200
+# How long the set of heavy users is cached.
+HEAVY_USERS_TIMEOUT = 10 * 60
+HEAVY_USERS_KEY = 'timeline:heavy'
+
+BATCH_SIZE = 1000
+
+
+def enabled():
+    return settings.TIMELINE_ENABLED
+
+
+def heavy_user_ids():
+    """
+    Returns the ids of users whose posts are not fanned out.
+    """
+    heavy = cache.get(HEAVY_USERS_KEY)
+    if heavy is None:
+        # Accepting a request creates the reciprocal row too, so counting
+        # the accepted rows a user sent counts their friends.
+        heavy = set(
+            Friendship.objects.filter(status=Friendship.STATUS_ACCEPTED)
+            .values('from_user').annotate(friends=Count('id'))
+            .filter(friends__gt=FANOUT_LIMIT).values_list('from_user', flat=True)
+        )
+        cache.set(HEAVY_USERS_KEY, heavy, HEAVY_USERS_TIMEOUT)
+    return heavy
+
+
+def forget_heavy_users():
+    """
+    Drops the cached heavy user ids, for friendships created without the
+    views (bulk loads).
+    """
+    cache.delete(HEAVY_USERS_KEY)
+
+
+def _write(posts, owner_ids):
+    entries = [
+        TimelineEntry(owner_id=owner_id, post_id=post.id, author_id=post.author_id, created_at=post.created_at)
+        for post in posts for owner_id in owner_ids
+    ]
+    TimelineEntry.objects.bulk_create(entries, batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+
+def fan_out(post):
+    """
+    Copies a new post into the timelines of its author and, unless the
+    author is heavy, all of the author's friends.
+    """
+    if not enabled():
+        return
+    owner_ids = {post.author_id}
+    if post.author_id not in heavy_user_ids():
+        owner_ids |= friends.friend_ids(post.author_id)
+    _write([post], owner_ids)
+
+
+def backfill(owner_id, author_id, limit=BACKFILL_LIMIT):
+    """
+    Copies the most recent posts of `author_id` into the timeline of
+    `owner_id`, e.g. after they became friends.
+    """
+    if not enabled() or (owner_id != author_id and author_id in heavy_user_ids()):
+        return
+    posts = Post.objects.filter(author_id=author_id).only('id', 'author_id', 'created_at')[:limit]
+    _write(posts, [owner_id])
+
+
+def remove(owner_id, author_id):
+    """
+    Drops the posts of `author_id` from the timeline of `owner_id`.
+    """
+    TimelineEntry.objects.filter(owner_id=owner_id, author_id=author_id).delete()
+
+
+def posts_for(user_id, cursor=None, size=FEED_PAGE_SIZE):
+    """
+    Returns a Post queryset holding the user's next timeline page after
+    `cursor`: their timeline entries plus the posts of heavy friends.
+    Paginate it with keyset_page and the same cursor.
+    """
+    entries, _ = keyset_page(
+        TimelineEntry.objects.filter(owner_id=user_id).only('created_at', 'post_id'),
+        cursor, ordering=('-created_at', '-post_id'), size=size + 1,
+    )
+    visible = Q(id__in=[entry.post_id for entry in entries])
+    heavy_friends = friends.friend_ids(user_id) & heavy_user_ids()
+    if heavy_friends:
+        visible |= Q(author_id__in=heavy_friends)
+    return Post.objects.filter(visible)
@@ -7,6 +7,7 @@ urlpatterns = [
     path('register/', views.registerPage, name="register"),
 
     path('', views.home, name="home"),
+    path('feed/', views.feed_page, name="feed-page"),
     path('post/<int:pk>/', views.post, name="post"),
     path('profile/<int:pk>/', views.userProfile, name="user-profile"),
 
@@ -24,5 +25,15 @@ urlpatterns = [
 
     path('map/', views.map_page_view, name='map-page'),
     path('api/posts/', views.get_all_posts_api, name='api-get-posts'),
+    path('api/posts/<int:pk>/', views.get_post_api, name='api-get-post'),
+    path('api/posts/events/', views.post_events_api, name='api-post-events'),
+    path('api/posts/nearby/', views.nearby_posts_api, name='api-nearby-posts'),
+    path('api/heatmap/', views.heatmap_api, name='api-heatmap'),
+    path('api/tiles/<int:z>/<int:x>/<int:y>/', views.get_tile_api, name='api-get-tile'),
+
+    # Stored request profiles, staff only
+    path('profiles/', views.profile_list, name='profile-list'),
+    path('profiles/<str:profile_id>/', views.profile_detail, name='profile-detail'),
+    path('profiles/<str:profile_id>/download/', views.profile_download, name='profile-download'),
 ]
  
\ No newline at end of file
@@ -1,16 +1,33 @@
-from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponse
+import asyncio
+import hashlib
+import json
+import math
+from datetime import date, datetime, timezone as dt_timezone
+from urllib.parse import urlencode
+
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
+from django.http import FileResponse, HttpResponse, Http404, StreamingHttpResponse
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
 from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q, Count
+from django.db import transaction
+from django.db.models import Q, Count, Avg, Max, Sum
+from django.db.models.functions import Substr
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate, login, logout, get_user_model
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
-from .models import Post, Topic, Comment, Like, Friendship
+from .models import HeatmapCell, Post, Topic, Comment, Like, Friendship
 from .forms import PostForm, UserForm
+from . import columnar, counters, events, exif, fragments, friends, geo, heatmap, images, jobs, map_cache, profiling, search, timeline
+from .pagination import akeyset_page, keyset_page
 from django.http import JsonResponse
-from django.utils.timesince import timesince
-from django.utils import timezone
+from django.template.loader import render_to_string
 
 def loginPage(request):
 
@@ -58,56 +75,127 @@ def registerPage(request):
             messages.error(request, 'An error occurred during regisretion.')
     return render(request, 'core/login_register.html',  {'form': form})
 
+# How long the "N Memories available" total may be stale.
+FEED_COUNT_TIMEOUT = 5 * 60
+
+
+def _feed_posts(user_id, q):
+    """
+    Returns the posts the user may see (their own and their friends'),
+    filtered by the search term `q`, and the ordering to page them with.
+    """
+    # The user's accepted friends plus the user themselves
+    allowed_user_ids = friends.friend_ids(user_id) | {user_id}
+
+    posts = Post.objects.filter(author__id__in=allowed_user_ids)
+    ordering = ('-created_at', '-id')
+    if q:
+        posts, ordering = search.filter_posts(posts, q)
+    return _feed_columns(posts), ordering
+
+
+def _feed_columns(posts):
+    """
+    Loads only what feed_component.html renders, with the author and topic
+    in the same query.
+    """
+    return posts.select_related('author', 'topic').only(
+        'caption', 'created_at', 'comment_count', 'author__username', 'topic__name'
+    )
+
+
+def _activity_comments(comments):
+    """
+    Loads what activity_component.html renders. Comment.__str__ and
+    Post.__str__ both reach for the author, so those are joined too.
+    """
+    return comments.select_related('author', 'post__author')
+
+
+def _feed_count(request, q, posts):
+    """
+    The total shown above the feed. Counting every visible post on each
+    page view is expensive, so the number is cached for a few minutes.
+    """
+    key = 'feed:count:{}:{}'.format(request.user.id, hashlib.md5(q.encode()).hexdigest())
+    return cache.get_or_set(key, posts.count, FEED_COUNT_TIMEOUT)
+
+
+def _feed_query(user_id, q, cursor=None, visible=None):
+    """
+    Returns (posts, ordering) to page the home feed after `cursor` with.
+    Plain feeds come from the fan-out timeline when it is enabled; searches
+    and the fallback filter all visible posts at read time. Pass what
+    _feed_posts returned for the same user and `q` as `visible` when it is
+    at hand already.
+    """
+    if timeline.enabled() and not q:
+        return _feed_columns(timeline.posts_for(user_id, cursor)), ('-created_at', '-id')
+    return visible or _feed_posts(user_id, q)
+
+
 @login_required
 def home(request):
     q = request.GET.get('q') if request.GET.get('q') != None else ''
 
-    # 1. Get a list of the user's friends
-    # We query where the status is 'accepted' from either side of the relationship
-    friends_sent = Friendship.objects.filter(from_user=request.user, status='accepted').values_list('to_user_id', flat=True)
-    friends_received = Friendship.objects.filter(to_user=request.user, status='accepted').values_list('from_user_id', flat=True)
-    friend_ids = list(friends_sent) + list(friends_received)
-
-    # 2. Include the user's own ID
-    allowed_user_ids = friend_ids + [request.user.id]
-
-    # Optimized query using select_related and prefetch_related
-    posts = Post.objects.filter(
-        author__id__in=allowed_user_ids
-    ).filter(
-        Q(topic__name__icontains=q)|
-        Q(caption__icontains=q)
-    ).select_related('author', 'topic').prefetch_related('likes')
+    visible = _feed_posts(request.user.id, q)
+    posts = visible[0]
+    feed, ordering = _feed_query(request.user.id, q, visible=visible)
+    page, next_cursor = keyset_page(feed, None, ordering)
 
     topics = Topic.objects.all()[0:5]
-    post_count = posts.count()
-    # This comment query would also need to be restricted
-    post_comments = Comment.objects.filter(post__in=posts)
+    post_count = _feed_count(request, q, posts)
 
     # For activity feed, let's show comments on posts the user can see
-    post_comments = Comment.objects.filter(
-        post__in=posts).select_related('author', 'post').order_by('-created_at')[:5]
+    post_comments = _activity_comments(Comment.objects.filter(
+        post__in=posts)).order_by('-created_at')[:5]
 
-    context = {'posts':posts, 'topics': topics, 'post_count': post_count,
-                'post_comments': post_comments}
+    context = {'posts': fragments.attach(page), 'next_cursor': next_cursor, 'q': q, 'topics': topics,
+                'post_count': post_count, 'post_comments': post_comments,
+                **fragments.context(topics='topics', feed=f'feed:{request.user.id}')}
     return render(request, 'core/home.html', context)
 
+@login_required
+async def feed_page(request):
+    """
+    Returns the next page of the home feed for infinite scrolling: the
+    rendered posts as HTML plus the cursor of the page after it.
+    """
+    user = await request.auser()
+    q = request.GET.get('q', '')
+    cursor = request.GET.get('cursor')
+    try:
+        # The friend graph and timeline lookups are cached sync helpers,
+        # the page itself is read with the async ORM.
+        posts, ordering = await sync_to_async(_feed_query)(user.id, q, cursor)
+        page, next_cursor = await akeyset_page(posts, cursor, ordering)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+
+    context = {'posts': await fragments.aattach(page), 'fragment_timeout': fragments.FRAGMENT_TIMEOUT}
+    html = render_to_string('core/feed_component.html', context, request=request)
+    return JsonResponse({'html': html, 'next_cursor': next_cursor})
+
 def post(request,pk):
-    # Use prefetch_related for efficiency even on a single object
-    post = get_object_or_404(Post.objects.prefetch_related(
-        'comments__author', 'likes'
-    ), id=pk)
-    post_comments = post.comments.all()
+    post = get_object_or_404(Post.objects.select_related('author', 'topic'), id=pk)
+    # Only evaluated when the cached comment thread has to be rendered again
+    post_comments = post.comments.select_related('author')
+    user_has_liked = request.user.is_authenticated and Like.objects.filter(post=post, user=request.user).exists()
 
     if request.method == 'POST':
-        Comment.objects.create(
-            author = request.user,
-            post = post,
-            text = request.POST.get('text')
-        )
+        with transaction.atomic():
+            Comment.objects.create(
+                author = request.user,
+                post = post,
+                text = request.POST.get('text')
+            )
+            counters.adjust(post.id, comment_count=1)
+        # The comment count is part of the map pin
+        map_cache.invalidate_point(post.latitude, post.longitude)
         return redirect('post', pk=post.id)
 
-    context = {'post': post, 'post_comments': post_comments,} 
+    context = {'post': post, 'post_comments': post_comments, 'user_has_liked': user_has_liked,
+               **fragments.context(post=f'post:{post.id}')}
     return render(request, 'core/post.html', context)
 
 def userProfile(request, pk):
@@ -116,23 +204,13 @@ def userProfile(request, pk):
     # Friendship status logic
     friendship_status = None
     if request.user.is_authenticated and request.user != user:
-        # Check if a request was sent from the logged-in user to the profile user
-        sent_request = Friendship.objects.filter(from_user=request.user, to_user=user).first()
-        # Check if a request was received by the logged-in user from the profile user
-        received_request = Friendship.objects.filter(from_user=user, to_user=request.user).first()
-
-        if sent_request:
-            friendship_status = sent_request.status
-        elif received_request:
-            # If a request was received, show its status but give options to accept/decline
-            friendship_status = received_request.status
-            if received_request.status == 'pending':
-                friendship_status = 'received_pending' # A custom status for the template
-
-    posts = user.post_set.all().prefetch_related('likes')
-    post_comments = user.comment_set.all()
+        friendship_status = friends.relationship(request.user.id, user.id)
+
+    posts = fragments.attach(list(_feed_columns(user.post_set.all())))
+    post_comments = _activity_comments(user.comment_set.all())
     topics = Topic.objects.all()
-    context = {'user': user, 'posts': posts, 'post_comments': post_comments, 'topics': topics, 'friendship_status': friendship_status}
+    context = {'user': user, 'posts': posts, 'post_comments': post_comments, 'topics': topics, 'friendship_status': friendship_status,
+               **fragments.context(topics='topics', user=f'user:{user.id}')}
     return render(request, 'core/profile.html', context)
 
 
@@ -146,10 +224,16 @@ def createPost(request):
         if form.is_valid():
             post = form.save(commit=False)
             post.author = request.user
+            if 'photo' in request.FILES:
+                # Geotag from the photo when the form came without a location
+                post.apply_photo_metadata(exif.read(request.FILES['photo']))
             topic_name = request.POST.get('topic')
             topic, _ = Topic.objects.get_or_create(name=topic_name)
             post.topic = topic
             post.save()
+            if post.photo:
+                jobs.enqueue('photo_variants', post_id=post.id)
+            timeline.fan_out(post)
             return redirect('home')
         
 
@@ -168,10 +252,29 @@ def updatePost(request, pk):
         form = PostForm(request.POST, request.FILES, instance=post)
         if form.is_valid():
             post = form.save(commit=False)
+            if 'photo' in request.FILES:
+                post.apply_photo_metadata(exif.read(request.FILES['photo']))
             topic_name = request.POST.get('topic')
             topic, _ = Topic.objects.get_or_create(name=topic_name)
             post.topic = topic
-            post.save()
+            # Only the edited columns, so likes, comments and photo variants
+            # written since the post was loaded are kept
+            fields = [*PostForm.Meta.fields, 'topic', 'taken_at', 'updated_at']
+            if 'photo' in form.changed_data:
+                # The variants show the previous photo, fall back to the new
+                # original until the job has resized it
+                stale = [getattr(post, field) for field in images.VARIANTS if getattr(post, field)]
+                for field in images.VARIANTS:
+                    setattr(post, field, None)
+                fields += images.VARIANTS
+            post.save(update_fields=fields)
+            if 'photo' in form.changed_data:
+                def delete_stale():
+                    for variant in stale:
+                        variant.storage.delete(variant.name)
+
+                transaction.on_commit(delete_stale)
+                jobs.enqueue('photo_variants', post_id=post.id)
             return redirect('home')
         
     context = {'form': form, 'topics': topics, 'post': post}
@@ -193,11 +296,15 @@ def deletePost(request, pk):
 def like_post(request, post_id):
     if request.method == 'POST':
         post = get_object_or_404(Post, id=post_id)
-        like, created = Like.objects.get_or_create(user=request.user, post=post)
-
-        if not created:
-            # If the like already existed, delete it (unlike).
-            like.delete()
+        with transaction.atomic():
+            like, created = Like.objects.get_or_create(user=request.user, post=post)
+
+            if created:
+                counters.adjust(post.id, like_count=1)
+            else:
+                # If the like already existed, delete it (unlike).
+                like.delete()
+                counters.adjust(post.id, like_count=-1)
     return redirect(request.META.get('HTTP_REFERER', 'home'))
 
 @login_required(login_url='login')
@@ -218,6 +325,9 @@ def manage_friend_request(request, user_id, action):
         friend_request.save()
         # Optional: Create a reciprocal friendship for easier querying
         Friendship.objects.get_or_create(from_user=request.user, to_user=from_user, defaults={'status': 'accepted'})
+        # Show each other's recent posts in the new friend's timeline
+        timeline.backfill(request.user.id, from_user.id)
+        timeline.backfill(from_user.id, request.user.id)
     elif action == 'decline':
         friend_request.delete() # Or set status to 'declined' if you want to keep the record
 
@@ -229,8 +339,15 @@ def remove_friend(request, user_id):
     # Delete the friendship records from both sides
     Friendship.objects.filter(from_user=request.user, to_user=friend_to_remove).delete()
     Friendship.objects.filter(from_user=friend_to_remove, to_user=request.user).delete()
+    timeline.remove(request.user.id, friend_to_remove.id)
+    timeline.remove(friend_to_remove.id, request.user.id)
     return redirect('user-profile', pk=user_id)
 
+def _is_asgi(request):
+    # Served by GeoMemories/asgi.py rather than a WSGI worker
+    return isinstance(request, ASGIRequest)
+
+
 def map_page_view(request):
     """
     This view just renders the map page template. The actual
@@ -241,36 +358,561 @@ def map_page_view(request):
     context = {
         'initial_lat': 24.8138,
         'initial_lon': 120.9675,
+        # Live updates need the ASGI server, see post_events_api
+        'live_updates': _is_asgi(request),
     }
     return render(request, 'core/map_page.html', context)
 
-def get_all_posts_api(request):
+# Hard cap on the number of pins returned for a single viewport.
+MAP_MAX_POSTS = 2000
+
+# Below this zoom level the map API returns clusters instead of single posts.
+CLUSTER_MAX_ZOOM = 16
+
+
+def _parse_bbox(value):
     """
-    This is an API endpoint that returns all posts as JSON.
-    The frontend JavaScript will call this URL to get the pin data.
+    Parses a Leaflet `toBBoxString()` value: "west,south,east,north".
+    """
+    west, south, east, north = (float(part) for part in value.split(','))
+    if not all(math.isfinite(v) for v in (west, south, east, north)):
+        raise ValueError('bbox must be finite')
+    return west, south, east, north
+
+
+def _geohash_q(ranges, field='geohash'):
+    """
+    Builds a filter matching rows whose geohash (or geohash prefix, in
+    `field`) falls in any of the given (low, high) ranges from
+    geo.prefix_ranges.
+    """
+    cells = Q()
+    for low, high in ranges:
+        cell = Q(**{f'{field}__gte': low})
+        if high is not None:
+            cell &= Q(**{f'{field}__lt': high})
+        cells |= cell
+    return cells
+
+
+def _in_bbox(posts, bbox):
     """
-    posts = Post.objects.filter(
+    Restricts a Post queryset to a bounding box. The geohash ranges narrow the
+    lookup down to an index range scan, the coordinate filter trims the
+    edges of the covering cells.
+    """
+    west, south, east, north = bbox
+    cells = _geohash_q(geo.bbox_ranges(west, south, east, north))
+
+    coords = Q()
+    for box_south, box_west, box_north, box_east in geo.split_bbox(west, south, east, north):
+        coords |= Q(latitude__gte=box_south, latitude__lte=box_north,
+                    longitude__gte=box_west, longitude__lte=box_east)
+    return posts.filter(cells).filter(coords)
+
+
+def _post_pin(post):
+    """
+    Serializes a post for a map pin.
+    """
+    return {
+        "id": post.id,
+        "author": post.author.username,
+        "author_id": post.author.id,
+        "caption": post.caption,
+        "topic": post.topic.name if post.topic else '',
+        "comments_count": post.comment_count,
+        "created_at": post.created_at,
+        "photo_url": post.photo_thumb_url,
+        "lat": post.latitude,
+        "lon": post.longitude
+    }
+
+
+# Rows fetched per database round trip (and written per chunk) when streaming.
+STREAM_CHUNK_SIZE = 2000
+
+
+def _pin_row(row, storage):
+    """
+    Same as _post_pin, for a row of _stream_pins' values() query.
+    """
+    photo = row['photo_thumb'] or row['photo']
+    return {
+        "id": row['id'],
+        "author": row['author__username'],
+        "author_id": row['author_id'],
+        "caption": row['caption'],
+        "topic": row['topic__name'] or '',
+        "comments_count": row['comment_count'],
+        "created_at": row['created_at'],
+        "photo_url": storage.url(photo) if photo else '',
+        "lat": row['latitude'],
+        "lon": row['longitude']
+    }
+
+
+def _stream_rows():
+    return Post.objects.filter(
         latitude__isnull=False, longitude__isnull=False
-    ).select_related('author', 'topic').annotate(
-        comments_count=Count('comments')
+    ).values(
+        'id', 'author__username', 'author_id', 'caption', 'topic__name', 'comment_count',
+        'created_at', 'photo', 'photo_thumb', 'latitude', 'longitude',
+    )
+
+
+def _stream_pins():
+    """
+    Yields the JSON array of every geotagged post a chunk at a time, so
+    memory stays flat however many posts there are. For WSGI workers, which
+    can only consume a sync iterator without buffering it whole.
+    """
+    storage = Post._meta.get_field('photo').storage
+    encoder = DjangoJSONEncoder()
+    yield '['
+    chunk = []
+    separator = ''
+    for row in _stream_rows().iterator(chunk_size=STREAM_CHUNK_SIZE):
+        chunk.append(separator + encoder.encode(_pin_row(row, storage)))
+        separator = ','
+        if len(chunk) == STREAM_CHUNK_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+    yield ''.join(chunk) + ']'
+
+
+async def _astream_pins():
+    """
+    Async version of _stream_pins, for the ASGI server.
+    """
+    storage = Post._meta.get_field('photo').storage
+    encoder = DjangoJSONEncoder()
+    yield '['
+    chunk = []
+    separator = ''
+    async for row in _stream_rows().aiterator(chunk_size=STREAM_CHUNK_SIZE):
+        chunk.append(separator + encoder.encode(_pin_row(row, storage)))
+        separator = ','
+        if len(chunk) == STREAM_CHUNK_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+    yield ''.join(chunk) + ']'
+
+
+async def _clusters(posts, zoom):
+    """
+    Groups posts into geohash cells sized for `zoom`. Each cell becomes one
+    cluster point with its post count, centroid and newest post. Cells that
+    hold a single post are returned as that post's regular pin.
+    """
+    precision = geo.cluster_precision(zoom)
+    cells = posts.order_by().values(
+        cell=Substr('geohash', 1, precision)
+    ).annotate(
+        count=Count('id'),
+        lat=Avg('latitude'),
+        lon=Avg('longitude'),
+        post_id=Max('id'),
     )
 
-    now = timezone.now()
-    # Create a list of dictionaries, with each dictionary representing a post.
-    post_data = [
-        {
-            "id": post.id,
-            "author": post.author.username,
-            "author_id": post.author.id,
-            "caption": post.caption,
-            "topic": post.topic.name,
-            "comments_count": post.comments_count,
-            "created_ago": timesince(post.created_at, now) + " ago",
-            "photo_url": post.photo.url if post.photo else '',
-            "lat": post.latitude,
-            "lon": post.longitude
-        }
-        for post in posts
-    ]
-
-    return JsonResponse(post_data, safe=False)
\ No newline at end of file
+    clusters = []
+    single_ids = []
+    async for cell in cells:
+        if cell['count'] == 1:
+            single_ids.append(cell['post_id'])
+        else:
+            clusters.append({
+                "cluster": True,
+                "count": cell['count'],
+                "lat": cell['lat'],
+                "lon": cell['lon'],
+                "post_id": cell['post_id'],
+            })
+
+    singles = Post.objects.filter(id__in=single_ids).select_related('author', 'topic')
+    return clusters + [_post_pin(post) async for post in singles]
+
+
+def _map_format(request):
+    """
+    Returns the payload format asked for with `format=`: "json" for the
+    plain list of pins, or the compact "columnar" encoding.
+    """
+    fmt = request.GET.get('format', 'json')
+    if fmt not in ('json', columnar.FORMAT):
+        raise ValueError('format must be "json" or "columnar"')
+    return fmt
+
+
+def _map_payload(fmt, items):
+    return columnar.encode(items) if fmt == columnar.FORMAT else items
+
+
+async def _map_items(bbox, zoom):
+    """
+    Returns the pins (or clusters, when zoomed out) inside a bounding box.
+    """
+    posts = _in_bbox(Post.objects.filter(
+        latitude__isnull=False, longitude__isnull=False
+    ), bbox)
+    if zoom is not None and zoom < CLUSTER_MAX_ZOOM:
+        return await _clusters(posts, zoom)
+
+    posts = posts.select_related('author', 'topic')[:MAP_MAX_POSTS]
+    return [_post_pin(post) async for post in posts]
+
+
+# How long a serialized posts API response is kept. It is keyed by the posts
+# version and pins carry created_at rather than "x minutes ago" texts, so it
+# never goes stale; this only lets unused bodies expire.
+POSTS_CACHE_TIMEOUT = 60 * 60
+
+
+def _posts_etag(request):
+    return f'posts-{map_cache.posts_version()}'
+
+
+def _posts_last_modified(request):
+    return datetime.fromtimestamp(map_cache.posts_version() / 1e9, tz=dt_timezone.utc)
+
+
+def _posts_query(request):
+    # The same viewport in a different parameter order is the same response.
+    return urlencode(sorted(request.GET.lists()), doseq=True)
+
+
+@condition(etag_func=_posts_etag, last_modified_func=_posts_last_modified)
+async def get_all_posts_api(request):
+    """
+    This is an API endpoint that returns posts as JSON.
+    The frontend JavaScript will call this URL to get the pin data.
+
+    With a `bbox` parameter ("west,south,east,north") only the posts inside
+    that viewport are returned, newest first, up to MAP_MAX_POSTS. When a
+    `zoom` below CLUSTER_MAX_ZOOM is given as well, nearby posts are merged
+    into cluster points (see _clusters).
+
+    Without a bbox, `stream=1` streams every post instead of building the
+    whole list in memory; streamed responses are not cached.
+
+    `format=columnar` returns the compact encoding described in
+    core/columnar.py; the popup texts are then loaded from get_post_api.
+
+    Responses carry an ETag and Last-Modified taken from the posts version
+    (bumped from core.signals), so an unchanged map revalidates with a
+    304, and the serialized body is cached under that version.
+    """
+    try:
+        fmt = _map_format(request)
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    bbox = request.GET.get('bbox')
+    if bbox:
+        try:
+            bbox = _parse_bbox(bbox)
+            zoom = int(request.GET['zoom']) if request.GET.get('zoom') else None
+        except ValueError:
+            return JsonResponse({'error': 'bbox must be "west,south,east,north" and zoom an integer'}, status=400)
+    elif request.GET.get('stream') and fmt == 'json':
+        stream = _astream_pins() if _is_asgi(request) else _stream_pins()
+        response = StreamingHttpResponse(stream, content_type='application/json')
+        patch_cache_control(response, no_cache=True)
+        return response
+
+    key = map_cache.posts_body_key(map_cache.posts_version(), _posts_query(request))
+    body = await cache.aget(key)
+    if body is None:
+        if bbox:
+            post_data = await _map_items(bbox, zoom)
+        else:
+            posts = Post.objects.filter(
+                latitude__isnull=False, longitude__isnull=False
+            ).select_related('author', 'topic')
+
+            # Create a list of dictionaries, with each dictionary representing a post.
+            post_data = [_post_pin(post) async for post in posts]
+        body = json.dumps(_map_payload(fmt, post_data), cls=DjangoJSONEncoder)
+        await cache.aset(key, body, POSTS_CACHE_TIMEOUT)
+
+    response = HttpResponse(body, content_type='application/json')
+    # Let browsers keep the payload but always revalidate it.
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+async def get_post_api(request, pk):
+    """
+    Returns the pin of a single post, which the map uses to fill in the
+    popup of a columnar marker when it is first shown.
+    """
+    post = await aget_object_or_404(Post.objects.select_related('author', 'topic'), id=pk)
+    return JsonResponse(_post_pin(post))
+
+
+# Seconds between keep-alive comments on an idle event stream, so proxies
+# do not time the connection out.
+EVENTS_HEARTBEAT = 15
+
+
+async def _event_stream(bbox):
+    subscription = events.subscribe(bbox)
+    queue = subscription.queue
+    try:
+        # Ask the browser to reconnect quickly when the connection drops
+        yield 'retry: 3000\n\n'
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), EVENTS_HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield ': keep-alive\n\n'
+                continue
+            if subscription.lagged:
+                # Events were dropped, have the map reload its pins instead
+                while not queue.empty():
+                    queue.get_nowait()
+                subscription.lagged = False
+                yield 'event: resync\ndata: {}\n\n'
+                continue
+            yield f'event: {event["type"]}\ndata: {json.dumps(event)}\n\n'
+    finally:
+        events.unsubscribe(subscription)
+
+
+async def post_events_api(request):
+    """
+    Server-Sent Events stream of the posts created, moved or deleted inside
+    the `bbox` viewport ("west,south,east,north", the whole world when it is
+    left out). Each event carries the post id, its position and, when it
+    moved, its "previous" one; the map refreshes the tiles at those points.
+
+    Idle streams are just a queue waiting on the event loop, so this needs
+    the ASGI server (see GeoMemories/asgi.py). Under WSGI every open stream
+    would hold a worker thread, so it answers 204 No Content there, which
+    tells EventSource not to reconnect.
+    """
+    if not _is_asgi(request):
+        return HttpResponse(status=204)
+    bbox = request.GET.get('bbox')
+    if bbox:
+        try:
+            bbox = _parse_bbox(bbox)
+        except ValueError:
+            return JsonResponse({'error': 'bbox must be "west,south,east,north"'}, status=400)
+
+    response = StreamingHttpResponse(_event_stream(bbox or None), content_type='text/event-stream')
+    patch_cache_control(response, no_cache=True)
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@condition(etag_func=_posts_etag, last_modified_func=_posts_last_modified)
+async def heatmap_api(request):
+    """
+    Returns post density inside the `bbox` viewport as [lat, lon, count]
+    points, one per geohash cell, read from the HeatmapCell aggregate (see
+    core.heatmap). The cell size follows `zoom`, or an explicit `precision`,
+    and gets coarser when the viewport would need too many cells. Optional
+    `topic` (a name) and `since`/`until` (inclusive YYYY-MM-DD dates)
+    narrow the posts counted.
+    """
+    try:
+        bbox = _parse_bbox(request.GET['bbox'])
+        if request.GET.get('precision'):
+            requested = int(request.GET['precision'])
+        else:
+            requested = geo.cluster_precision(int(request.GET['zoom'])) + 1
+        since = date.fromisoformat(request.GET['since']) if request.GET.get('since') else None
+        until = date.fromisoformat(request.GET['until']) if request.GET.get('until') else None
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'bbox and zoom (or precision) are required, since/until must be YYYY-MM-DD'},
+                            status=400)
+    if requested < 1:
+        return JsonResponse({'error': 'precision must be positive'}, status=400)
+
+    precision = heatmap.precision_for(bbox, requested)
+    cells = HeatmapCell.objects.filter(precision=precision).filter(
+        _geohash_q(geo.bbox_ranges(*bbox, max_precision=precision), field='cell')
+    )
+    if request.GET.get('topic'):
+        cells = cells.filter(topic__name=request.GET['topic'])
+    if since:
+        cells = cells.filter(day__gte=since)
+    if until:
+        cells = cells.filter(day__lte=until)
+    cells = cells.order_by().values('cell').annotate(total=Sum('count')).filter(total__gt=0)
+
+    points = [[*geo.cell_center(row['cell']), row['total']] async for row in cells]
+    response = JsonResponse({
+        'precision': precision,
+        'max': max((point[2] for point in points), default=0),
+        'points': points,
+    })
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+# Default and maximum number of posts returned by the nearby endpoint.
+NEARBY_DEFAULT_K = 20
+NEARBY_MAX_K = 100
+# Geohash precision of the first (smallest) search ring, about 150m across.
+NEARBY_START_PRECISION = 7
+# Rings tried at each precision before moving to coarser cells, in cells
+# around the point's own: 3x3, 5x5 and 7x7 blocks. A coarser cell is 4 to 8
+# times wider, so this keeps each step a few times larger than the last.
+NEARBY_RING_RADII = (1, 2, 3)
+
+
+async def _distances(posts, lat, lon, radius_km):
+    # order_by(): the default -created_at ordering would have SQLite walk
+    # the created_at index instead of the geohash ranges
+    hits = sorted([
+        (geo.haversine_km(lat, lon, row_lat, row_lon), post_id)
+        async for post_id, row_lat, row_lon in posts.order_by().values_list('id', 'latitude', 'longitude')
+    ])
+    if radius_km is not None:
+        hits = [hit for hit in hits if hit[0] <= radius_km]
+    return hits
+
+
+async def _nearest(posts, lat, lon, k, radius_km=None):
+    """
+    Returns up to `k` (distance_km, post_id) pairs closest to a point.
+
+    Looks at the 3x3 block of geohash cells around the point and widens it
+    a ring of cells at a time, then at coarser precisions, until it holds
+    `k` posts. If the k-th is closer than anything outside the block can be
+    (geo.ring_radius_km) those are the answer; otherwise nothing outside a
+    box around the point with the k-th distance as radius can be closer,
+    and one query over that box settles it. Distances are refined with
+    haversine, so only the candidate rows are ever loaded.
+    """
+    for precision in range(NEARBY_START_PRECISION, 0, -1):
+        for radius in NEARBY_RING_RADII:
+            ranges = geo.prefix_ranges(geo.ring_prefixes(lat, lon, precision, radius))
+            hits = await _distances(posts.filter(_geohash_q(ranges)), lat, lon, radius_km)
+            safe_km = geo.ring_radius_km(lat, precision, radius)
+            if len(hits) >= k:
+                if hits[k - 1][0] <= safe_km:
+                    return hits[:k]
+                bbox = geo.radius_bbox(lat, lon, hits[k - 1][0])
+                return (await _distances(_in_bbox(posts, bbox), lat, lon, radius_km))[:k]
+            if radius_km is not None and radius_km <= safe_km:
+                return hits
+            if not hits:
+                break  # nothing around at all, go straight to coarser cells
+
+    # Fewer than k posts in the coarsest block, which spans most of the
+    # globe. Anything left is in the few cells it missed, or beyond radius_km.
+    if radius_km is not None:
+        posts = _in_bbox(posts, geo.radius_bbox(lat, lon, radius_km))
+    return (await _distances(posts, lat, lon, radius_km))[:k]
+
+
+async def nearby_posts_api(request):
+    """
+    Returns the `k` posts closest to `lat`/`lon`, nearest first, each with a
+    `distance_km`. Optional `radius_km` caps the distance and `topic`
+    restricts the results to one topic name.
+    """
+    try:
+        lat = float(request.GET['lat'])
+        lon = float(request.GET['lon'])
+        k = int(request.GET.get('k', NEARBY_DEFAULT_K))
+        radius_km = float(request.GET['radius_km']) if request.GET.get('radius_km') else None
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'lat and lon are required, k and radius_km must be numbers'}, status=400)
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180) or not 1 <= k <= NEARBY_MAX_K \
+            or (radius_km is not None and not radius_km > 0):
+        return JsonResponse({'error': f'lat/lon out of range, k must be 1-{NEARBY_MAX_K}, radius_km positive'}, status=400)
+
+    posts = Post.objects.filter(latitude__isnull=False, longitude__isnull=False)
+    topic = request.GET.get('topic')
+    if topic:
+        posts = posts.filter(topic__name=topic)
+
+    hits = await _nearest(posts, lat, lon, k, radius_km)
+    found = await Post.objects.filter(id__in=[post_id for _, post_id in hits]).select_related(
+        'author', 'topic'
+    ).ain_bulk()
+
+    post_data = []
+    for distance, post_id in hits:
+        if post_id not in found:
+            continue  # deleted in the meantime
+        pin = _post_pin(found[post_id])
+        pin['distance_km'] = round(distance, 3)
+        post_data.append(pin)
+    return JsonResponse(post_data, safe=False)
+
+
+# How long browsers and CDNs may reuse a tile before revalidating it.
+TILE_MAX_AGE = 60
+# How long a rendered tile body stays in the cache.
+TILE_CACHE_TIMEOUT = 60 * 60
+
+
+def _tile_etag(request, z, x, y):
+    return f'{z}-{x}-{y}-{map_cache.tile_version(z, x, y)}'
+
+
+@condition(etag_func=_tile_etag)
+async def get_tile_api(request, z, x, y):
+    """
+    Serves the pins (or clusters) inside one slippy map tile. Tiles are
+    addressed like OSM raster tiles so the map can load them in parallel,
+    and they carry a strong ETag that only changes when a post inside the
+    tile changes (see core.signals). Like the posts API they
+    accept `format=columnar`.
+    """
+    if z > map_cache.TILE_MAX_ZOOM or x >= 1 << z or y >= 1 << z:
+        raise Http404('No such tile')
+    try:
+        fmt = _map_format(request)
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+
+    version = map_cache.tile_version(z, x, y)
+    key = map_cache.tile_body_key(z, x, y, version, fmt)
+    body = await cache.aget(key)
+    if body is None:
+        items = await _map_items(geo.tile_bounds(z, x, y), z)
+        body = json.dumps(_map_payload(fmt, items), cls=DjangoJSONEncoder)
+        await cache.aset(key, body, TILE_CACHE_TIMEOUT)
+
+    response = HttpResponse(body, content_type='application/json')
+    patch_cache_control(response, public=True, max_age=TILE_MAX_AGE)
+    return response
+
+
+# Orders the profile page can be sorted by, see pstats.SortKey.
+PROFILE_SORTS = ('cumulative', 'tottime', 'calls')
+
+
+@staff_member_required
+def profile_list(request):
+    return render(request, 'core/profiles.html', {'profiles': profiling.listing()})
+
+
+@staff_member_required
+def profile_detail(request, profile_id):
+    sort = request.GET.get('sort', 'cumulative')
+    if sort not in PROFILE_SORTS:
+        sort = 'cumulative'
+    try:
+        details = profiling.load(profile_id)
+        report = profiling.report(profile_id, sort)
+    except FileNotFoundError:
+        raise Http404('No such profile')
+    return render(request, 'core/profile_detail.html', {
+        'profile': details, 'report': report, 'sort': sort, 'sorts': PROFILE_SORTS,
+    })
+
+
+@staff_member_required
+def profile_download(request, profile_id):
+    try:
+        path = profiling.prof_path(profile_id)
+    except FileNotFoundError:
+        raise Http404('No such profile')
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=f'{profile_id}.prof')
@@ -0,0 +1,21 @@
+"""
+Entry points for the `run_jobs` worker processes.
+
+Worker processes are started fresh, so this module must be importable
+before Django is set up: everything that touches models is imported
+inside the functions.
+"""
+
+import django
+
+
+def setup():
+    """
+    Process pool initializer, every worker process needs its own Django.
+    """
+    django.setup()
+
+
+def execute(name, payload):
+    from . import jobs
+    jobs.execute(name, payload)